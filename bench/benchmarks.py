@@ -0,0 +1,474 @@
+"""
+Benchmark definitions.
+
+Each benchmark is registered with ``@benchmark(name, suites)``. Its function
+receives the ``Workspace`` and does any setup, then returns the callable
+that is actually timed. Fixtures are generated once per workspace and
+reused, so a kept ``--workdir`` makes nightly runs cheap to set up.
+"""
+import contextlib
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from fseq import FseqFile, COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_ZSTD
+from audio import probe_wav, probe_mp3
+from utils import find_all_shows
+from show_index import ShowIndex
+from validate import validate_sequence, validate_show, check_channels
+from package import package_show, package_image
+from list_shows import list_shows, find_shows, show_previews
+from preview import PreviewCache
+from show import Show
+from bundle import bundle_shows
+from diff import diff_sequences
+from convert import convert_sequence
+from effects import Timeline
+from analyze import analyze_sync
+from serve import receive_show
+from generators import (
+    make_fseq, make_wav, make_mp3, make_show, make_shows_tree, make_beat_show,
+    frames_for_size
+)
+
+MB = 1024 * 1024
+
+QUICK = ('quick', 'full')
+FULL = ('full',)
+
+
+class Benchmark(NamedTuple):
+    """A registered benchmark."""
+    name: str
+    prepare: Callable      # prepare(workspace) -> callable to time
+    suites: Tuple[str, ...]
+    budget: Optional[float] = None   # seconds the fastest run must stay under
+
+
+BENCHMARKS: List[Benchmark] = []
+
+
+def benchmark(name: str, suites: Tuple[str, ...] = QUICK, budget: Optional[float] = None):
+    """
+    Register a benchmark under name for the given suites. A benchmark with
+    a budget also fails whenever its fastest run exceeds it, whatever the
+    baseline says.
+    """
+    def register(prepare):
+        BENCHMARKS.append(Benchmark(name, prepare, suites, budget))
+        return prepare
+    return register
+
+
+class Workspace:
+    """Directory of generated fixtures, each created on first use."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _fixture(self, name: str, create: Callable[[Path], None]) -> Path:
+        path = self.root / name
+        done = self.root / f".{name}.done"
+        if not done.exists():
+            if path.is_dir():
+                shutil.rmtree(path)
+            elif path.exists():
+                path.unlink()
+            create(path)
+            done.touch()
+        return path
+
+    def fseq(self, size_mb: int, compression: int = COMPRESSION_NONE,
+             channel_count: int = 200, edited: bool = False) -> Path:
+        """
+        A sequence of about size_mb MB of channel data. An edited sequence
+        is the same one with two seconds in the middle changed.
+        """
+        frames = frames_for_size(size_mb * MB, channel_count)
+        edit = (frames // 2, frames // 2 + 100) if edited else None
+        return self._fixture(
+            f"seq-{size_mb}mb-c{compression}{'-edited' if edited else ''}.fseq",
+            lambda path: make_fseq(path, frames, channel_count, step_time_ms=20,
+                                   compression=compression, edit=edit),
+        )
+
+    def wav(self, seconds: int) -> Path:
+        return self._fixture(f"audio-{seconds}s.wav", lambda path: make_wav(path, seconds))
+
+    def mp3(self, seconds: int) -> Path:
+        return self._fixture(f"audio-{seconds}s.mp3", lambda path: make_mp3(path, seconds))
+
+    def outro_show(self, audio: str) -> Path:
+        """A 3-minute show whose audio runs on for 5 minutes."""
+        def create(path: Path):
+            make_show(path, 180, audio=audio)
+            if audio == 'mp3':
+                make_mp3(path / "lightshow.mp3", 300)
+            else:
+                make_wav(path / "lightshow.wav", 300)
+        return self._fixture(f"outro-show-{audio}", create)
+
+    def outro_upload(self, audio: str) -> Path:
+        """outro_show() as the tar stream a client uploads to serve.py."""
+        show_dir = self.outro_show(audio)
+
+        def create(path: Path):
+            with tarfile.open(path, 'w') as tar:
+                tar.add(show_dir, arcname=show_dir.name)
+        return self._fixture(f"outro-show-{audio}.tar", create)
+
+    def beat_show(self, offset_ms: int = 0) -> Path:
+        """A 5-minute show flashing on a click track, offset_ms late."""
+        return self._fixture(f"beat-show-{offset_ms}ms",
+                             lambda path: make_beat_show(path, offset_ms=offset_ms))
+
+    def shows(self, count: int) -> Path:
+        """A shows directory holding count small valid shows."""
+        return self._fixture(f"shows-{count}", lambda path: make_shows_tree(path, count))
+
+    def scratch(self, name: str) -> Path:
+        """An empty directory, recreated on every call."""
+        path = self.root / "scratch" / name
+        if path.exists():
+            shutil.rmtree(path)
+        path.mkdir(parents=True)
+        return path
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the tools' console output while timing."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _zstd_available() -> bool:
+    try:
+        import zstandard  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _numpy_available() -> bool:
+    try:
+        import numpy  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _consume(seq: FseqFile):
+    # A helper so the last chunk's view is released before the file closes
+    for _ in seq.iter_chunks():
+        pass
+
+
+# Parsers and readers at 1 MB - 1 GB
+
+SIZES = [(1, QUICK), (32, QUICK), (256, FULL), (1024, FULL)]
+
+for _size, _suites in SIZES:
+    @benchmark(f"fseq.open[{_size}MB]", _suites)
+    def _open(ws, size=_size):
+        path = ws.fseq(size)
+
+        def run():
+            with FseqFile(path) as seq:
+                seq.header
+        return run
+
+    @benchmark(f"fseq.scan[{_size}MB]", _suites)
+    def _scan(ws, size=_size):
+        path = ws.fseq(size)
+
+        def run():
+            with FseqFile(path) as seq:
+                _consume(seq)
+        return run
+
+    # Past ~4 MB a sequence is over Tesla's 5 minute limit and validation
+    # stops at the header, so time the channel checks on their own
+    @benchmark(f"check_channels[{_size}MB]", _suites)
+    def _check_channels(ws, size=_size):
+        if not _numpy_available():
+            return None
+        path = ws.fseq(size)
+
+        def run():
+            with quiet(), FseqFile(path) as seq:
+                check_channels(seq)
+        return run
+
+for _size, _suites in SIZES[:3]:
+    for _codec, _label in ((COMPRESSION_ZLIB, 'zlib'), (COMPRESSION_ZSTD, 'zstd')):
+        @benchmark(f"fseq.scan[{_size}MB,{_label}]", _suites)
+        def _scan_compressed(ws, size=_size, codec=_codec):
+            if codec == COMPRESSION_ZSTD and not _zstd_available():
+                return None
+            path = ws.fseq(size, codec)
+
+            def run():
+                with FseqFile(path, cache_bytes=0) as seq:
+                    _consume(seq)
+            return run
+
+# Two revisions of a sequence that differ in one section
+
+for _size, _suites in ((32, QUICK), (256, FULL)):
+    for _codec, _label in ((COMPRESSION_NONE, 'none'), (COMPRESSION_ZLIB, 'zlib'),
+                           (COMPRESSION_ZSTD, 'zstd')):
+        @benchmark(f"diff[{_size}MB,{_label}]", _suites)
+        def _diff(ws, size=_size, codec=_codec):
+            if not _numpy_available() or codec == COMPRESSION_ZSTD and not _zstd_available():
+                return None
+            old = ws.fseq(size, codec)
+            new = ws.fseq(size, codec, edited=True)
+            return lambda: diff_sequences(old, new)
+
+
+for _size, _suites in ((32, QUICK), (256, FULL)):
+    for _src, _dest in ((COMPRESSION_NONE, 'none'), (COMPRESSION_NONE, 'zlib'),
+                        (COMPRESSION_ZLIB, 'none'), (COMPRESSION_ZLIB, 'zstd')):
+        _name = {COMPRESSION_NONE: 'none', COMPRESSION_ZLIB: 'zlib'}[_src]
+
+        @benchmark(f"convert[{_size}MB,{_name}->{_dest}]", _suites)
+        def _convert(ws, size=_size, src=_src, dest=_dest):
+            if dest == 'zstd' and not _zstd_available():
+                return None
+            source = ws.fseq(size, src)
+            output = ws.scratch(f"convert-{size}-{src}-{dest}") / "lightshow.fseq"
+            return lambda: convert_sequence(source, output, dest)
+
+
+def _tesla_max_fseq(ws) -> Path:
+    # The largest sequence Tesla accepts: 5 minutes of 200 channels at 15 ms
+    return ws._fixture(
+        "seq-tesla-max.fseq",
+        lambda path: make_fseq(path, 20000, 200, step_time_ms=15),
+    )
+
+
+@benchmark("validate_sequence[4MB]")
+def _validate_sequence(ws):
+    path = _tesla_max_fseq(ws)
+
+    def run():
+        with quiet():
+            validate_sequence(path)
+    return run
+
+
+@benchmark("preview.render[5min]")
+def _preview_render(ws):
+    if not _numpy_available():
+        return None
+    path = _tesla_max_fseq(ws)
+
+    def run():
+        # A fresh cache each time, so the hash and render are timed too
+        PreviewCache(ws.scratch("previews")).get(Show.for_sequence(path))
+    return run
+
+
+@benchmark("effects.write[5min, 2000 effects]")
+def _effects_write(ws):
+    if not _numpy_available():
+        return None
+    import random
+
+    rng = random.Random(1)
+    timeline = Timeline(299, step_time_ms=20, channel_count=200)
+    for _ in range(2000):
+        start = rng.uniform(0, 290)
+        kind = rng.choice(('on', 'off', 'fade', 'blink'))
+        channels = [rng.randrange(200) for _ in range(5)]
+        getattr(timeline, kind)(channels, start, start + rng.uniform(0.5, 8))
+    dest = ws.scratch("effects") / "lightshow.fseq"
+    return lambda: timeline.write(dest)
+
+
+@benchmark("analyze.sync[5min]")
+def _analyze_sync(ws):
+    if not _numpy_available():
+        return None
+    show_dir = ws.beat_show(120)
+
+    def run():
+        analyze_sync(show_dir / "lightshow.wav", show_dir / "lightshow.fseq")
+    return run
+
+
+@benchmark("probe_wav[5min]")
+def _probe_wav(ws):
+    path = ws.wav(300)
+    return lambda: probe_wav(path)
+
+
+@benchmark("probe_mp3[5min]")
+def _probe_mp3(ws):
+    path = ws.mp3(300)
+    return lambda: probe_mp3(path)
+
+
+# Whole-show operations at 1, 100 and 5,000 shows
+
+SHOW_COUNTS = [(1, QUICK), (100, QUICK), (5000, FULL)]
+
+for _count, _suites in SHOW_COUNTS:
+    @benchmark(f"find_all_shows[{_count}]", _suites)
+    def _find_all_shows(ws, count=_count):
+        shows_dir = ws.shows(count)
+        return lambda: find_all_shows(shows_dir)
+
+    @benchmark(f"list_shows.cold[{_count}]", _suites)
+    def _list_cold(ws, count=_count):
+        shows_dir = ws.shows(count)
+
+        def run():
+            with quiet():
+                list_shows(shows_dir, rescan=True)
+        return run
+
+    @benchmark(f"list_shows.warm[{_count}]", _suites)
+    def _list_warm(ws, count=_count):
+        shows_dir = ws.shows(count)
+        ShowIndex(shows_dir).refresh()
+
+        def run():
+            with quiet():
+                list_shows(shows_dir)
+        return run
+
+    @benchmark(f"list_shows.previews[{_count}]", _suites)
+    def _list_previews(ws, count=_count):
+        if not _numpy_available():
+            return None
+        shows = find_shows(ws.shows(count))
+        show_previews(shows)
+        return lambda: show_previews(shows)
+
+    @benchmark(f"validate_show[{_count}]", _suites)
+    def _validate_shows(ws, count=_count):
+        shows = find_all_shows(ws.shows(count))
+
+        def run():
+            with quiet():
+                for show_dir in shows:
+                    validate_show(show_dir)
+        return run
+
+    @benchmark(f"package_show.cold[{_count}]", _suites)
+    def _package_cold(ws, count=_count):
+        shows = find_all_shows(ws.shows(count))
+        output = ws.scratch(f"build-cold-{count}")
+
+        def run():
+            with quiet():
+                for show_dir in shows:
+                    package_show(show_dir, output / show_dir.name, force=True)
+        return run
+
+    @benchmark(f"package_show.warm[{_count}]", _suites)
+    def _package_warm(ws, count=_count):
+        shows = find_all_shows(ws.shows(count))
+        output = ws.scratch(f"build-warm-{count}")
+        with quiet():
+            for show_dir in shows:
+                package_show(show_dir, output / show_dir.name)
+
+        def run():
+            with quiet():
+                for show_dir in shows:
+                    package_show(show_dir, output / show_dir.name)
+        return run
+
+
+for _fs in ('fat32', 'exfat'):
+    @benchmark(f"package_image[{_fs}]")
+    def _package_image(ws, fs=_fs):
+        show_dir = find_all_shows(ws.shows(1))[0]
+        image = ws.scratch(f"image-{fs}") / "lightshow.img"
+
+        def run():
+            with quiet():
+                package_image(show_dir, image, fs=fs)
+        return run
+
+
+for _audio in ('wav', 'mp3'):
+    for _trim in (False, True):
+        @benchmark(f"package_show.outro[{_audio}, {'trim' if _trim else 'copy'}]")
+        def _package_outro(ws, audio=_audio, trim=_trim):
+            show_dir = ws.outro_show(audio)
+            output = ws.scratch(f"build-outro-{audio}-{trim}")
+
+            def run():
+                with quiet():
+                    package_show(show_dir, output, force=True, trim_audio=trim)
+            return run
+
+
+@benchmark("serve.receive[5min wav show]")
+def _serve_receive(ws):
+    upload = ws.outro_upload('wav')
+
+    def run():
+        with open(upload, 'rb') as body:
+            receive_show(body, ws.scratch("serve-upload"))
+    return run
+
+
+@benchmark("bundle.plan[100]")
+def _bundle_plan(ws):
+    shows = find_all_shows(ws.shows(100))
+
+    def run():
+        with quiet():
+            bundle_shows(shows, 64 * MB, dry_run=True)
+    return run
+
+
+# Cold start of the lightshow command, which scripts and git hooks run
+# thousands of times: a fresh interpreter per run, so every import counts
+
+LIGHTSHOW = Path(__file__).resolve().parent.parent / "tools" / "lightshow.py"
+STARTUP_BUDGET = 0.1
+
+
+def _command(*args):
+    command = [sys.executable, str(LIGHTSHOW)] + [str(arg) for arg in args]
+
+    def run():
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return run
+
+
+@benchmark("startup[lightshow --help]", budget=STARTUP_BUDGET)
+def _startup_help(ws):
+    return _command("--help")
+
+
+for _command_name in ('create', 'validate', 'package', 'list'):
+    @benchmark(f"startup[lightshow {_command_name} --help]", budget=STARTUP_BUDGET)
+    def _startup_command(ws, name=_command_name):
+        return _command(name, "--help")
+
+
+# No budget: checking the channel data is what NumPy is for, and importing
+# it dominates this one
+@benchmark("startup[lightshow validate show]")
+def _startup_validate(ws):
+    return _command("validate", find_all_shows(ws.shows(1))[0])
+
+
+@benchmark("startup[lightshow list]", budget=STARTUP_BUDGET)
+def _startup_list(ws):
+    shows_dir = ws.shows(100)
+    ShowIndex(shows_dir).refresh()
+    return _command("list", "-d", shows_dir)
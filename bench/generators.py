@@ -0,0 +1,256 @@
+"""
+Synthetic show generators for the benchmarks.
+
+Everything here uses the standard library only. Large files are written in
+chunks so generating a 1 GB sequence never holds it in memory, and all-zero
+data is written as a sparse file (a header followed by truncate), which
+costs no disk space.
+"""
+import json
+import math
+import os
+import random
+import struct
+from pathlib import Path
+from typing import Optional, Tuple
+
+from fseq import FseqWriter, COMPRESSION_NONE
+
+# Frames written per FseqWriter call
+WRITE_FRAMES = 4096
+
+PATTERNS = ('zero', 'chase', 'random')
+
+# Byte translation table mapping each value v to 255 - v
+INVERT = bytes(range(255, -1, -1))
+
+# MPEG-1 Layer III, 48 kHz, mono, no CRC: frames are exactly 144 * bitrate / 48000 bytes
+MP3_SAMPLE_RATE = 48000
+MP3_SAMPLES_PER_FRAME = 1152
+MP3_BITRATE_INDEX = {32: 1, 64: 5, 128: 9, 192: 11, 320: 14}
+
+
+def frames_for_size(size_bytes: int, channel_count: int) -> int:
+    """Return the frame count giving roughly size_bytes of channel data."""
+    return max(1, size_bytes // channel_count)
+
+
+def _pattern_chunk(pattern: str, channel_count: int, frames: int, first_frame: int) -> bytes:
+    if pattern == 'random':
+        # Sparse random flashes: mostly off like a real show
+        noise = os.urandom(frames * channel_count)
+        return noise.translate(bytes(255 if b < 16 else 0 for b in range(256)))
+    # 'chase': one light at a time, four frames each
+    out = bytearray(frames * channel_count)
+    for i in range(frames):
+        out[i * channel_count + ((first_frame + i) // 4) % channel_count] = 255
+    return bytes(out)
+
+
+def make_fseq(path: Path, frame_count: int, channel_count: int = 48,
+              step_time_ms: int = 20, compression: int = COMPRESSION_NONE,
+              pattern: str = 'chase', edit: Optional[Tuple[int, int]] = None) -> Path:
+    """
+    Write a synthetic FSEQ v2 file.
+
+    Args:
+        path: Output file
+        frame_count: Number of frames
+        channel_count: Channels per frame
+        step_time_ms: Frame interval
+        compression: fseq.COMPRESSION_* code
+        pattern: 'zero' (sparse file when uncompressed), 'chase' or 'random'
+        edit: Frames [start, stop) to invert, giving a copy of the same
+            sequence with one section changed
+
+    Returns:
+        The output path
+    """
+    if pattern not in PATTERNS:
+        raise ValueError(f"Unknown pattern: {pattern}")
+    path = Path(path)
+
+    if pattern == 'zero' and compression == COMPRESSION_NONE and edit is None:
+        with FseqWriter(path, channel_count, 0, step_time_ms) as out:
+            pass
+        # Rewrite the frame count and extend the file with zeros
+        with open(path, 'r+b') as f:
+            data_offset = struct.unpack_from('<H', f.read(6), 4)[0]
+            f.seek(14)
+            f.write(struct.pack('<I', frame_count))
+            f.truncate(data_offset + frame_count * channel_count)
+        return path
+
+    # 'chase' repeats every 4 * channel_count frames, so build one period and reuse it
+    period = 4 * channel_count
+    chunk_frames = max(period, WRITE_FRAMES // period * period)
+    repeated = None
+    if pattern == 'chase':
+        repeated = _pattern_chunk('chase', channel_count, chunk_frames, 0)
+    elif pattern == 'zero':
+        repeated = bytes(chunk_frames * channel_count)
+
+    with FseqWriter(path, channel_count, frame_count, step_time_ms,
+                    compression=compression) as out:
+        written = 0
+        while written < frame_count:
+            count = min(chunk_frames, frame_count - written)
+            if repeated is not None:
+                data = repeated[:count * channel_count]
+            else:
+                data = _pattern_chunk(pattern, channel_count, count, written)
+            if edit is not None and edit[0] < written + count and edit[1] > written:
+                data = bytearray(data)
+                lo = (max(edit[0], written) - written) * channel_count
+                hi = (min(edit[1], written + count) - written) * channel_count
+                data[lo:hi] = bytes(data[lo:hi]).translate(INVERT)
+            out.write_frames(data)
+            written += count
+    return path
+
+
+def make_wav(path: Path, seconds: float, sample_rate: int = 44100,
+             channels: int = 2, bits: int = 16) -> Path:
+    """
+    Write a silent PCM WAV stub of the given length as a sparse file.
+
+    Returns:
+        The output path
+    """
+    block_align = channels * bits // 8
+    data_size = int(round(seconds * sample_rate)) * block_align
+    header = b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE'
+    header += b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate,
+                                    sample_rate * block_align, block_align, bits)
+    header += b'data' + struct.pack('<I', data_size)
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.truncate(len(header) + data_size)
+    return Path(path)
+
+
+def make_mp3(path: Path, seconds: float, bitrate_kbps: int = 128) -> Path:
+    """
+    Write a constant-bitrate MP3 stub: valid frame headers with empty
+    payloads and no Xing header, so probing has to walk every frame.
+
+    Returns:
+        The output path
+    """
+    index = MP3_BITRATE_INDEX[bitrate_kbps]
+    frame_length = 144 * bitrate_kbps * 1000 // MP3_SAMPLE_RATE
+    # 0xFFFB: MPEG-1 Layer III without CRC; rate index 1 = 48 kHz; mono
+    frame = bytes((0xFF, 0xFB, (index << 4) | (1 << 2), 0xC0)) + bytes(frame_length - 4)
+    frames = -(-int(round(seconds * MP3_SAMPLE_RATE)) // MP3_SAMPLES_PER_FRAME)
+    with open(path, 'wb') as f:
+        batch = frame * 1024
+        for _ in range(frames // 1024):
+            f.write(batch)
+        f.write(frame * (frames % 1024))
+    return Path(path)
+
+
+def make_show(show_dir: Path, seconds: float = 10.0, channel_count: int = 48,
+              step_time_ms: int = 40, audio: str = 'wav',
+              pattern: str = 'chase', sample_rate: int = 44100,
+              audio_channels: int = 2) -> Path:
+    """
+    Create a complete, valid show: sequence, matching audio and metadata.
+
+    ``sample_rate`` and ``audio_channels`` only apply to WAV audio.
+
+    Returns:
+        The show directory
+    """
+    show_dir = Path(show_dir)
+    show_dir.mkdir(parents=True, exist_ok=True)
+    frame_count = int(round(seconds * 1000 / step_time_ms))
+    make_fseq(show_dir / "lightshow.fseq", frame_count, channel_count,
+              step_time_ms, pattern=pattern)
+    if audio == 'mp3':
+        make_mp3(show_dir / "lightshow.mp3", seconds)
+    else:
+        make_wav(show_dir / "lightshow.wav", seconds, sample_rate, audio_channels)
+    metadata = {
+        "name": show_dir.name.replace('-', ' ').title(),
+        "artist": "Benchmark",
+        "duration": seconds,
+        "fps": round(1000 / step_time_ms),
+        "audio_format": audio,
+    }
+    with open(show_dir / "metadata.json", 'w') as f:
+        json.dump(metadata, f, indent=2)
+    return show_dir
+
+
+def make_beat_show(show_dir: Path, seconds: float = 300.0, bpm: float = 120.0,
+                   offset_ms: float = 0.0, step_time_ms: int = 20,
+                   sample_rate: int = 44100) -> Path:
+    """
+    Create a show whose lights flash on the hits of a click track.
+
+    The track has a click on every beat plus irregular extra hits, so its
+    onsets are not perfectly periodic. Each hit flashes one of the main
+    lights, offset_ms late (or early if negative).
+
+    Returns:
+        The show directory
+    """
+    show_dir = Path(show_dir)
+    show_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(0)
+    period = 60.0 / bpm
+    hits = [i * period for i in range(1, int(seconds / period))]
+    hits += [rng.uniform(0.5, seconds - 0.5) for _ in range(len(hits) // 2)]
+    hits.sort()
+
+    # Decaying 1 kHz click, 16-bit stereo
+    click = b''.join(
+        struct.pack('<h', int(20000 * math.sin(2 * math.pi * 1000 * n / sample_rate)
+                              * math.exp(-60 * n / sample_rate))) * 2
+        for n in range(int(0.06 * sample_rate))
+    )
+    samples = bytearray(int(round(seconds * sample_rate)) * 4)
+    for hit in hits:
+        start = int(hit * sample_rate) * 4
+        samples[start:start + len(click)] = click[:len(samples) - start]
+    header = b'RIFF' + struct.pack('<I', 36 + len(samples)) + b'WAVE'
+    header += b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 2, sample_rate,
+                                    sample_rate * 4, 4, 16)
+    header += b'data' + struct.pack('<I', len(samples))
+    with open(show_dir / "lightshow.wav", 'wb') as f:
+        f.write(header)
+        f.write(samples)
+
+    channel_count = 48
+    frame_count = int(round(seconds * 1000 / step_time_ms))
+    frames = bytearray(frame_count * channel_count)
+    for index, hit in enumerate(hits):
+        first = int(round((hit * 1000 + offset_ms) / step_time_ms))
+        for frame in range(max(0, first), min(frame_count, first + 3)):
+            frames[frame * channel_count + index % 8] = 255
+    with FseqWriter(show_dir / "lightshow.fseq", channel_count, frame_count,
+                    step_time_ms) as out:
+        out.write_frames(frames)
+
+    metadata = {"name": show_dir.name, "artist": "Benchmark", "duration": seconds}
+    with open(show_dir / "metadata.json", 'w') as f:
+        json.dump(metadata, f, indent=2)
+    return show_dir
+
+
+def make_shows_tree(shows_dir: Path, count: int, seconds: float = 10.0,
+                    channel_count: int = 48) -> Path:
+    """
+    Create count small shows, alternating WAV and MP3 audio. The WAV files
+    are 8 kHz mono to keep packaged copies of thousands of shows small.
+
+    Returns:
+        The shows directory
+    """
+    shows_dir = Path(shows_dir)
+    shows_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        make_show(shows_dir / f"show-{i:05d}", seconds, channel_count,
+                  audio='mp3' if i % 2 else 'wav', sample_rate=8000, audio_channels=1)
+    return shows_dir
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Run the benchmark suite and compare against a saved baseline.
+
+Each benchmark is run a few times and its fastest run is kept, which is
+the figure least disturbed by other load on the machine. Results are
+compared with the baseline JSON file; a benchmark that got slower by more
+than the tolerance is reported as a regression and the run exits with
+status 1. Benchmarks with an absolute budget (the command startup times)
+also fail the run whenever they exceed it, baseline or not. Timings are
+machine specific, so the baseline is kept locally (bench/baseline.json,
+not committed) and recorded on the first run.
+"""
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent / "tools"))
+sys.path.insert(0, str(BENCH_DIR))
+
+from utils import print_success, print_error, print_warning, print_info  # noqa: E402
+from benchmarks import BENCHMARKS, Workspace  # noqa: E402
+
+
+BASELINE_VERSION = 1
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+DEFAULT_TOLERANCE = 0.25
+# Differences below this are timer noise, whatever the percentage
+NOISE_FLOOR = 0.0005
+DEFAULT_REPEAT = 5
+# Stop repeating a benchmark once this much time has been spent on it
+TIME_BUDGET = 3.0
+
+
+def time_benchmark(run, repeat: int = DEFAULT_REPEAT,
+                   budget: float = TIME_BUDGET) -> Dict:
+    """
+    Time a callable.
+
+    Returns:
+        Dict with the fastest and median run in seconds and the run count
+    """
+    times = []
+    spent = 0.0
+    while len(times) < repeat and (not times or spent < budget):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        spent += elapsed
+    times.sort()
+    return {'min': times[0], 'median': times[len(times) // 2], 'runs': len(times)}
+
+
+def load_baseline(path: Path) -> Dict[str, Dict]:
+    """Return the saved results, or an empty dict if there is no baseline."""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('version') != BASELINE_VERSION:
+        return {}
+    return data.get('results', {})
+
+
+def save_baseline(path: Path, results: Dict[str, Dict]):
+    """Merge results into the baseline file, keeping other benchmarks' entries."""
+    merged = load_baseline(path)
+    merged.update(results)
+    data = {
+        'version': BASELINE_VERSION,
+        'machine': platform.node(),
+        'python': platform.python_version(),
+        'saved': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': dict(sorted(merged.items())),
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.write('\n')
+
+
+def compare(name: str, result: Dict, baseline: Optional[Dict],
+            tolerance: float) -> Optional[bool]:
+    """
+    Print one result line against its baseline.
+
+    Returns:
+        True for a regression, False otherwise, None if there is no baseline
+    """
+    current = result['min']
+    if baseline is None:
+        print(f"  {name:<34} {format_time(current):>10}   (new)")
+        return None
+    previous = baseline['min']
+    change = (current - previous) / previous if previous else 0.0
+    regressed = change > tolerance and current - previous > NOISE_FLOOR
+    line = (f"  {name:<34} {format_time(current):>10}   "
+            f"was {format_time(previous):>9}  {change:+7.1%}")
+    if regressed:
+        print_error(line.strip() + "  REGRESSION")
+    else:
+        print(line)
+    return regressed
+
+
+def format_time(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.0f} µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:.1f} ms"
+    return f"{seconds:.2f} s"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the lightshow tools benchmarks',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s                         Quick suite, compared with the baseline
+  %(prog)s --suite full            Adds 5,000 shows and 256 MB - 1 GB files
+  %(prog)s --save                  Record the results as the new baseline
+  %(prog)s -k package              Only benchmarks whose name contains 'package'
+        """
+    )
+
+    parser.add_argument(
+        '--suite',
+        choices=['quick', 'full'],
+        default='quick',
+        help='Benchmark suite (default: quick)'
+    )
+
+    parser.add_argument(
+        '-k', '--filter',
+        help='Only run benchmarks whose name contains this text'
+    )
+
+    parser.add_argument(
+        '--baseline',
+        type=Path,
+        default=DEFAULT_BASELINE,
+        help='Baseline JSON file (default: bench/baseline.json)'
+    )
+
+    parser.add_argument(
+        '--save',
+        action='store_true',
+        help='Save the results as the baseline instead of comparing'
+    )
+
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help=f'Allowed slowdown before failing (default: {DEFAULT_TOLERANCE:.0%}%)'
+    )
+
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=DEFAULT_REPEAT,
+        help=f'Runs per benchmark (default: {DEFAULT_REPEAT})'
+    )
+
+    parser.add_argument(
+        '--workdir',
+        type=Path,
+        help='Keep generated fixtures here and reuse them (default: temporary)'
+    )
+
+    parser.add_argument(
+        '--json',
+        type=Path,
+        help='Also write this run\'s results to a JSON file'
+    )
+
+    parser.add_argument(
+        '--list',
+        action='store_true',
+        help='List the benchmarks in the suite and exit'
+    )
+
+    args = parser.parse_args()
+
+    selected = [
+        bench for bench in BENCHMARKS
+        if args.suite in bench.suites and (not args.filter or args.filter in bench.name)
+    ]
+    if args.list:
+        for bench in selected:
+            print(bench.name)
+        return
+    if not selected:
+        print_error("No benchmarks selected")
+        sys.exit(1)
+
+    baseline = {} if args.save else load_baseline(args.baseline.absolute())
+    baseline_path = args.baseline.absolute()
+    json_path = args.json.absolute() if args.json else None
+
+    workdir = args.workdir.absolute() if args.workdir else Path(tempfile.mkdtemp(prefix="lightshow-bench-"))
+    workspace = Workspace(workdir)
+    print_info(f"Running {len(selected)} benchmarks ({args.suite} suite) in {workdir}")
+    if not baseline and not args.save:
+        print_info(f"No baseline at {baseline_path}; this run will be saved as the baseline")
+
+    # package_show keeps its build manifest under ./build/.cache
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    results = {}
+    regressions = []
+    over_budget = []
+    new = {}
+    try:
+        for bench in selected:
+            run = bench.prepare(workspace)
+            if run is None:
+                print_warning(f"  {bench.name}: skipped (optional dependency missing)")
+                continue
+            result = time_benchmark(run, args.repeat)
+            results[bench.name] = result
+            regressed = compare(bench.name, result, baseline.get(bench.name), args.tolerance)
+            if regressed is None:
+                new[bench.name] = result
+            elif regressed:
+                regressions.append(bench.name)
+            if bench.budget is not None and result['min'] > bench.budget:
+                print_error(f"  {bench.name}: {format_time(result['min'])} "
+                            f"is over its {format_time(bench.budget)} budget")
+                over_budget.append(bench.name)
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+
+    if args.save or not baseline:
+        save_baseline(baseline_path, results)
+        print_success(f"Saved baseline: {baseline_path}")
+    elif new:
+        save_baseline(baseline_path, new)
+        print_info(f"Added {len(new)} new benchmark(s) to the baseline")
+
+    print()
+    if over_budget:
+        print_error(f"{len(over_budget)} benchmark(s) over budget: " + ", ".join(over_budget))
+        sys.exit(1)
+    if args.save or not baseline:
+        return
+    if regressions:
+        print_error(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}: "
+                    + ", ".join(regressions))
+        sys.exit(1)
+    print_success(f"No regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == '__main__':
+    main()
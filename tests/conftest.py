@@ -0,0 +1,11 @@
+"""
+Shared test setup: the tools are flat scripts importing each other by
+module name, so tools/ (and bench/, for the generators and budgets) go on
+sys.path the same way bench/run.py puts them there.
+"""
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "tools"))
+sys.path.insert(0, str(ROOT / "bench"))
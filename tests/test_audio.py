@@ -0,0 +1,278 @@
+"""
+MP3 probing without decoding: frame walks for CBR files, the frame count
+from Xing/Info and VBRI headers with the LAME encoder delay and padding
+taken off, and ID3v2 tags skipped in front of the first frame. Then the
+shortened copies planned by plan_cut and written by write_cut.
+
+Files are assembled here from the MPEG audio frame format, so the expected
+durations do not come from audio.py's own tables.
+"""
+import struct
+from typing import List
+
+import pytest
+
+from audio import plan_cut, probe_mp3, probe_wav, write_cut
+
+# kbps -> bitrate index, Layer III
+MPEG1_BITRATES = {32: 1, 64: 5, 96: 7, 128: 9, 160: 10, 192: 11, 256: 13, 320: 14}
+MPEG2_BITRATES = {8: 1, 32: 4, 64: 8, 96: 10, 128: 12, 160: 14}
+SAMPLE_RATE_INDEX = {44100: 0, 48000: 1, 32000: 2, 22050: 0, 24000: 1, 16000: 2}
+
+
+def mp3_frame(kbps: int, rate: int = 44100, mono: bool = False, padding: int = 0,
+              body: bytes = b'') -> bytes:
+    """One Layer III frame without CRC: MPEG-1 above 32 kHz, MPEG-2 below."""
+    mpeg1 = rate >= 32000
+    index = (MPEG1_BITRATES if mpeg1 else MPEG2_BITRATES)[kbps]
+    header = bytes((
+        0xFF,
+        0xFB if mpeg1 else 0xF3,
+        (index << 4) | (SAMPLE_RATE_INDEX[rate] << 2) | (padding << 1),
+        0xC0 if mono else 0x00,
+    ))
+    length = (144 if mpeg1 else 72) * kbps * 1000 // rate + padding
+    return (header + body).ljust(length, b'\0')
+
+
+def samples_per_frame(rate: int) -> int:
+    return 1152 if rate >= 32000 else 576
+
+
+def side_info(rate: int, mono: bool) -> int:
+    if rate >= 32000:
+        return 17 if mono else 32
+    return 9 if mono else 17
+
+
+def xing_frame(tag: bytes, frames: int, byte_count: int = None, kbps: int = 128,
+               rate: int = 44100, mono: bool = False, delay: int = None,
+               padding: int = 0, toc: bool = False) -> bytes:
+    """A Xing/Info frame, with a LAME extension if delay is given."""
+    flags = 0x1
+    fields = struct.pack('>I', frames)
+    if byte_count is not None:
+        flags |= 0x2
+        fields += struct.pack('>I', byte_count)
+    if toc:
+        flags |= 0x4 | 0x8
+        fields += bytes(range(100)) + struct.pack('>I', 57)
+    body = bytes(side_info(rate, mono)) + tag + struct.pack('>I', flags) + fields
+    if delay is not None:
+        # 9-byte version string, then 12 bytes up to the 12-bit delay and padding
+        body += b'LAME3.100' + bytes(12)
+        body += bytes((delay >> 4, ((delay & 0x0F) << 4) | (padding >> 8), padding & 0xFF))
+    return mp3_frame(kbps, rate, mono, body=body)
+
+
+def vbri_frame(frames: int, byte_count: int, kbps: int = 128, rate: int = 44100) -> bytes:
+    body = bytes(32) + b'VBRI' + struct.pack('>HHHII', 1, 0, 75, byte_count, frames)
+    return mp3_frame(kbps, rate, body=body)
+
+
+def id3v2(size: int, footer: bool = False) -> bytes:
+    """An ID3v2.4 tag with ``size`` bytes of frames, as a syncsafe size."""
+    syncsafe = bytes((size >> 21 & 0x7F, size >> 14 & 0x7F, size >> 7 & 0x7F, size & 0x7F))
+    header = b'ID3' + bytes((4, 0, 0x10 if footer else 0)) + syncsafe
+    # Tag contents that look like the start of a frame must not be taken as one
+    body = (b'\xff\xfb\x90\x00' * (size // 4 + 1))[:size]
+    return header + body + (b'3DI' + header[3:] if footer else b'')
+
+
+def vbr_frames(count: int, rate: int = 44100) -> List[bytes]:
+    rates = (96, 128, 160, 320, 64)
+    return [mp3_frame(rates[i % len(rates)], rate, padding=i & 1) for i in range(count)]
+
+
+@pytest.mark.parametrize('kbps, rate, mono', [
+    (128, 44100, False),
+    (320, 48000, False),
+    (64, 22050, True),
+], ids=['mpeg1-44k', 'mpeg1-48k', 'mpeg2-22k-mono'])
+def test_cbr(tmp_path, kbps, rate, mono):
+    # The padding bit varies the frame length, as an encoder sets it
+    frames = [mp3_frame(kbps, rate, mono, padding=int(i % 3 == 0)) for i in range(1000)]
+    path = tmp_path / "cbr.mp3"
+    # Trailing ID3v1 tag ends the walk
+    path.write_bytes(b''.join(frames) + b'TAG' + bytes(125))
+
+    info = probe_mp3(path)
+    assert info.duration == 1000 * samples_per_frame(rate) / rate
+    assert info.sample_rate == rate
+    assert info.channels == (1 if mono else 2)
+    assert info.data_offset == 0
+    assert info.data_size == sum(map(len, frames))
+
+
+@pytest.mark.parametrize('toc', [False, True], ids=['frames-bytes', 'toc-quality'])
+def test_xing_vbr_with_lame_delay(tmp_path, toc):
+    audio = b''.join(vbr_frames(500))
+    first = xing_frame(b'Xing', 500, None, delay=576, padding=1000, toc=toc)
+    first = xing_frame(b'Xing', 500, len(first) + len(audio), delay=576, padding=1000, toc=toc)
+    path = tmp_path / "vbr.mp3"
+    path.write_bytes(first + audio)
+
+    info = probe_mp3(path)
+    assert info.duration == (500 * 1152 - 576 - 1000) / 44100
+    assert info.data_offset == len(first)
+    assert info.data_size == len(audio)
+
+
+def test_info_header_without_byte_count(tmp_path):
+    # LAME writes 'Info' for CBR; with no byte count the rest of the file is audio
+    audio = b''.join(mp3_frame(64, 32000, mono=True) for _ in range(300))
+    first = xing_frame(b'Info', 300, kbps=64, rate=32000, mono=True)
+    path = tmp_path / "info.mp3"
+    path.write_bytes(first + audio)
+
+    info = probe_mp3(path)
+    assert info.duration == 300 * 1152 / 32000
+    assert info.channels == 1
+    assert info.data_offset == len(first)
+    assert info.data_size == len(audio)
+
+
+def test_vbri(tmp_path):
+    audio = b''.join(vbr_frames(250))
+    first = vbri_frame(250, 0)
+    first = vbri_frame(250, len(first) + len(audio))
+    path = tmp_path / "vbri.mp3"
+    path.write_bytes(first + audio)
+
+    info = probe_mp3(path)
+    assert info.duration == 250 * 1152 / 44100
+    assert info.data_offset == len(first)
+    assert info.data_size == len(audio)
+
+
+@pytest.mark.parametrize('tags', [
+    [(300, False)],
+    [(1000, True), (20, False)],
+], ids=['one-tag', 'footer-then-second-tag'])
+def test_id3v2_prefix(tmp_path, tags):
+    prefix = b''.join(id3v2(size, footer) for size, footer in tags)
+    audio = b''.join(vbr_frames(400))
+    path = tmp_path / "tagged.mp3"
+    path.write_bytes(prefix + audio)
+
+    info = probe_mp3(path)
+    assert info.duration == 400 * 1152 / 44100
+    assert info.data_offset == len(prefix)
+    assert info.data_size == len(audio)
+
+
+def test_id3v2_prefix_before_xing(tmp_path):
+    prefix = id3v2(2000)
+    audio = b''.join(vbr_frames(100))
+    first = xing_frame(b'Xing', 100, None, delay=1105, padding=0)
+    first = xing_frame(b'Xing', 100, len(first) + len(audio), delay=1105, padding=0)
+    path = tmp_path / "tagged-vbr.mp3"
+    path.write_bytes(prefix + first + audio)
+
+    info = probe_mp3(path)
+    assert info.duration == (100 * 1152 - 1105) / 44100
+    assert info.data_offset == len(prefix) + len(first)
+    assert info.data_size == len(audio)
+
+
+# Shortened copies
+
+def chunk(chunk_id: bytes, body: bytes) -> bytes:
+    return chunk_id + struct.pack('<I', len(body)) + body + bytes(len(body) & 1)
+
+
+def write_wav(path, frames: int, rate: int, channels: int, bits: int,
+              before: bytes = b'', after: bytes = b'') -> bytes:
+    """Write a PCM WAV with extra chunks around ``data``; returns the samples."""
+    block_align = channels * bits // 8
+    samples = bytes(i % 251 for i in range(frames * block_align))
+    fmt = struct.pack('<HHIIHH', 1, channels, rate, rate * block_align, block_align, bits)
+    body = b'WAVE' + chunk(b'fmt ', fmt) + before + chunk(b'data', samples) + after
+    path.write_bytes(b'RIFF' + struct.pack('<I', len(body)) + body)
+    return samples
+
+
+def read_chunks(data: bytes):
+    """The (id, body) of each top-level chunk, checking the RIFF size."""
+    assert data[0:4] == b'RIFF' and data[8:12] == b'WAVE'
+    assert struct.unpack_from('<I', data, 4)[0] == len(data) - 8
+    chunks = []
+    pos = 12
+    while pos < len(data):
+        chunk_id, size = struct.unpack_from('<4sI', data, pos)
+        body = data[pos + 8:pos + 8 + size]
+        assert len(body) == size, f"{chunk_id} runs past the end of the file"
+        chunks.append((chunk_id, body))
+        pos += 8 + size + (size & 1)
+    assert pos == len(data)
+    return chunks
+
+
+def cut_to(src, dest, seconds):
+    cut = plan_cut(src, seconds)
+    assert cut is not None
+    write_cut(src, dest, cut)
+    assert dest.stat().st_size == cut.size
+    return cut
+
+
+@pytest.mark.parametrize('rate, channels, bits, seconds, kept', [
+    (44100, 2, 16, 1.5, 66150),
+    # An odd number of 1-byte frames needs a pad byte after the data
+    (8000, 1, 8, 0.5001, 4001),
+], ids=['stereo-16', 'mono-8-odd'])
+def test_wav_cut_drops_trailing_chunks(tmp_path, rate, channels, bits, seconds, kept):
+    src = tmp_path / "long.wav"
+    # Odd-sized, so the kept chunk's pad byte must survive too
+    info = b'INFOISFT' + struct.pack('<I', 5) + b'test\0'
+    samples = write_wav(src, 3 * rate, rate, channels, bits, before=chunk(b'LIST', info),
+                        after=chunk(b'id3 ', bytes(33)) + chunk(b'smpl', bytes(60)))
+    dest = tmp_path / "cut.wav"
+    cut = cut_to(src, dest, seconds)
+
+    chunks = read_chunks(dest.read_bytes())
+    assert [chunk_id for chunk_id, _ in chunks] == [b'fmt ', b'LIST', b'data']
+    assert chunks[1][1] == info
+    data = chunks[2][1]
+    assert len(data) == kept * channels * bits // 8
+    assert data == samples[:len(data)]
+    assert cut.duration == kept / rate
+    assert probe_wav(dest).duration == cut.duration
+
+
+def test_cut_beyond_the_end(tmp_path):
+    wav = tmp_path / "short.wav"
+    write_wav(wav, 8000, 8000, 1, 16)
+    assert plan_cut(wav, 1.0) is None
+    assert plan_cut(wav, 60.0) is None
+    assert plan_cut(wav, 0.999) is not None
+
+    mp3 = tmp_path / "short.mp3"
+    mp3.write_bytes(b''.join(vbr_frames(100)) + b'TAG' + bytes(125))
+    duration = probe_mp3(mp3).duration
+    assert plan_cut(mp3, duration) is None
+    # The last frame is the one that reaches this point
+    assert plan_cut(mp3, duration - 0.01) is None
+    assert plan_cut(mp3, 60.0) is None
+    assert plan_cut(mp3, 99 * 1152 / 44100) is not None
+
+
+def test_mp3_cut_drops_the_xing_frame(tmp_path):
+    prefix = id3v2(500)
+    frames = vbr_frames(500)
+    audio = b''.join(frames)
+    first = xing_frame(b'Xing', 500, None, delay=576, padding=1000)
+    first = xing_frame(b'Xing', 500, len(first) + len(audio), delay=576, padding=1000)
+    src = tmp_path / "vbr.mp3"
+    src.write_bytes(prefix + first + audio)
+    dest = tmp_path / "cut.mp3"
+    cut = cut_to(src, dest, 1.0)
+
+    # The whole frames reaching 1 s follow the tag directly: a Xing frame
+    # left in front of them would still announce all 500
+    kept = -(-44100 // 1152)
+    assert dest.read_bytes() == prefix + b''.join(frames[:kept])
+    assert cut.duration == kept * 1152 / 44100
+    info = probe_mp3(dest)
+    assert info.duration == cut.duration
+    assert info.data_offset == len(prefix)
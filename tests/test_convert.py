@@ -0,0 +1,150 @@
+"""
+Round trips through convert.py: every source layout it reads must come
+out as the same frames as a plain v2 file written from the same matrix.
+
+Sources are assembled byte by byte here, so block sizes and the v1 header
+do not depend on FseqWriter's choices.
+"""
+import struct
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from convert import convert_sequence
+from fseq import (COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_ZSTD, FseqFile, FseqWriter,
+                  compress_block)
+
+CONVERT = Path(__file__).resolve().parent.parent / "tools" / "convert.py"
+FRAMES = 300
+STEP_MS = 40
+
+
+def random_matrix(channels: int, seed: int = 1) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (FRAMES, channels), dtype=np.uint8)
+
+
+def write_reference(path: Path, matrix: np.ndarray) -> Path:
+    with FseqWriter(path, matrix.shape[1], len(matrix), STEP_MS) as out:
+        out.write_frames(matrix)
+    return path
+
+
+def write_v1(path: Path, matrix: np.ndarray) -> Path:
+    frames, channels = matrix.shape
+    data_offset = 28
+    header = b'PSEQ' + struct.pack('<HBBHIIBBHHBBH', data_offset, 0, 1, data_offset,
+                                   channels, frames, STEP_MS, 0, 0, 0, 0, 0, 0)
+    path.write_bytes(header + matrix.tobytes())
+    return path
+
+
+def write_v2(path: Path, stored: np.ndarray, compression: int = COMPRESSION_NONE,
+             block_frames=(), sparse=()) -> Path:
+    """
+    Write a v2 file from the stored channels, with compressed blocks of the
+    given frame counts (their sum must be the frame count) and sparse
+    (start, count) ranges.
+    """
+    frames, channels = stored.shape
+    blocks = []
+    first = 0
+    for size in block_frames:
+        blocks.append((first, compress_block(stored[first:first + size].tobytes(), compression)))
+        first += size
+    assert first == (frames if compression != COMPRESSION_NONE else 0)
+
+    header_len = 32 + 8 * len(blocks) + 6 * len(sparse)
+    data_offset = (header_len + 3) & ~3
+    header = b'PSEQ' + struct.pack('<HBBHIIBBBBBBQ', data_offset, 0, 2, header_len,
+                                   channels, frames, STEP_MS, 0, compression, len(blocks),
+                                   len(sparse), 0, 0)
+    index = b''.join(struct.pack('<II', start, len(data)) for start, data in blocks)
+    ranges = b''.join(start.to_bytes(3, 'little') + count.to_bytes(3, 'little')
+                      for start, count in sparse)
+    body = b''.join(data for _, data in blocks) if blocks else stored.tobytes()
+    path.write_bytes((header + index + ranges).ljust(data_offset, b'\0') + body)
+    return path
+
+
+def frames_of(path: Path) -> np.ndarray:
+    with FseqFile(path) as seq:
+        return np.array(seq.as_array())
+
+
+def assert_converted(src: Path, reference: Path, tmp_path: Path, compression: str = 'none'):
+    dest = tmp_path / f"out-{compression}.fseq"
+    result = convert_sequence(src, dest, compression, workers=3)
+    with FseqFile(dest) as seq:
+        assert seq.header.major_version == 2
+        assert not seq.header.sparse_ranges
+        assert seq.header.step_time_ms == STEP_MS
+    assert np.array_equal(frames_of(dest), frames_of(reference))
+    return result
+
+
+@pytest.mark.parametrize('compression', ['none', 'zlib'])
+def test_v1(tmp_path, compression):
+    matrix = random_matrix(40)
+    full = np.zeros((FRAMES, 48), dtype=np.uint8)
+    full[:, :40] = matrix
+    result = assert_converted(write_v1(tmp_path / "v1.fseq", matrix),
+                              write_reference(tmp_path / "ref.fseq", full), tmp_path, compression)
+    assert result.channels == (40, 48)
+
+
+@pytest.mark.parametrize('codec', [COMPRESSION_ZLIB, COMPRESSION_ZSTD], ids=['zlib', 'zstd'])
+def test_uneven_blocks(tmp_path, codec):
+    if codec == COMPRESSION_ZSTD:
+        pytest.importorskip('zstandard')
+    matrix = random_matrix(48)
+    src = write_v2(tmp_path / "blocks.fseq", matrix, codec, block_frames=(7, 100, 1, 64, 128))
+    assert_converted(src, write_reference(tmp_path / "ref.fseq", matrix), tmp_path)
+
+
+def test_sparse(tmp_path):
+    stored = random_matrix(16)
+    full = np.zeros((FRAMES, 48), dtype=np.uint8)
+    full[:, 0:10] = stored[:, :10]
+    full[:, 30:36] = stored[:, 10:]
+    src = write_v2(tmp_path / "sparse.fseq", stored, COMPRESSION_ZLIB,
+                   block_frames=(50, 250), sparse=((0, 10), (30, 6)))
+    result = assert_converted(src, write_reference(tmp_path / "ref.fseq", full), tmp_path)
+    assert result.channels == (16, 48)
+
+
+def test_recompressed_output_reads_back(tmp_path):
+    matrix = random_matrix(48)
+    src = write_v2(tmp_path / "blocks.fseq", matrix, COMPRESSION_ZLIB, block_frames=(33, 267))
+    assert_converted(src, write_reference(tmp_path / "ref.fseq", matrix), tmp_path, 'zlib')
+
+
+def run_in_place(path: Path):
+    return subprocess.run([sys.executable, str(CONVERT), str(path), '--in-place'],
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+
+def test_in_place_replaces_source(tmp_path):
+    matrix = random_matrix(48)
+    src = write_v2(tmp_path / "lightshow.fseq", matrix, COMPRESSION_ZLIB, block_frames=(100, 200))
+    assert run_in_place(src).returncode == 0
+    assert np.array_equal(frames_of(src), matrix)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["lightshow.fseq"]
+
+
+def test_in_place_failure_leaves_no_temp_file(tmp_path):
+    matrix = random_matrix(48)
+    src = write_v2(tmp_path / "lightshow.fseq", matrix, COMPRESSION_ZLIB, block_frames=(100, 200))
+    # Corrupt the second block, so the conversion fails part way through
+    data = bytearray(src.read_bytes())
+    data[-20:] = bytes(20)
+    src.write_bytes(bytes(data))
+
+    result = run_in_place(src)
+    assert result.returncode == 1, result.stdout
+    assert "Failed to convert" in result.stdout
+    assert src.read_bytes() == bytes(data)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["lightshow.fseq"]
@@ -0,0 +1,106 @@
+"""
+Changed ranges reported by diff.py, on the paths it takes to find them:
+identical compressed blocks skipped without decoding, decoded comparison
+when the layouts differ, and the joining of nearby changes.
+"""
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from diff import ChangedRange, diff_sequences
+from fseq import COMPRESSION_NONE, COMPRESSION_ZLIB, FseqWriter
+
+FRAMES = 2000
+STEP_MS = 20
+# FseqWriter's default block size for FRAMES frames
+BLOCK_FRAMES = 32
+
+
+def base_matrix() -> np.ndarray:
+    return np.random.default_rng(7).integers(0, 256, (FRAMES, 48), dtype=np.uint8)
+
+
+def edited(matrix: np.ndarray, *edits) -> np.ndarray:
+    """Copy of matrix with each (start, stop, channels) section changed."""
+    matrix = matrix.copy()
+    for start, stop, channels in edits:
+        matrix[start:stop, channels] ^= 0xFF
+    return matrix
+
+
+def write(path, matrix: np.ndarray, compression: int = COMPRESSION_NONE):
+    with FseqWriter(path, matrix.shape[1], len(matrix), STEP_MS,
+                    compression=compression) as out:
+        out.write_frames(matrix)
+    return path
+
+
+@pytest.fixture
+def pair(tmp_path):
+    def make(edits, old_compression=COMPRESSION_ZLIB, new_compression=COMPRESSION_ZLIB):
+        matrix = base_matrix()
+        old = write(tmp_path / "old.fseq", matrix, old_compression)
+        new = write(tmp_path / "new.fseq", edited(matrix, *edits), new_compression)
+        return old, new
+    return make
+
+
+def test_identical_blocks_are_skipped(pair):
+    old, new = pair([(100, 150, [0, 5])])
+    result = diff_sequences(old, new)
+    assert result.ranges == [ChangedRange(100, 150, (0, 5))]
+    blocks = -(-FRAMES // BLOCK_FRAMES)
+    assert result.segments == blocks
+    # Only the blocks holding frames 96-127 and 128-159 are decoded
+    assert result.segments_skipped == blocks - 2
+
+
+def test_identical_files(pair):
+    old, new = pair([])
+    result = diff_sequences(old, new)
+    assert result.identical
+    assert result.segments_skipped == result.segments
+
+
+@pytest.mark.parametrize('old_compression, new_compression', [
+    (COMPRESSION_NONE, COMPRESSION_ZLIB),
+    (COMPRESSION_ZLIB, COMPRESSION_NONE),
+], ids=['plain-to-zlib', 'zlib-to-plain'])
+def test_mixed_layouts_are_decoded(pair, old_compression, new_compression):
+    old, new = pair([(0, 3, [1]), (1000, 1001, [47]), (FRAMES - 10, FRAMES, [2, 3])],
+                    old_compression, new_compression)
+    result = diff_sequences(old, new, gap_seconds=0)
+    assert result.ranges == [
+        ChangedRange(0, 3, (1,)),
+        ChangedRange(1000, 1001, (47,)),
+        ChangedRange(FRAMES - 10, FRAMES, (2, 3)),
+    ]
+    assert result.segments_skipped == 0
+
+
+@pytest.mark.parametrize('compression', [COMPRESSION_NONE, COMPRESSION_ZLIB],
+                         ids=['plain', 'zlib'])
+def test_gap_merging(pair, compression):
+    # Frames 110-114 are unchanged between the two edits
+    old, new = pair([(100, 110, [0]), (115, 120, [1])], compression, compression)
+
+    merged = [ChangedRange(100, 120, (0, 1))]
+    split = [ChangedRange(100, 110, (0,)), ChangedRange(115, 120, (1,))]
+    assert diff_sequences(old, new).ranges == merged
+    assert diff_sequences(old, new, gap_seconds=0).ranges == split
+    # A gap of exactly 5 frames is joined, 4 is not
+    assert diff_sequences(old, new, gap_seconds=5 * STEP_MS / 1000).ranges == merged
+    assert diff_sequences(old, new, gap_seconds=4 * STEP_MS / 1000).ranges == split
+
+
+def test_change_across_a_block_boundary_is_one_range(pair):
+    # Block boundary at frame 128: the two halves are found in different
+    # segments and must be joined even with no gap allowed
+    old, new = pair([(120, 140, [4])])
+    result = diff_sequences(old, new, gap_seconds=0)
+    assert result.ranges == [ChangedRange(120, 140, (4,))]
+
+
+def test_adjacent_changes_with_no_gap_are_joined(pair):
+    old, new = pair([(200, 210, [0]), (210, 220, [1])], COMPRESSION_NONE, COMPRESSION_NONE)
+    assert diff_sequences(old, new, gap_seconds=0).ranges == [ChangedRange(200, 220, (0, 1))]
@@ -0,0 +1,280 @@
+"""
+Round trip of the disk image builder.
+
+A small image is built for each filesystem and read back with a reader
+written from the on-disk format rather than from disk_image's helpers: the
+MBR, the boot sector and its backup, the FATs, the exFAT boot checksum,
+entry-set checksums and name hashes, and finally every file's contents.
+"""
+import struct
+
+import pytest
+
+from disk_image import (FILESYSTEMS, PARTITION_START, PARTITION_TYPES, SECTOR_SIZE,
+                        build_image)
+
+BASE = PARTITION_START * SECTOR_SIZE
+
+FILES = {
+    'LightShow/lightshow.fseq': bytes(range(256)) * 400,
+    'LightShow/lightshow.wav': b'RIFF' + bytes(5000),
+    'LightShow/Empty.txt': b'',
+    'A much longer file name than 8.3 allows.txt': b'long name\n',
+    'Ünïcode show.fseq': b'\xff' * 700,
+    'README.TXT': b'short name only\n',
+}
+
+
+@pytest.fixture
+def sources(tmp_path):
+    files = {}
+    for index, (name, data) in enumerate(FILES.items()):
+        source = tmp_path / f"source{index}"
+        source.write_bytes(data)
+        files[name] = source
+    return files
+
+
+def read_sectors(image: bytes, sector: int, count: int = 1) -> bytes:
+    start = BASE + sector * SECTOR_SIZE
+    return image[start:start + count * SECTOR_SIZE]
+
+
+def check_mbr(image: bytes, fs: str):
+    assert image[510:512] == b'\x55\xaa'
+    kind, = struct.unpack_from('<B', image, 446 + 4)
+    start, sectors = struct.unpack_from('<II', image, 446 + 8)
+    assert kind == PARTITION_TYPES[fs]
+    assert start == PARTITION_START
+    assert (start + sectors) * SECTOR_SIZE == len(image)
+    # Only one partition
+    assert image[462:510] == bytes(48)
+
+
+def cluster_chain(fat: bytes, first: int, end: int):
+    chain = []
+    cluster = first
+    while cluster and cluster < end:
+        assert cluster not in chain, "FAT chain loops"
+        chain.append(cluster)
+        cluster, = struct.unpack_from('<I', fat, cluster * 4)
+    if chain:
+        assert cluster >= end, "FAT chain does not end"
+    return chain
+
+
+def read_chain(image: bytes, fat: bytes, first: int, end: int, data_start: int,
+               cluster_size: int) -> bytes:
+    return b''.join(
+        image[data_start + (c - 2) * cluster_size:data_start + (c - 1) * cluster_size]
+        for c in cluster_chain(fat, first, end)
+    )
+
+
+# FAT32
+
+def lfn_checksum(name11: bytes) -> int:
+    total = 0
+    for b in name11:
+        total = ((total >> 1) | ((total & 1) << 7)) + b & 0xFF
+    return total
+
+
+def lfn_text(entry: bytes) -> bytes:
+    return entry[1:11] + entry[14:26] + entry[28:32]
+
+
+def fat32_directory(image, fat, data_start, cluster_size, first, path=''):
+    """Yield (path, first cluster, size) of every file below a directory."""
+    raw = read_chain(image, fat, first, 0x0FFFFFF8, data_start, cluster_size)
+    long_parts = []
+    for offset in range(0, len(raw), 32):
+        entry = raw[offset:offset + 32]
+        if entry[0] == 0x00:
+            break
+        attr = entry[11]
+        if attr == 0x0F:
+            long_parts.append(entry)
+            continue
+        if attr & 0x08 or entry[0:1] == b'.':
+            assert not long_parts
+            continue
+
+        name11 = entry[0:11]
+        if long_parts:
+            assert long_parts[0][0] & 0x40, "first long name entry lacks the last flag"
+            orders = [e[0] & 0x3F for e in long_parts]
+            assert orders == list(range(len(long_parts), 0, -1))
+            assert all(e[13] == lfn_checksum(name11) for e in long_parts)
+            units = b''.join(lfn_text(e) for e in reversed(long_parts))
+            units = units.decode('utf-16-le')
+            name = units.split('\x00')[0]
+        else:
+            base, ext = name11[:8].decode().rstrip(), name11[8:].decode().rstrip()
+            name = f"{base}.{ext}" if ext else base
+        long_parts = []
+
+        high, = struct.unpack_from('<H', entry, 20)
+        low, size = struct.unpack_from('<HI', entry, 26)
+        cluster = (high << 16) | low
+        if attr & 0x10:
+            yield from fat32_directory(image, fat, data_start, cluster_size, cluster,
+                                       f"{path}{name}/")
+        else:
+            yield f"{path}{name}", cluster, size
+
+
+def read_fat32(image: bytes) -> dict:
+    boot = read_sectors(image, 0)
+    assert boot[510:512] == b'\x55\xaa'
+    assert boot[82:90] == b'FAT32   '
+    (bytes_per_sector, spc, reserved, fat_count) = struct.unpack_from('<HBHB', boot, 11)
+    fat_sectors, = struct.unpack_from('<I', boot, 36)
+    root_cluster, fsinfo_sector, backup_sector = struct.unpack_from('<IHH', boot, 44)
+    assert bytes_per_sector == SECTOR_SIZE
+    assert fat_count == 2
+    assert reserved % spc == (-2 * fat_sectors) % spc
+
+    # The whole three-sector boot record is repeated at the backup position
+    assert read_sectors(image, backup_sector, 3) == read_sectors(image, 0, 3)
+    fsinfo = read_sectors(image, fsinfo_sector)
+    assert struct.unpack_from('<I', fsinfo, 0)[0] == 0x41615252
+    assert struct.unpack_from('<I', fsinfo, 484)[0] == 0x61417272
+    assert fsinfo[510:512] == b'\x55\xaa'
+
+    first = read_sectors(image, reserved, fat_sectors)
+    second = read_sectors(image, reserved + fat_sectors, fat_sectors)
+    assert first == second
+    assert struct.unpack_from('<II', first, 0) == (0x0FFFFFF8, 0x0FFFFFFF)
+
+    cluster_size = spc * SECTOR_SIZE
+    data_start = BASE + (reserved + 2 * fat_sectors) * SECTOR_SIZE
+    contents = {}
+    for path, cluster, size in fat32_directory(image, first, data_start, cluster_size,
+                                               root_cluster):
+        data = read_chain(image, first, cluster, 0x0FFFFFF8, data_start, cluster_size)
+        contents[path] = data[:size]
+    return contents
+
+
+# exFAT
+
+def exfat_checksum(data: bytes, checksum: int, bits: int, skip=()) -> int:
+    mask = (1 << bits) - 1
+    for i, b in enumerate(data):
+        if i not in skip:
+            checksum = ((checksum >> 1) | ((checksum & 1) << (bits - 1))) + b & mask
+    return checksum
+
+
+def exfat_directory(image, fat, heap, cluster_size, first, upcase, path=''):
+    """Yield (path, first cluster, length) of every file below a directory."""
+    raw = read_chain(image, fat, first, 0xFFFFFFF8, heap, cluster_size)
+    offset = 0
+    while offset < len(raw) and raw[offset] != 0x00:
+        kind = raw[offset]
+        if kind != 0x85:
+            assert kind in (0x81, 0x82, 0x83), f"unexpected entry type {kind:#x}"
+            offset += 32
+            continue
+        secondary = raw[offset + 1]
+        entry_set = raw[offset:offset + 32 * (secondary + 1)]
+        offset += len(entry_set)
+
+        stored, = struct.unpack_from('<H', entry_set, 2)
+        assert stored == exfat_checksum(entry_set, 0, 16, skip=(2, 3))
+        attributes, = struct.unpack_from('<H', entry_set, 4)
+
+        stream = entry_set[32:64]
+        assert stream[0] == 0xC0
+        name_length, name_hash = stream[3], struct.unpack_from('<H', stream, 4)[0]
+        valid_length, = struct.unpack_from('<Q', stream, 8)
+        cluster, length = struct.unpack_from('<IQ', stream, 20)
+        assert valid_length == length
+
+        names = entry_set[64:]
+        assert all(names[i] == 0xC1 for i in range(0, len(names), 32))
+        units = b''.join(names[i + 2:i + 32] for i in range(0, len(names), 32))
+        units = units[:2 * name_length]
+        name = units.decode('utf-16-le')
+        upper = b''.join(upcase[2 * u:2 * u + 2]
+                         for u in struct.unpack(f'<{name_length}H', units))
+        assert name_hash == exfat_checksum(upper, 0, 16)
+
+        if attributes & 0x10:
+            yield from exfat_directory(image, fat, heap, cluster_size, cluster, upcase,
+                                       f"{path}{name}/")
+        else:
+            yield f"{path}{name}", cluster, length
+
+
+def read_exfat(image: bytes) -> dict:
+    region = read_sectors(image, 0, 12)
+    boot = region[:SECTOR_SIZE]
+    assert boot[3:11] == b'EXFAT   '
+    assert boot[510:512] == b'\x55\xaa'
+    checksum = 0
+    for index in range(11):
+        sector = region[index * SECTOR_SIZE:(index + 1) * SECTOR_SIZE]
+        checksum = exfat_checksum(sector, checksum, 32,
+                                  skip=(106, 107, 112) if index == 0 else ())
+    assert region[11 * SECTOR_SIZE:] == struct.pack('<I', checksum) * (SECTOR_SIZE // 4)
+    assert read_sectors(image, 12, 12) == region
+
+    partition_offset, volume_length = struct.unpack_from('<QQ', boot, 64)
+    fat_offset, fat_length, heap_offset, cluster_count, root_cluster = \
+        struct.unpack_from('<IIIII', boot, 80)
+    sector_shift, cluster_shift, fat_count = boot[108], boot[109], boot[110]
+    assert partition_offset == PARTITION_START
+    assert (PARTITION_START + volume_length) * SECTOR_SIZE == len(image)
+    assert sector_shift == 9
+    assert fat_count == 1
+
+    cluster_size = SECTOR_SIZE << cluster_shift
+    fat = read_sectors(image, fat_offset, fat_length)
+    assert struct.unpack_from('<II', fat, 0) == (0xFFFFFFF8, 0xFFFFFFFF)
+    heap = BASE + heap_offset * SECTOR_SIZE
+    end = 0xFFFFFFF8
+
+    root = read_chain(image, fat, root_cluster, end, heap, cluster_size)
+    entries = {root[i]: root[i:i + 32] for i in range(0, 96, 32)}
+    bitmap_cluster, bitmap_size = struct.unpack_from('<IQ', entries[0x81], 20)
+    upcase_sum, = struct.unpack_from('<I', entries[0x82], 4)
+    upcase_cluster, upcase_size = struct.unpack_from('<IQ', entries[0x82], 20)
+    bitmap = read_chain(image, fat, bitmap_cluster, end, heap, cluster_size)[:bitmap_size]
+    assert bitmap_size * 8 >= cluster_count
+    upcase = read_chain(image, fat, upcase_cluster, end, heap, cluster_size)[:upcase_size]
+    assert upcase_sum == exfat_checksum(upcase, 0, 32)
+
+    contents = {}
+    for path, cluster, length in exfat_directory(image, fat, heap, cluster_size,
+                                                 root_cluster, upcase):
+        chain = cluster_chain(fat, cluster, end)
+        assert all(bitmap[(c - 2) // 8] >> ((c - 2) % 8) & 1 for c in chain)
+        data = read_chain(image, fat, cluster, end, heap, cluster_size)
+        contents[path] = data[:length]
+    return contents
+
+
+READERS = {'fat32': read_fat32, 'exfat': read_exfat}
+
+
+@pytest.mark.parametrize('fs', FILESYSTEMS)
+def test_image_round_trip(tmp_path, sources, fs):
+    dest = tmp_path / f"show-{fs}.img"
+    info = build_image(dest, sources, fs=fs)
+    image = dest.read_bytes()
+
+    assert info.filesystem == fs
+    assert info.size == len(image)
+    assert info.file_count == len(FILES)
+    check_mbr(image, fs)
+    assert READERS[fs](image) == FILES
+
+
+@pytest.mark.parametrize('fs', FILESYSTEMS)
+def test_image_is_reproducible(tmp_path, sources, fs):
+    first, second = tmp_path / "first.img", tmp_path / "second.img"
+    build_image(first, sources, fs=fs)
+    build_image(second, sources, fs=fs)
+    assert first.read_bytes() == second.read_bytes()
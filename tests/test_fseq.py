@@ -0,0 +1,64 @@
+"""
+FseqFile edge cases: damaged files must fail with FseqError, never with an
+IndexError from deep inside frame access, and closing must not depend on
+every frame view having been dropped first.
+"""
+import struct
+
+import pytest
+
+from fseq import COMPRESSION_ZLIB, V2_HEADER_SIZE, FseqError, FseqFile, FseqWriter, SparseRange
+from generators import make_fseq
+
+FRAMES = 500
+
+
+def zero_block_index(path):
+    """Zero every block index entry, as unused pre-allocated slots are."""
+    data = bytearray(path.read_bytes())
+    index_end = V2_HEADER_SIZE + 8 * data[21]
+    data[V2_HEADER_SIZE:index_end] = bytes(index_end - V2_HEADER_SIZE)
+    path.write_bytes(bytes(data))
+
+
+@pytest.fixture
+def compressed(tmp_path):
+    path = make_fseq(tmp_path / "show.fseq", FRAMES, compression=COMPRESSION_ZLIB)
+    with FseqFile(path) as seq:
+        assert seq.header.blocks[0].first_frame == 0
+        assert sum(block.frame_count for block in seq.header.blocks) == FRAMES
+    return path
+
+
+def test_empty_block_index_is_rejected(compressed):
+    zero_block_index(compressed)
+    with pytest.raises(FseqError, match="do not cover"):
+        FseqFile(compressed)
+
+
+def test_block_index_starting_late_is_rejected(compressed):
+    data = bytearray(compressed.read_bytes())
+    struct.pack_into('<I', data, V2_HEADER_SIZE, 10)
+    compressed.write_bytes(bytes(data))
+    with pytest.raises(FseqError, match="do not cover"):
+        FseqFile(compressed)
+
+
+def test_close_with_live_views(tmp_path):
+    path = make_fseq(tmp_path / "show.fseq", FRAMES)
+    seq = FseqFile(path)
+    frame = seq.frame(3)
+    expected = bytes(frame)
+    seq.close()
+    # The view keeps the mapping alive until it is dropped
+    assert bytes(frame) == expected
+    seq.close()
+
+
+def test_sparse_ranges_must_match_channel_count(tmp_path):
+    path = tmp_path / "show.fseq"
+    with FseqWriter(path, 10, FRAMES, 20,
+                    sparse_ranges=[SparseRange(0, 4), SparseRange(20, 4)]) as out:
+        out.write_frames(bytes(FRAMES * 10))
+    with pytest.raises(FseqError, match="Sparse ranges hold 8 channels"):
+        FseqFile(path)
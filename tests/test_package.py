@@ -0,0 +1,49 @@
+"""
+Packaging refuses sequences Tesla cannot play, so they never reach a stick,
+and cuts long audio to the sequence when asked.
+"""
+import pytest
+
+from audio import probe_wav
+from fseq import COMPRESSION_ZLIB, FseqWriter, SparseRange
+from generators import make_fseq, make_show, make_wav
+from package import package_show
+
+
+@pytest.fixture
+def show(tmp_path):
+    return make_show(tmp_path / "shows" / "demo", seconds=1.0)
+
+
+def test_plain_show_is_packaged(show, tmp_path):
+    out = tmp_path / "build"
+    assert package_show(show, out)
+    assert (out / "LightShow" / "lightshow.fseq").is_file()
+
+
+def test_compressed_sequence_is_refused(show, tmp_path, capsys):
+    make_fseq(show / "lightshow.fseq", 25, step_time_ms=40, compression=COMPRESSION_ZLIB)
+    out = tmp_path / "build"
+    assert not package_show(show, out)
+    assert not out.exists()
+    assert "convert.py" in capsys.readouterr().out
+
+
+def test_sparse_sequence_is_refused(show, tmp_path):
+    with FseqWriter(show / "lightshow.fseq", 8, 25, 40,
+                    sparse_ranges=[SparseRange(0, 4), SparseRange(20, 4)]) as out:
+        out.write_frames(bytes(25 * 8))
+    assert not package_show(show, tmp_path / "build")
+
+
+@pytest.mark.parametrize('tail_pad, seconds', [(0.0, 1.0), (2.0, 3.0), (20.0, 10.0)],
+                         ids=['no-pad', 'pad', 'pad-past-the-end'])
+def test_trimmed_audio_keeps_tail_pad(show, tmp_path, tail_pad, seconds):
+    make_wav(show / "lightshow.wav", 10.0)
+    out = tmp_path / "build"
+    assert package_show(show, out, trim_audio=True, tail_pad=tail_pad)
+    audio = out / "LightShow" / "lightshow.wav"
+    assert probe_wav(audio).duration == seconds
+    if seconds == 10.0:
+        # Nothing to cut: the source is copied as it is
+        assert audio.read_bytes() == (show / "lightshow.wav").read_bytes()
@@ -0,0 +1,102 @@
+"""
+The upload service on localhost: concurrent identical uploads share one
+job, repeats come from the cache, uploads that expand past the size limit
+are refused, and stored results never outlive a change to the tools.
+"""
+import http.client
+import io
+import json
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from generators import make_show
+from serve import ShowServer, ShowService
+
+MAX_UPLOAD = 1024 * 1024
+CLIENTS = 6
+
+
+@pytest.fixture
+def server(tmp_path):
+    service = ShowService(tmp_path / "state", jobs=2)
+    server = ShowServer(('127.0.0.1', 0), service, MAX_UPLOAD, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def tar_of(directory, mode='w') -> bytes:
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode=mode) as tar:
+        tar.add(directory, arcname=directory.name)
+    return data.getvalue()
+
+
+def request(server, method, path, body=None):
+    host, port = server.server_address[:2]
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    try:
+        connection.request(method, path, body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_concurrent_uploads_share_one_job(server, tmp_path):
+    upload = tar_of(make_show(tmp_path / "shows" / "demo", seconds=2.0))
+
+    with ThreadPoolExecutor(CLIENTS) as pool:
+        answers = list(pool.map(lambda _: request(server, 'POST', '/validate', upload),
+                                range(CLIENTS)))
+    assert all(status == 200 for status, _ in answers)
+    results = [result for _, result in answers]
+    assert all(result['ok'] for result in results), results[0]['output']
+    assert len({result['key'] for result in results}) == 1
+
+    _, metrics = request(server, 'GET', '/metrics')
+    counts = metrics['requests']
+    assert counts['requests'] == CLIENTS
+    assert counts['cache_misses'] == 1
+    assert counts['shared'] + counts['cache_hits'] == CLIENTS - 1
+    assert metrics['queue'] == {'running': 0, 'waiting': 0}
+
+    status, again = request(server, 'POST', '/validate', upload)
+    assert status == 200
+    assert again['cached']
+    assert again['key'] == results[0]['key']
+    _, metrics = request(server, 'GET', '/metrics')
+    assert metrics['requests']['cache_misses'] == 1
+
+    status, stored = request(server, 'GET', f"/results/{again['key']}")
+    assert status == 200
+    assert stored['output'] == again['output']
+
+
+def test_upload_expanding_past_limit_is_refused(server, tmp_path):
+    show = tmp_path / "bomb"
+    show.mkdir()
+    (show / "lightshow.fseq").write_bytes(bytes(4 * MAX_UPLOAD))
+    upload = tar_of(show, 'w:gz')
+    assert len(upload) < MAX_UPLOAD
+
+    status, answer = request(server, 'POST', '/validate', upload)
+    assert status == 413
+    assert 'size limit' in answer['error']
+
+
+def test_tools_change_reruns_stored_shows(server, tmp_path):
+    upload = tar_of(make_show(tmp_path / "shows" / "demo", seconds=2.0))
+    _, first = request(server, 'POST', '/validate', upload)
+
+    server.service.version = "0" * 64
+    status, second = request(server, 'POST', '/validate', upload)
+    assert status == 200
+    assert not second['cached']
+    assert second['key'] != first['key']
@@ -0,0 +1,34 @@
+"""
+Show index reuse: unchanged shows come from the index, and a sequence or
+audio file overwritten in place (which leaves the directory's mtime alone)
+is noticed.
+"""
+import os
+
+from generators import make_show
+from show_index import ShowIndex
+
+
+def test_unchanged_shows_are_not_rescanned(tmp_path):
+    make_show(tmp_path / "alpha", seconds=1.0)
+    make_show(tmp_path / "beta", seconds=1.0)
+    assert ShowIndex(tmp_path).refresh()
+    index = ShowIndex(tmp_path)
+    index.refresh()
+    assert index.rescanned == 0
+
+
+def test_file_overwritten_in_place_is_rescanned(tmp_path):
+    show = make_show(tmp_path / "alpha", seconds=1.0)
+    ShowIndex(tmp_path).refresh()
+    dir_mtime = os.stat(show).st_mtime_ns
+
+    sequence = show / "lightshow.fseq"
+    with open(sequence, 'ab') as f:
+        f.write(bytes(48))
+    os.utime(show, ns=(dir_mtime, dir_mtime))
+
+    index = ShowIndex(tmp_path)
+    shows = index.refresh()
+    assert index.rescanned == 1
+    assert shows[0]['fseq']['size'] == sequence.stat().st_size
@@ -0,0 +1,42 @@
+"""
+Cold-start budget of the lightshow command.
+
+Scripts and git hooks run it thousands of times, so each command's --help
+must come up in a fresh interpreter within STARTUP_BUDGET. The fastest of
+a few runs is compared, as in the benchmarks, so a busy machine does not
+fail the test.
+"""
+import subprocess
+import sys
+import time
+
+import pytest
+
+from benchmarks import LIGHTSHOW, STARTUP_BUDGET
+
+RUNS = 5
+
+
+def fastest_run(*args) -> float:
+    command = [sys.executable, str(LIGHTSHOW)] + list(args)
+    best = float('inf')
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@pytest.mark.parametrize('args', [
+    ('--help',),
+    ('create', '--help'),
+    ('validate', '--help'),
+    ('package', '--help'),
+    ('list', '--help'),
+], ids=' '.join)
+def test_command_starts_within_budget(args):
+    elapsed = fastest_run(*args)
+    assert elapsed < STARTUP_BUDGET, (
+        f"lightshow {' '.join(args)} took {elapsed * 1000:.0f} ms, "
+        f"budget is {STARTUP_BUDGET * 1000:.0f} ms"
+    )
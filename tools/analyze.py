@@ -0,0 +1,748 @@
+#!/usr/bin/env python3
+"""
+Analyse a show's music and draft a starter light sequence.
+
+The WAV file is streamed in fixed-size chunks through a NumPy short-time
+Fourier transform, so memory stays bounded whatever the track length. Per
+STFT frame it keeps only a spectral-flux onset strength and the energy in
+a few frequency bands; tempo, beats and onsets are then derived from those
+small envelopes. ``write_starter_sequence`` maps the events to Tesla light
+channels and streams the result out as ``lightshow.fseq``.
+
+``analyze_sync`` goes the other way and checks an existing sequence: it
+cross-correlates the onset envelope with the frame-to-frame brightness
+increases of the lights, using FFTs over the whole show and over a batch
+of overlapping windows, and reports how far the lights are off the music
+and where that offset drifts.
+"""
+import sys
+import argparse
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional
+
+from utils import get_show_files, print_success, print_error, print_info, print_warning
+from audio import probe_wav, AudioError
+from fseq import FseqFile, FseqWriter, FseqError
+from show import Show
+import tesla
+
+
+# STFT parameters at the analysis sample rate (~22 kHz)
+N_FFT = 1024
+HOP = 512
+# PCM frames read per chunk (about 6 s at 44.1 kHz)
+CHUNK_FRAMES = 1 << 18
+
+# Band edges in Hz for the per-band energy envelopes
+BANDS = ((20, 200), (200, 2000), (2000, 8000))
+BAND_NAMES = ('low', 'mid', 'high')
+
+MIN_BPM = 60
+MAX_BPM = 180
+
+# Beat sync: onsets and light changes are compared on this time grid,
+# blurred so a change one frame off an onset still overlaps it, with swells
+# slower than SYNC_DETREND_SECONDS removed
+SYNC_GRID_SECONDS = 0.005
+SYNC_SMOOTH_SECONDS = 0.02
+SYNC_DETREND_SECONDS = 1.0
+# Largest offset searched for
+MAX_SYNC_OFFSET = 1.0
+# On steady music, offsets a whole beat apart correlate almost equally well;
+# the global offset prefers small values and each window prefers the global
+# offset, by Gaussian weights of these widths
+GLOBAL_PRIOR_SECONDS = 0.5
+WINDOW_PRIOR_SECONDS = 0.25
+# Windows checked for drift
+SYNC_WINDOW_SECONDS = 16.0
+SYNC_WINDOW_HOP = 8.0
+# Offsets viewers start to notice; never less than one frame
+SYNC_TOLERANCE_MS = 50
+# Weaker peaks mean the lights and music have too little in common to measure
+MIN_SYNC_CORRELATION = 0.1
+
+# Frames a light stays on for one beat or onset flash
+FLASH_FRAMES = 2
+# Leave some command memory free for hand edits
+COMMAND_HEADROOM = 0.9
+
+
+class DriftRegion(NamedTuple):
+    """A stretch of the show whose lights are off from the global offset."""
+    start: float              # seconds
+    end: float                # seconds
+    offset_ms: float          # median offset of the lights in the stretch
+
+
+class SyncReport(NamedTuple):
+    """How well a sequence's light changes line up with the music."""
+    offset_ms: Optional[float]    # lights late (+) or early (-); None if unrelated
+    correlation: float            # normalised cross-correlation peak
+    tolerance_ms: float
+    window_times: object          # window centres in seconds (NumPy array)
+    window_offsets: object        # ms per window, NaN where unmeasurable
+    regions: List[DriftRegion]
+
+    @property
+    def in_sync(self) -> bool:
+        if self.offset_ms is None:
+            return True
+        return abs(self.offset_ms) <= self.tolerance_ms and not self.regions
+
+
+class AudioAnalysis(NamedTuple):
+    """Envelopes and events extracted from a track."""
+    sample_rate: int          # analysis sample rate
+    hop_seconds: float        # time between envelope values
+    duration: float           # track length in seconds
+    tempo: float              # beats per minute
+    beats: object             # beat times in seconds (NumPy array)
+    onsets: object            # onset times in seconds (NumPy array)
+    onset_envelope: object    # spectral flux per STFT frame
+    band_energy: object       # (len(BANDS), frames) log energy
+
+
+def iter_wav_chunks(path: Path, chunk_frames: int = CHUNK_FRAMES) -> Iterator:
+    """
+    Yield the WAV's samples as mono float32 NumPy arrays in [-1, 1],
+    reading chunk_frames PCM frames at a time.
+    """
+    import numpy as np
+
+    info = probe_wav(path)
+    channels = info.channels
+    width = info.bits_per_sample // 8
+    block = width * channels
+    if width not in (1, 2, 3, 4) or block == 0:
+        raise AudioError(f"Unsupported sample width: {info.bits_per_sample} bits")
+
+    remaining = info.data_size - info.data_size % block
+    with open(path, 'rb') as f:
+        f.seek(info.data_offset)
+        while remaining > 0:
+            raw = f.read(min(remaining, chunk_frames * block))
+            if not raw:
+                break
+            raw = raw[:len(raw) - len(raw) % block]
+            remaining -= len(raw)
+
+            if info.float_samples:
+                dtype = '<f4' if width == 4 else '<f8'
+                samples = np.frombuffer(raw, dtype=dtype).astype(np.float32)
+            elif width == 1:
+                samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+            elif width == 2:
+                samples = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768
+            elif width == 3:
+                b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+                ints = (b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16))
+                ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+                samples = ints.astype(np.float32) / 8388608
+            else:
+                samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648
+
+            yield samples.reshape(-1, channels).mean(axis=1)
+
+
+def stream_features(path: Path):
+    """
+    Run the chunked STFT over a WAV file.
+
+    Returns:
+        (analysis_rate, duration, onset_envelope, band_energy)
+    """
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    info = probe_wav(path)
+    # Halve high sample rates: beats and bands live well below 11 kHz
+    decimate = 2 if info.sample_rate >= 32000 else 1
+    rate = info.sample_rate // decimate
+
+    window = np.hanning(N_FFT).astype(np.float32)
+    freqs = np.fft.rfftfreq(N_FFT, 1.0 / rate)
+    band_masks = [(freqs >= lo) & (freqs < hi) for lo, hi in BANDS]
+
+    carry = np.zeros(0, dtype=np.float32)
+    odd = np.zeros(0, dtype=np.float32)
+    prev = None
+    flux_parts = []
+    band_parts = []
+
+    for samples in iter_wav_chunks(path):
+        if decimate > 1:
+            samples = np.concatenate((odd, samples))
+            usable = len(samples) - len(samples) % 2
+            odd = samples[usable:]
+            samples = samples[:usable].reshape(-1, 2).mean(axis=1)
+        buffer = np.concatenate((carry, samples))
+        if len(buffer) < N_FFT:
+            carry = buffer
+            continue
+
+        frames = sliding_window_view(buffer, N_FFT)[::HOP]
+        consumed = len(frames) * HOP
+        carry = buffer[consumed:]
+
+        spectrum = np.abs(np.fft.rfft(frames * window, axis=1)).astype(np.float32)
+        log_mag = np.log1p(spectrum * 10)
+
+        previous = log_mag[:1] if prev is None else prev[None, :]
+        diff = np.diff(np.concatenate((previous, log_mag)), axis=0)
+        flux_parts.append(np.maximum(diff, 0).sum(axis=1))
+        prev = log_mag[-1]
+
+        power = spectrum ** 2
+        band_parts.append(np.stack([
+            np.log1p(power[:, mask].sum(axis=1)) for mask in band_masks
+        ]))
+
+    if flux_parts:
+        onset_envelope = np.concatenate(flux_parts)
+        band_energy = np.concatenate(band_parts, axis=1)
+    else:
+        onset_envelope = np.zeros(0, dtype=np.float32)
+        band_energy = np.zeros((len(BANDS), 0), dtype=np.float32)
+    return rate, info.duration, onset_envelope, band_energy
+
+
+def pick_onsets(envelope, hop_seconds: float, window_seconds: float = 1.0,
+                sensitivity: float = 1.5):
+    """Return onset times: local maxima above a moving mean + k * std threshold."""
+    import numpy as np
+
+    if len(envelope) < 3:
+        return np.zeros(0)
+    width = max(3, int(window_seconds / hop_seconds) | 1)
+    kernel = np.ones(width) / width
+    mean = np.convolve(envelope, kernel, mode='same')
+    sq_mean = np.convolve(envelope ** 2, kernel, mode='same')
+    std = np.sqrt(np.maximum(sq_mean - mean ** 2, 0))
+    threshold = mean + sensitivity * std
+
+    peaks = (envelope[1:-1] > envelope[:-2]) & (envelope[1:-1] >= envelope[2:])
+    peaks &= envelope[1:-1] > threshold[1:-1]
+    return (np.flatnonzero(peaks) + 1) * hop_seconds
+
+
+def estimate_beats(envelope, hop_seconds: float):
+    """
+    Estimate tempo by autocorrelation of the onset envelope, then track
+    beats from the best-matching phase.
+
+    Returns:
+        (tempo_bpm, beat_times)
+    """
+    import numpy as np
+
+    if len(envelope) < 4:
+        return 0.0, np.zeros(0)
+    centred = envelope - envelope.mean()
+    size = 1 << int(np.ceil(np.log2(2 * len(centred))))
+    spectrum = np.fft.rfft(centred, size)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum), size)[:len(centred)]
+
+    min_lag = max(1, int(60.0 / MAX_BPM / hop_seconds))
+    max_lag = min(len(autocorr) - 1, int(60.0 / MIN_BPM / hop_seconds))
+    if max_lag <= min_lag:
+        return 0.0, np.zeros(0)
+    lags = np.arange(min_lag, max_lag + 1)
+    # Mild preference for tempos near 120 BPM to avoid octave errors
+    weight = np.exp(-0.5 * np.log2(lags * hop_seconds / 0.5) ** 2)
+    lag = lags[np.argmax(autocorr[min_lag:max_lag + 1] * weight)]
+
+    # Refine the lag between envelope frames with a parabola through the peak
+    period = float(lag)
+    if min_lag < lag < max_lag:
+        left, centre, right = autocorr[lag - 1], autocorr[lag], autocorr[lag + 1]
+        curve = left - 2 * centre + right
+        if curve < 0:
+            period += 0.5 * (left - right) / curve
+
+    phases = np.arange(lag)
+    scores = np.array([envelope[p::lag][:int(8 * 60 / hop_seconds / period)].sum()
+                       for p in phases])
+
+    # Walk the grid, snapping each beat to the strongest onset within a
+    # tenth of a period so small tempo errors don't accumulate
+    radius = max(1, lag // 10)
+    beats = []
+    position = float(phases[np.argmax(scores)])
+    while position < len(envelope):
+        centre = int(round(position))
+        lo, hi = max(0, centre - radius), min(len(envelope), centre + radius + 1)
+        snapped = lo + int(np.argmax(envelope[lo:hi]))
+        beats.append(snapped)
+        position = snapped + period
+
+    # The tracked beats average out the envelope's time resolution
+    if len(beats) > 1:
+        period = (beats[-1] - beats[0]) / (len(beats) - 1)
+    return 60.0 / (period * hop_seconds), np.array(beats) * hop_seconds
+
+
+def analyze_wav(path: Path) -> AudioAnalysis:
+    """Analyse a WAV file with bounded memory."""
+    rate, duration, envelope, band_energy = stream_features(path)
+    hop_seconds = HOP / rate
+    tempo, beats = estimate_beats(envelope, hop_seconds)
+    onsets = pick_onsets(envelope, hop_seconds)
+    return AudioAnalysis(rate, hop_seconds, duration, tempo, beats, onsets,
+                         envelope, band_energy)
+
+
+def render_frames(analysis: AudioAnalysis, step_time_ms: int, beat_stride: int = 1,
+                  use_onsets: bool = True, use_bands: bool = True):
+    """
+    Map analysis events to a (frames, 48) Tesla channel matrix.
+
+    Beats flash the main beams, alternating sides; onsets blink the
+    signature lights; loud low and high passages hold the fog lights and
+    side markers on. Closures are never moved. Audio past the longest show
+    the car plays (tesla.MAX_DURATION_S) gets no frames.
+    """
+    import numpy as np
+
+    step = step_time_ms / 1000.0
+    frame_count = int(np.ceil(min(analysis.duration, tesla.MAX_DURATION_S) / step))
+    matrix = np.zeros((frame_count, tesla.CHANNEL_COUNTS[0]), dtype=np.uint8)
+    if frame_count == 0:
+        return matrix
+
+    def flash(times, channels):
+        starts = np.unique(np.clip((times / step).astype(int), 0, frame_count - 1))
+        for offset in range(FLASH_FRAMES):
+            rows = np.clip(starts + offset, 0, frame_count - 1)
+            matrix[np.ix_(rows, channels)] = 255
+
+    beats = analysis.beats[::beat_stride]
+    flash(beats[0::2], [0, 2])   # left main beams
+    flash(beats[1::2], [1, 3])   # right main beams
+
+    if use_onsets and len(analysis.onsets):
+        flash(analysis.onsets, [4, 5])
+
+    if use_bands and analysis.band_energy.shape[1]:
+        # Resample band envelopes to frame times, then hold lights on where
+        # a band is in its loudest quarter
+        env_times = np.arange(analysis.band_energy.shape[1]) * analysis.hop_seconds
+        frame_times = np.arange(frame_count) * step
+        for band, channels in ((0, [14, 15]), (2, [18, 19])):
+            energy = np.interp(frame_times, env_times, analysis.band_energy[band])
+            # Smooth over ~1 s so the lights don't chatter
+            width = max(1, int(1.0 / step))
+            energy = np.convolve(energy, np.ones(width) / width, mode='same')
+            loud = energy > np.percentile(energy, 75)
+            matrix[:, channels] |= np.where(loud, 255, 0).astype(np.uint8)[:, None]
+
+    return matrix
+
+
+def plan_frames(analysis: AudioAnalysis, step_time_ms: int):
+    """
+    Render a matrix that fits the car's command memory, thinning the
+    events until it does.
+
+    Warns when the audio is longer than the car plays (the draft stops
+    there) and when even the thinnest draft is over the command budget.
+
+    Returns:
+        (matrix, description of what was kept)
+    """
+    if analysis.duration > tesla.MAX_DURATION_S:
+        print_warning(f"Audio is {_format_time(analysis.duration)} long; the draft covers "
+                      f"the first {_format_time(tesla.MAX_DURATION_S)}, the longest "
+                      f"show the car plays (cut the music there with package.py --trim-audio)")
+    budget = tesla.COMMAND_MEMORY_LIMIT * COMMAND_HEADROOM
+    attempts = [
+        (1, True, True), (1, False, True), (2, False, True),
+        (2, False, False), (4, False, False), (8, False, False),
+    ]
+    for stride, onsets, bands in attempts:
+        matrix = render_frames(analysis, step_time_ms, stride, onsets, bands)
+        commands = tesla.command_count(matrix)
+        if commands <= budget:
+            break
+    else:
+        print_warning(f"Draft needs {commands} commands, more than the car's "
+                      f"{tesla.COMMAND_MEMORY_LIMIT}; thin it out before validating")
+    parts = [f"every {stride} beat(s)" if stride > 1 else "every beat"]
+    if onsets:
+        parts.append("onsets")
+    if bands:
+        parts.append("band energy")
+    return matrix, ", ".join(parts)
+
+
+def write_starter_sequence(analysis: AudioAnalysis, dest: Path,
+                           step_time_ms: int = 40) -> str:
+    """
+    Write a draft lightshow.fseq for an analysed track.
+
+    Returns:
+        Description of the events the draft uses
+    """
+    matrix, description = plan_frames(analysis, step_time_ms)
+    with FseqWriter(dest, matrix.shape[1], matrix.shape[0], step_time_ms) as out:
+        for start in range(0, len(matrix), 1024):
+            out.write_frames(matrix[start:start + 1024])
+    return description
+
+
+def light_flux(seq: FseqFile):
+    """
+    Sum of brightness increases over the light channels, per frame.
+
+    The sequence is streamed in chunks; closures are left out, as their
+    motors never move on the beat.
+    """
+    import numpy as np
+
+    lights = min(tesla.LIGHT_CHANNELS.stop, seq.channel_count)
+    prev = None
+    parts = []
+    for _, data in seq.iter_chunks():
+        frames = np.frombuffer(data, dtype=np.uint8).reshape(-1, seq.channel_count)
+        frames = frames[:, :lights].astype(np.int16)
+        previous = frames[:1] if prev is None else prev
+        diff = np.diff(np.concatenate((previous, frames)), axis=0)
+        parts.append(np.maximum(diff, 0).sum(axis=1))
+        prev = frames[-1:]
+    if not parts:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(parts).astype(np.float32)
+
+
+def _sync_signal(values, step_seconds: float, delay: float, length: int):
+    """
+    Place an envelope on the common sync grid, blur it and remove slow
+    swells, so that onsets and light changes compare as short pulses.
+    """
+    import numpy as np
+
+    grid = np.zeros(length, dtype=np.float64)
+    bins = np.round((np.arange(len(values)) * step_seconds + delay) / SYNC_GRID_SECONDS)
+    bins = bins.astype(np.int64)
+    keep = (bins >= 0) & (bins < length)
+    np.add.at(grid, bins[keep], values[keep])
+
+    sigma = SYNC_SMOOTH_SECONDS / SYNC_GRID_SECONDS
+    taps = np.arange(-int(3 * sigma), int(3 * sigma) + 1)
+    kernel = np.exp(-0.5 * (taps / sigma) ** 2)
+    grid = np.convolve(grid, kernel / kernel.sum(), mode='same')
+
+    width = max(1, int(SYNC_DETREND_SECONDS / SYNC_GRID_SECONDS))
+    grid -= np.convolve(grid, np.ones(width) / width, mode='same')
+    std = grid.std()
+    return grid / std if std > 0 else grid
+
+
+def _prior(lags, centre: float, width_seconds: float):
+    import numpy as np
+
+    return np.exp(-0.5 * ((lags - centre) * SYNC_GRID_SECONDS / width_seconds) ** 2)
+
+
+def _peak_lag(corr, centre: int, weight=None) -> float:
+    """
+    Index of the highest correlation, refined between grid steps with a
+    parabola through the peak. ``weight`` only steers which peak is picked.
+    """
+    import numpy as np
+
+    index = int(np.argmax(corr if weight is None else corr * weight))
+    lag = float(index)
+    if 0 < index < len(corr) - 1:
+        left, middle, right = corr[index - 1], corr[index], corr[index + 1]
+        curve = left - 2 * middle + right
+        if curve < 0:
+            lag += 0.5 * (left - right) / curve
+    return lag - centre
+
+
+def sync_report(onset_envelope, hop_seconds: float, flux, step_seconds: float) -> SyncReport:
+    """
+    Cross-correlate the music's onsets with the sequence's light changes.
+
+    The whole show is correlated in one FFT for the global offset. The
+    show is then cut into overlapping windows, which are correlated as one
+    batch of FFTs, each window preferring peaks near the global offset so
+    that it does not lock onto a neighbouring beat. Windows whose offset
+    is further than the tolerance from the global one are merged into
+    drift regions.
+
+    Args:
+        onset_envelope: Spectral flux per STFT frame, from stream_features()
+        hop_seconds: Time between onset envelope values
+        flux: Light changes per sequence frame, from light_flux()
+        step_seconds: Sequence frame interval
+
+    Returns:
+        SyncReport; offsets are positive when the lights are late
+    """
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    tolerance = max(SYNC_TOLERANCE_MS, step_seconds * 1000)
+    duration = max(len(onset_envelope) * hop_seconds, len(flux) * step_seconds)
+    length = int(np.ceil(duration / SYNC_GRID_SECONDS)) + 1
+    max_lag = int(round(MAX_SYNC_OFFSET / SYNC_GRID_SECONDS))
+    # Time each STFT frame at the centre of its window
+    delay = hop_seconds * (N_FFT / 2) / HOP
+    audio = _sync_signal(onset_envelope, hop_seconds, delay, length)
+    lights = _sync_signal(flux, step_seconds, 0.0, length)
+
+    no_windows = np.zeros(0)
+    energy = np.sqrt(np.dot(audio, audio) * np.dot(lights, lights))
+    if energy == 0:
+        return SyncReport(None, 0.0, tolerance, no_windows, no_windows, [])
+
+    # corr[k] = sum(lights[t + k] * audio[t])
+    size = 1 << int(np.ceil(np.log2(2 * length)))
+    spectrum = np.fft.rfft(lights, size) * np.conj(np.fft.rfft(audio, size))
+    corr = np.fft.irfft(spectrum, size)
+    corr = np.concatenate((corr[-max_lag:], corr[:max_lag + 1])) / energy
+    lags = np.arange(-max_lag, max_lag + 1)
+    lag = _peak_lag(corr, max_lag, _prior(lags, 0, GLOBAL_PRIOR_SECONDS))
+    correlation = float(corr[int(round(lag)) + max_lag])
+    if correlation < MIN_SYNC_CORRELATION:
+        return SyncReport(None, correlation, tolerance, no_windows, no_windows, [])
+    offset_ms = lag * SYNC_GRID_SECONDS * 1000
+
+    # Windowed offsets, all windows in one batch of FFTs
+    window = min(length, int(SYNC_WINDOW_SECONDS / SYNC_GRID_SECONDS))
+    hop = int(SYNC_WINDOW_HOP / SYNC_GRID_SECONDS)
+    starts = np.arange(0, length - window + 1, hop)
+    padded = np.concatenate((np.zeros(max_lag), lights, np.zeros(max_lag)))
+    audio_windows = sliding_window_view(audio, window)[starts]
+    light_windows = sliding_window_view(padded, window + 2 * max_lag)[starts]
+    size = 1 << int(np.ceil(np.log2(2 * (window + max_lag))))
+    spectra = np.fft.rfft(light_windows, size) * np.conj(np.fft.rfft(audio_windows, size))
+    windowed = np.fft.irfft(spectra, size)[:, :2 * max_lag + 1]
+    energies = np.sqrt((audio_windows ** 2).sum(axis=1)
+                       * (light_windows[:, max_lag:max_lag + window] ** 2).sum(axis=1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        windowed = windowed / energies[:, None]
+
+    prior = _prior(lags, lag, WINDOW_PRIOR_SECONDS)
+    times = (starts + window / 2) * SYNC_GRID_SECONDS
+    offsets = np.full(len(starts), np.nan)
+    for index, row in enumerate(windowed):
+        if np.isfinite(row).all() and row.max() >= MIN_SYNC_CORRELATION:
+            offsets[index] = _peak_lag(row, max_lag, prior) * SYNC_GRID_SECONDS * 1000
+
+    # Merge neighbouring windows that drift from the global offset
+    regions = []
+    drifting = np.abs(offsets - offset_ms) > tolerance
+    half_hop = SYNC_WINDOW_HOP / 2
+    index = 0
+    while index < len(offsets):
+        if not drifting[index]:
+            index += 1
+            continue
+        end = index
+        while end + 1 < len(offsets) and drifting[end + 1]:
+            end += 1
+        regions.append(DriftRegion(
+            max(0.0, float(times[index]) - half_hop), min(duration, float(times[end]) + half_hop),
+            float(np.median(offsets[index:end + 1])),
+        ))
+        index = end + 1
+
+    return SyncReport(offset_ms, correlation, tolerance, times, offsets, regions)
+
+
+def analyze_sync(audio_file: Path, fseq_file: Path) -> SyncReport:
+    """
+    Measure how well a sequence's light changes follow the music.
+
+    Both files are streamed in chunks. Requires NumPy and WAV audio.
+
+    Raises:
+        AudioError: If the audio cannot be read
+        FseqError: If the sequence cannot be read
+    """
+    rate, _, envelope, _ = stream_features(audio_file)
+    with FseqFile(fseq_file) as seq:
+        flux = light_flux(seq)
+        step_seconds = seq.header.step_time_ms / 1000.0
+    return sync_report(envelope, HOP / rate, flux, step_seconds)
+
+
+def _describe_offset(offset_ms: float) -> str:
+    side = "behind" if offset_ms > 0 else "ahead of"
+    return f"{abs(offset_ms):.0f} ms {side} the music"
+
+
+def check_beat_sync(show: Show, verbose: bool = False) -> bool:
+    """
+    Report whether a show's lights change on the music's onsets.
+
+    Prints the global offset and every stretch that drifts from it.
+
+    Returns:
+        False if the lights are measurably off the beat, True otherwise
+        (including when the show cannot be measured)
+    """
+    if not show.fseq_file or not show.audio_file:
+        return True
+    if show.audio_file.suffix != '.wav':
+        if verbose:
+            print_info("  Beat sync can only be measured with WAV audio")
+        return True
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        if verbose:
+            print_info("  Install numpy to check that the lights follow the beat")
+        return True
+
+    try:
+        report = analyze_sync(show.audio_file, show.fseq_file)
+    except (AudioError, FseqError, OSError) as e:
+        print_warning(f"Cannot measure beat sync: {e}")
+        return True
+    return print_sync_report(report, verbose)
+
+
+def print_sync_report(report: SyncReport, verbose: bool = False,
+                      windows: bool = False) -> bool:
+    """
+    Print a SyncReport: warnings for a global offset or drifting stretches
+    beyond the tolerance, and with verbose the measured offset.
+
+    Args:
+        windows: Also print the offset measured in every window
+
+    Returns:
+        report.in_sync
+    """
+    if report.offset_ms is None:
+        if verbose:
+            print_info(f"  Beat sync: lights do not follow the music's onsets "
+                       f"(correlation {report.correlation:.2f})")
+        return True
+
+    if verbose:
+        print_info(f"  Beat sync: {_describe_offset(report.offset_ms)} "
+                   f"(correlation {report.correlation:.2f})")
+    if windows:
+        for time, offset in zip(report.window_times.tolist(), report.window_offsets.tolist()):
+            measured = f"{offset:+.0f} ms" if offset == offset else "not measurable"
+            print_info(f"    {_format_time(time)}: {measured}")
+
+    if abs(report.offset_ms) > report.tolerance_ms:
+        print_warning(f"Lights are {_describe_offset(report.offset_ms)} "
+                      f"(tolerance {report.tolerance_ms:.0f} ms)")
+    for region in report.regions:
+        print_warning(f"Lights drift to {_describe_offset(region.offset_ms)} from "
+                      f"{_format_time(region.start)} to {_format_time(region.end)}")
+    if report.in_sync and verbose:
+        print_success(f"Lights follow the beat ({report.offset_ms:+.0f} ms)")
+    return report.in_sync
+
+
+def _format_time(seconds: float) -> str:
+    return f"{int(seconds // 60)}:{seconds % 60:04.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Analyse show music and draft a starter light sequence',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s shows/my-show               Print tempo, beats and onsets
+  %(prog)s shows/my-show --draft       Also write a starter lightshow.fseq
+  %(prog)s shows/my-show --sync -v     Check the lights follow the beat, per window
+
+With --sync the exit status is 1 when the lights are off the beat by more
+than the tolerance, overall or in any stretch, so it can gate CI.
+        """
+    )
+
+    parser.add_argument(
+        'show_dir',
+        type=Path,
+        help='Path to show directory'
+    )
+
+    parser.add_argument(
+        '--draft',
+        action='store_true',
+        help='Write a starter lightshow.fseq (never overwrites an existing one)'
+    )
+
+    parser.add_argument(
+        '--sync',
+        action='store_true',
+        help='Measure how far the sequence\'s light changes are from the music\'s onsets'
+    )
+
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='With --sync: print the offset measured in every window'
+    )
+
+    parser.add_argument(
+        '--fps',
+        type=int,
+        default=25,
+        help='Frame rate of the draft sequence (default: 25)'
+    )
+
+    args = parser.parse_args()
+
+    # Frames must be at least MIN_STEP_MS apart, and the header stores the
+    # interval in one byte
+    max_fps = 1000 // tesla.MIN_STEP_MS
+    min_fps = -(-1000 // 255)
+    if not min_fps <= args.fps <= max_fps:
+        parser.error(f"--fps must be between {min_fps} and {max_fps} "
+                     f"(Tesla needs frames at least {tesla.MIN_STEP_MS} ms apart)")
+
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print_error("analyze.py requires NumPy: pip install numpy")
+        sys.exit(1)
+
+    fseq_file, audio_file, _ = get_show_files(args.show_dir)
+    if not audio_file or audio_file.suffix != '.wav':
+        print_error("Analysis needs a .wav audio file in the show directory")
+        sys.exit(1)
+
+    if args.sync:
+        if not fseq_file:
+            print_error("Beat sync needs a .fseq file in the show directory")
+            sys.exit(1)
+        try:
+            report = analyze_sync(audio_file, fseq_file)
+        except (AudioError, FseqError, OSError) as e:
+            print_error(f"Cannot measure beat sync: {e}")
+            sys.exit(1)
+        in_sync = print_sync_report(report, verbose=True, windows=args.verbose)
+        sys.exit(0 if in_sync else 1)
+
+    try:
+        analysis = analyze_wav(audio_file)
+    except (AudioError, OSError) as e:
+        print_error(f"Cannot analyse {audio_file.name}: {e}")
+        sys.exit(1)
+
+    print_info(f"Duration: {analysis.duration:.2f}s")
+    print_info(f"Tempo: {analysis.tempo:.1f} BPM ({len(analysis.beats)} beats)")
+    print_info(f"Onsets: {len(analysis.onsets)}")
+
+    if args.draft:
+        if fseq_file:
+            print_warning(f"Not overwriting existing sequence: {fseq_file.name}")
+            sys.exit(1)
+        dest = args.show_dir / "lightshow.fseq"
+        description = write_starter_sequence(analysis, dest, int(round(1000 / args.fps)))
+        print_success(f"Wrote draft sequence: {dest} ({description})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,453 @@
+"""
+Header-only audio probes.
+
+Reads just enough of an audio file to know its exact duration: for WAV the
+RIFF chunk headers are walked with seeks until the ``fmt `` and ``data``
+chunks are found, so the cost is independent of the file size and no
+samples are ever read.
+
+For MP3 the ID3v2 tags are skipped and the first frame is checked for a
+Xing/Info or VBRI header, which carry the frame count. Files without one
+are measured by walking the 4-byte frame headers through a small fixed
+buffer. No audio is decoded in either case.
+
+The same header walks plan a shortened copy of a file (``plan_cut``): a
+WAV gets a new RIFF and ``data`` header in front of a prefix of its
+samples, an MP3 is cut after a whole frame. ``write_cut`` then moves the
+kept bytes file to file inside the kernel, so the samples never pass
+through Python.
+"""
+import math
+import os
+import struct
+from pathlib import Path
+from typing import NamedTuple, Optional, Tuple, Union
+
+from build_cache import copy_range
+from tracing import span, count, BYTES_READ, BYTES_WRITTEN
+
+
+class AudioError(ValueError):
+    """Raised when an audio file cannot be probed."""
+
+
+class AudioInfo(NamedTuple):
+    """Format and exact duration of an audio file."""
+    format: str               # 'wav' or 'mp3'
+    sample_rate: int
+    channels: int
+    duration: float           # seconds
+    bits_per_sample: int = 0  # WAV only
+    data_offset: int = 0      # byte offset of the sample data / first frame
+    data_size: int = 0        # bytes of sample data / audio frames
+    bitrate: int = 0          # bits per second (average for VBR MP3)
+    float_samples: bool = False  # WAV only: IEEE float rather than integer PCM
+    block_align: int = 0      # WAV only: bytes per sample frame
+
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def probe_wav(path: Path) -> AudioInfo:
+    """
+    Read the format and duration of a WAV file from its chunk headers.
+
+    Raises:
+        AudioError: If the file is not a readable RIFF/WAVE file
+    """
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        riff = f.read(12)
+        if len(riff) < 12 or riff[0:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            raise AudioError("Not a RIFF/WAVE file")
+
+        fmt = None
+        for chunk_id, body, chunk_size in _riff_chunks(f, file_size):
+            if chunk_id == b'fmt ':
+                if chunk_size < 16:
+                    raise AudioError("Truncated fmt chunk")
+                raw = f.read(min(chunk_size, 40))
+                fmt = list(struct.unpack_from('<HHIIHH', raw))
+                if fmt[0] == WAVE_FORMAT_EXTENSIBLE and len(raw) >= 26:
+                    # The real encoding is the first field of the sub-format GUID
+                    fmt[0] = struct.unpack_from('<H', raw, 24)[0]
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise AudioError("data chunk before fmt chunk")
+                # Streaming writers leave the size unset; trust the file length
+                data_size = min(chunk_size, file_size - body)
+                return _wav_info(fmt, body, data_size)
+
+    raise AudioError("No data chunk found")
+
+
+def _riff_chunks(f, file_size: int):
+    """
+    Walk the top-level chunks of a RIFF file with seeks.
+
+    Yields:
+        (chunk_id, body_offset, body_size), with the file positioned at
+        the start of the body
+    """
+    pos = 12
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+        yield chunk_id, pos + 8, chunk_size
+        # Chunks are padded to an even length
+        pos += 8 + chunk_size + (chunk_size & 1)
+
+
+def _wav_info(fmt, data_offset: int, data_size: int) -> AudioInfo:
+    audio_format, channels, sample_rate, byte_rate, block_align, bits = fmt
+    if audio_format not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        raise AudioError(f"Unsupported WAV encoding 0x{audio_format:04x}")
+    if not sample_rate or not block_align:
+        raise AudioError("Invalid WAV format header")
+    frames = data_size // block_align
+    return AudioInfo(
+        'wav', sample_rate, channels, frames / sample_rate,
+        bits_per_sample=bits, data_offset=data_offset, data_size=data_size,
+        bitrate=byte_rate * 8, float_samples=audio_format == WAVE_FORMAT_IEEE_FLOAT,
+        block_align=block_align,
+    )
+
+
+# MPEG audio frame header tables, indexed by version id (bits 19-20)
+MPEG_VERSIONS = {3: 1, 2: 2, 0: 25}  # 25 = MPEG 2.5; 1 is reserved
+SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    25: (11025, 12000, 8000),
+}
+# kbps by (MPEG-1?, layer)
+BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+MP3_BUFFER_SIZE = 64 * 1024
+
+
+class Mp3Frame(NamedTuple):
+    """Fields of one MPEG audio frame header."""
+    version: int          # 1, 2 or 25
+    layer: int            # 1, 2 or 3
+    bitrate: int          # bits per second
+    sample_rate: int
+    channels: int
+    samples: int          # samples per frame
+    length: int           # frame length in bytes, header included
+
+
+def parse_mp3_frame(header: bytes) -> Optional[Mp3Frame]:
+    """Parse a 4-byte MPEG audio frame header, or return None if invalid."""
+    if len(header) < 4:
+        return None
+    b0, b1, b2, b3 = header[0], header[1], header[2], header[3]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = MPEG_VERSIONS.get((b1 >> 3) & 0x03)
+    layer = 4 - ((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 0x03
+    if version is None or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version == 1
+    bitrate = BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 0x01
+    channels = 1 if (b3 >> 6) == 3 else 2
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or mpeg1:
+        samples = 1152
+        length = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 576
+        length = 72 * bitrate // sample_rate + padding
+    return Mp3Frame(version, layer, bitrate, sample_rate, channels, samples, length)
+
+
+def _skip_id3v2(f) -> int:
+    """Return the offset just past any ID3v2 tags at the start of the file."""
+    pos = 0
+    while True:
+        f.seek(pos)
+        header = f.read(10)
+        if len(header) < 10 or header[0:3] != b'ID3':
+            return pos
+        size = 0
+        for b in header[6:10]:
+            size = (size << 7) | (b & 0x7F)
+        footer = 10 if header[5] & 0x10 else 0
+        pos += 10 + size + footer
+
+
+def _find_first_frame(f, start: int):
+    """Find the first frame header that is followed by another valid frame."""
+    f.seek(start)
+    buffer = f.read(MP3_BUFFER_SIZE)
+    for i in range(len(buffer) - 3):
+        if buffer[i] != 0xFF:
+            continue
+        frame = parse_mp3_frame(buffer[i:i + 4])
+        if frame is None:
+            continue
+        f.seek(start + i + frame.length)
+        following = parse_mp3_frame(f.read(4))
+        if following is not None and following.sample_rate == frame.sample_rate:
+            return start + i, frame
+    raise AudioError("No MPEG audio frames found")
+
+
+def _vbr_header(f, offset: int, frame: Mp3Frame):
+    """
+    Read a Xing/Info or VBRI header from the first frame.
+
+    Returns:
+        (frame_count, byte_count, encoder_delay_samples) or None
+    """
+    f.seek(offset)
+    data = f.read(min(frame.length, 512))
+
+    if frame.version == 1:
+        side_info = 17 if frame.channels == 1 else 32
+    else:
+        side_info = 9 if frame.channels == 1 else 17
+    xing = 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack_from('>I', data, xing + 4)[0]
+        pos = xing + 8
+        frames = byte_count = None
+        if flags & 0x1:
+            frames = struct.unpack_from('>I', data, pos)[0]
+            pos += 4
+        if flags & 0x2:
+            byte_count = struct.unpack_from('>I', data, pos)[0]
+            pos += 4
+        if flags & 0x4:
+            pos += 100  # seek table
+        if flags & 0x8:
+            pos += 4    # quality
+        if frames is None:
+            return None
+        # LAME/Lavc extension: encoder delay and padding for gapless length
+        trim = 0
+        if data[pos:pos + 4] in (b'LAME', b'Lavc', b'Lavf') and len(data) >= pos + 24:
+            raw = data[pos + 21:pos + 24]
+            delay = (raw[0] << 4) | (raw[1] >> 4)
+            padding = ((raw[1] & 0x0F) << 8) | raw[2]
+            trim = delay + padding
+        return frames, byte_count, trim
+
+    vbri = 4 + 32
+    if data[vbri:vbri + 4] == b'VBRI' and len(data) >= vbri + 18:
+        byte_count, frames = struct.unpack_from('>II', data, vbri + 10)
+        return frames, byte_count, 0
+
+    return None
+
+
+def _walk_frames(f, offset: int, file_size: int, limit: Optional[int] = None):
+    """
+    Count frames by hopping from header to header.
+
+    Args:
+        limit: Stop after this many frames
+
+    Returns:
+        (frame_count, audio_bytes)
+    """
+    frames = 0
+    pos = offset
+    buffer = b''
+    buffer_start = offset
+    # A stream uses only a handful of distinct headers (the padding bit and,
+    # for VBR, the bitrate change), so each is parsed once
+    lengths = {}
+    while pos + 4 <= file_size and frames != limit:
+        rel = pos - buffer_start
+        if rel < 0 or rel + 4 > len(buffer):
+            f.seek(pos)
+            buffer = f.read(MP3_BUFFER_SIZE)
+            count(BYTES_READ, len(buffer))
+            buffer_start = pos
+            rel = 0
+        header = buffer[rel:rel + 4]
+        length = lengths.get(header)
+        if length is None:
+            frame = parse_mp3_frame(header)
+            length = lengths[header] = frame.length if frame is not None else 0
+        if length < 4:
+            break  # trailing ID3v1/APE tag or garbage
+        frames += 1
+        pos += length
+    return frames, min(pos, file_size) - offset
+
+
+def probe_mp3(path: Path) -> AudioInfo:
+    """
+    Read the format and exact duration of an MP3 file without decoding it.
+
+    Raises:
+        AudioError: If no MPEG audio frames are found
+    """
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        start = _skip_id3v2(f)
+        offset, first = _find_first_frame(f, start)
+
+        vbr = _vbr_header(f, offset, first)
+        if vbr is not None:
+            frames, byte_count, trim = vbr
+            # The Xing/VBRI frame itself carries no audio
+            data_offset = offset + first.length
+            data_size = byte_count - first.length if byte_count else file_size - data_offset
+            samples = max(frames * first.samples - trim, 0)
+        else:
+            data_offset = offset
+            frames, data_size = _walk_frames(f, offset, file_size)
+            samples = frames * first.samples
+
+    duration = samples / first.sample_rate
+    bitrate = int(data_size * 8 / duration) if duration else first.bitrate
+    return AudioInfo(
+        'mp3', first.sample_rate, first.channels, duration,
+        data_offset=data_offset, data_size=data_size, bitrate=bitrate,
+    )
+
+
+def probe_audio(path: Path) -> AudioInfo:
+    """
+    Probe an audio file by extension.
+
+    Raises:
+        AudioError: If the format is unsupported or the file is unreadable
+    """
+    suffix = Path(path).suffix.lower()
+    try:
+        with span('probe'):
+            if suffix == '.wav':
+                return probe_wav(path)
+            if suffix == '.mp3':
+                return probe_mp3(path)
+    except (OSError, struct.error) as e:
+        raise AudioError(f"Cannot read audio file: {e}")
+    raise AudioError(f"Cannot probe {suffix or 'unknown'} audio")
+
+
+# Shortened copies
+
+class AudioCut(NamedTuple):
+    """
+    How to write a shortened copy of an audio file.
+
+    ``pieces`` are written in order: bytes are written as given, and an
+    (offset, length) pair is that range of the source file.
+    """
+    pieces: Tuple[Union[bytes, Tuple[int, int]], ...]
+    size: int                 # bytes in the shortened file
+    duration: float           # seconds kept
+
+
+def _wav_cut(path: Path, seconds: float) -> Optional[AudioCut]:
+    info = probe_wav(path)
+    frames = math.ceil(seconds * info.sample_rate)
+    data_size = frames * info.block_align
+    if data_size >= info.data_size:
+        return None
+
+    # Chunks between the RIFF header and 'data' (fmt, LIST, ...) are kept
+    # as they are; chunks after the samples are dropped
+    data_header = info.data_offset - 8
+    pad = data_size & 1
+    size = data_header + 8 + data_size + pad
+    pieces = (
+        b'RIFF' + struct.pack('<I', size - 8) + b'WAVE',
+        (12, data_header - 12),
+        b'data' + struct.pack('<I', data_size),
+        (info.data_offset, data_size),
+    )
+    if pad:
+        pieces += (b'\x00',)
+    return AudioCut(pieces, size, frames / info.sample_rate)
+
+
+def _mp3_cut(path: Path, seconds: float) -> Optional[AudioCut]:
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        offset, first = _find_first_frame(f, _skip_id3v2(f))
+        # A Xing/VBRI frame would still announce the full length, so it is
+        # dropped along with everything after the last kept frame
+        data_offset = offset + first.length if _vbr_header(f, offset, first) else offset
+        frames = math.ceil(seconds * first.sample_rate / first.samples)
+        # Walk only as far as the cut, then check that more audio follows
+        kept, length = _walk_frames(f, data_offset, file_size, limit=frames)
+        f.seek(data_offset + length)
+        if kept < frames or parse_mp3_frame(f.read(4)) is None:
+            return None
+
+    pieces = ((0, offset), (data_offset, length))
+    return AudioCut(pieces, offset + length, frames * first.samples / first.sample_rate)
+
+
+def plan_cut(path: Path, seconds: float) -> Optional[AudioCut]:
+    """
+    Plan a copy of an audio file cut to at least ``seconds`` long.
+
+    A WAV is cut at the first sample frame past ``seconds``, an MP3 after
+    the first whole frame that reaches it. Only headers are read.
+
+    Returns:
+        The cut, or None if the file is no longer than ``seconds``
+
+    Raises:
+        AudioError: If the format is unsupported or the file is unreadable
+    """
+    suffix = Path(path).suffix.lower()
+    try:
+        with span('probe'):
+            if suffix == '.wav':
+                return _wav_cut(path, seconds)
+            if suffix == '.mp3':
+                return _mp3_cut(path, seconds)
+    except (OSError, struct.error) as e:
+        raise AudioError(f"Cannot read audio file: {e}")
+    raise AudioError(f"Cannot cut {suffix or 'unknown'} audio")
+
+
+def write_cut(src: Path, dest: Path, cut: AudioCut):
+    """
+    Write the shortened copy of src planned by ``plan_cut`` to dest.
+
+    Raises:
+        AudioError: If src no longer matches the plan
+        OSError: If a file cannot be read or written
+    """
+    with open(src, 'rb', buffering=0) as fsrc, open(dest, 'wb', buffering=0) as fdst:
+        for piece in cut.pieces:
+            if isinstance(piece, bytes):
+                fdst.write(piece)
+                count(BYTES_WRITTEN, len(piece))
+                continue
+            offset, length = piece
+            if copy_range(fsrc, fdst, offset, length) != length:
+                raise AudioError(f"{src} changed while it was being copied")
+
+
+def audio_duration(path: Path) -> Optional[float]:
+    """Return the exact duration in seconds, or None if it cannot be probed."""
+    try:
+        return probe_audio(path).duration
+    except AudioError:
+        return None
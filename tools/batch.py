@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Validate or package many Tesla Lightshows in parallel.
+
+Imports the validation and packaging code once and fans the shows out over
+a process pool. Each show's output is captured in its worker and printed as
+one block, so reports from different shows never interleave. With
+--timings each worker traces its show and the reports are summed, so span
+times are CPU-side totals across all workers rather than wall time.
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import contextlib
+from pathlib import Path
+from contextlib import nullcontext
+from typing import Dict, List, NamedTuple, Optional
+
+from utils import (
+    find_all_shows, print_success, print_error, print_info, Colors,
+    capture_messages, add_output_options, begin_output, end_output
+)
+from tracing import Tracer, tracer
+
+
+class ShowResult(NamedTuple):
+    """Outcome of running one task on one show."""
+    show: str
+    ok: bool
+    output: str
+    elapsed: float
+    messages: Optional[List[Dict]] = None   # with structured output
+    timings: Optional[Dict] = None          # tracer report, when tracing
+
+
+def _run_validate(show_dir: Path, verbose: bool, output_root: Optional[Path]) -> bool:
+    from validate import validate_show
+    return validate_show(show_dir, verbose=verbose)
+
+
+def _run_build(show_dir: Path, verbose: bool, output_root: Optional[Path]) -> bool:
+    from package import package_show
+    output_dir = output_root / show_dir.name if output_root else None
+    return package_show(show_dir, output_dir)
+
+
+def _run_sync(show_dir: Path, verbose: bool, output_root: Optional[Path]) -> bool:
+    from analyze import check_beat_sync
+    from show import Show
+    print_info(f"Checking beat sync: {show_dir.name}")
+    in_sync = check_beat_sync(Show.load(show_dir), verbose)
+    if in_sync:
+        print_success(f"No beat sync problems in '{show_dir.name}'")
+    return in_sync
+
+
+TASKS = {
+    'validate': _run_validate,
+    'build': _run_build,
+    'sync': _run_sync,
+}
+
+
+def run_task(task: str, show_dir: Path, verbose: bool = False,
+             output_root: Optional[Path] = None, trace: bool = False,
+             structured: bool = False) -> ShowResult:
+    """
+    Run one task on one show, capturing everything it prints.
+    
+    Args:
+        trace: Record spans and counters for this show
+        structured: Collect messages as a list instead of text
+    """
+    tracer.enable(trace)
+    buffer = io.StringIO()
+    capture = capture_messages() if structured else nullcontext(None)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(buffer), capture as messages:
+        try:
+            ok = TASKS[task](show_dir, verbose, output_root)
+        except Exception as e:
+            print_error(f"{task} failed: {e}")
+            ok = False
+    return ShowResult(show_dir.name, bool(ok), buffer.getvalue(),
+                      time.perf_counter() - start, messages,
+                      tracer.report() if trace else None)
+
+
+def run_batch(task: str, shows: List[Path], jobs: Optional[int] = None,
+              verbose: bool = False, output_root: Optional[Path] = None,
+              trace: bool = False, structured: bool = False) -> List[ShowResult]:
+    """
+    Run a task on every show, printing each show's output as it finishes.
+
+    Args:
+        task: 'validate', 'build' or 'sync'
+        shows: Show directories to process
+        jobs: Worker processes (default: CPU count); 1 runs in-process
+        verbose: Pass verbose output through to the task
+        output_root: Build output root (default: build/)
+        trace: Record a tracer report for each show
+        structured: Collect each show's messages instead of printing them
+
+    Returns:
+        One ShowResult per show, in completion order
+    """
+    results = []
+
+    def report(result: ShowResult):
+        if not structured:
+            sys.stdout.write(result.output)
+            print()
+            sys.stdout.flush()
+        results.append(result)
+
+    if jobs == 1 or len(shows) <= 1:
+        for show_dir in shows:
+            report(run_task(task, show_dir, verbose, output_root, trace, structured))
+        return results
+
+    # Only needed for parallel runs, and slow to import
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    workers = min(jobs or os.cpu_count() or 1, len(shows))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(run_task, task, show_dir, verbose, output_root, trace, structured)
+            for show_dir in shows
+        ]
+        for future in as_completed(futures):
+            report(future.result())
+    return results
+
+
+def print_summary(task: str, results: List[ShowResult], elapsed: float):
+    """Print a one-line-per-failure summary of a batch run."""
+    failed = sorted(r.show for r in results if not r.ok)
+    passed = len(results) - len(failed)
+    print(f"{Colors.BOLD}Summary ({task}):{Colors.END}")
+    print_info(f"{len(results)} show(s) in {elapsed:.2f}s")
+    if failed:
+        for name in failed:
+            print_error(f"{name}")
+        print_error(f"{len(failed)} failed, {passed} succeeded")
+    else:
+        print_success(f"All {passed} show(s) succeeded")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Validate or package all Tesla Lightshows in parallel',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s validate                  Validate every show in shows/
+  %(prog)s build -j 16               Package every show with 16 workers
+  %(prog)s validate shows/a shows/b  Validate specific shows
+  %(prog)s build --timings           Per-phase time and throughput for all shows
+  %(prog)s sync                      Fail if any show's lights are off the beat
+        """
+    )
+
+    parser.add_argument(
+        'task',
+        choices=sorted(TASKS),
+        help='What to run on each show'
+    )
+
+    parser.add_argument(
+        'shows',
+        nargs='*',
+        type=Path,
+        help='Show directories (default: every show in --directory)'
+    )
+
+    parser.add_argument(
+        '-d', '--directory',
+        type=Path,
+        default=Path('shows'),
+        help='Shows directory (default: shows/)'
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=None,
+        help='Number of worker processes (default: CPU count)'
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        type=Path,
+        help='Build output root (default: build/)'
+    )
+
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Verbose output with detailed information'
+    )
+
+    add_output_options(parser)
+
+    args = parser.parse_args()
+
+    trace = args.timings or args.format == 'json'
+    structured = args.format == 'json'
+    totals = Tracer()
+
+    with begin_output(args) as messages:
+        shows = args.shows or find_all_shows(args.directory)
+        if not shows:
+            print_info(f"No shows found in {args.directory}/")
+        # Keep the discovery time; workers reset the tracer per show
+        totals.merge(tracer.report())
+
+        start = time.perf_counter()
+        results = run_batch(args.task, shows, args.jobs, args.verbose, args.output,
+                            trace, structured)
+        elapsed = time.perf_counter() - start
+        if shows and not structured:
+            print_summary(args.task, results, elapsed)
+
+    for result in results:
+        if result.timings:
+            totals.merge(result.timings)
+    end_output(args, {
+        'tool': 'batch',
+        'task': args.task,
+        'elapsed': round(elapsed, 6),
+        'ok': all(r.ok for r in results),
+        'shows': [
+            {'show': r.show, 'ok': r.ok, 'elapsed': round(r.elapsed, 6),
+             'messages': r.messages}
+            for r in sorted(results, key=lambda r: r.show)
+        ],
+        'messages': messages,
+    }, totals.report())
+
+    sys.exit(0 if all(r.ok for r in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
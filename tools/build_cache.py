@@ -0,0 +1,367 @@
+"""
+Incremental build cache for packaged shows.
+
+Each output directory gets a manifest under ``build/.cache/`` recording,
+for every file written, the source's (size, mtime, inode) signature, its
+SHA-256 content hash and the signature of the written copy. A rebuild only
+stats the files involved: unchanged outputs are skipped without reading
+them. A source whose signature changed is copied again, in full, to a
+temporary file that is hashed on the way; if the content turns out to be
+the same as before, the temporary copy is thrown away and the existing
+output is left untouched, so a touched but identical file costs one read
+and one discarded write, but does not change the output.
+
+Files that do need writing are cloned with a hardlink (opt-in) or a
+reflink, or copied through a large aligned buffer that is hashed on the
+way, so a source is never read twice. Outputs that are not plain copies
+(such as trimmed audio) are written by a caller-supplied function and
+recorded with a ``variant`` describing how they were made. The hashes
+double as the checksum manifest of the packaged show.
+"""
+import hashlib
+import json
+import mmap
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from tracing import (
+    span, count, BYTES_READ, BYTES_WRITTEN, BUILD_CACHE_HITS, BUILD_CACHE_MISSES
+)
+
+
+CACHE_DIR = Path("build") / ".cache"
+
+# Linux FICLONE ioctl: share extents with the source on btrfs/xfs/...
+FICLONE = 0x40049409
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Copy buffer: a whole number of pages, large enough for sequential I/O
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def file_signature(path: Path) -> list:
+    """Return the (size, mtime_ns, inode) signature of a file."""
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def hash_file(path: Path) -> str:
+    """Return the SHA-256 hex digest of a file, read in large chunks."""
+    digest = hashlib.sha256()
+    with span('hash'), open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            count(BYTES_READ, len(chunk))
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _reflink(src_fd: int, dst_fd: int) -> bool:
+    try:
+        import fcntl
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def _copy_hashing(fsrc, fdst, size: int) -> str:
+    """
+    Copy between two unbuffered files through one page-aligned buffer,
+    hashing each chunk on its way through.
+
+    Returns:
+        SHA-256 hex digest of the data copied
+    """
+    digest = hashlib.sha256()
+    # Anonymous mmaps are page aligned, which keeps the reads and writes
+    # aligned all the way to the device
+    length = min(COPY_BUFFER_SIZE, max(mmap.PAGESIZE, -(-size // mmap.PAGESIZE) * mmap.PAGESIZE))
+    view = memoryview(mmap.mmap(-1, length))
+    while True:
+        n = fsrc.readinto(view)
+        if not n:
+            break
+        count(BYTES_READ, n)
+        chunk = view[:n]
+        digest.update(chunk)
+        written = 0
+        while written < n:
+            written += fdst.write(chunk[written:])
+        count(BYTES_WRITTEN, n)
+    return digest.hexdigest()
+
+
+def copy_range(fsrc, fdst, offset: int, length: int) -> int:
+    """
+    Append length bytes of fsrc, starting at offset, to fdst.
+
+    The data is moved inside the kernel with copy_file_range (or sendfile
+    where that is unavailable or refuses the pair of files) and never
+    enters Python; a buffered copy is the last resort. Both files must be
+    unbuffered.
+
+    Returns:
+        Bytes copied, short only if fsrc ends early
+    """
+    src, dst = fsrc.fileno(), fdst.fileno()
+    copied = 0
+    for name in ('copy_file_range', 'sendfile'):
+        if copied == length or not hasattr(os, name):
+            continue
+        started = copied
+        try:
+            while copied < length:
+                if name == 'copy_file_range':
+                    n = os.copy_file_range(src, dst, length - copied, offset + copied)
+                else:
+                    n = os.sendfile(dst, src, offset + copied, length - copied)
+                if n == 0:
+                    count(BYTES_WRITTEN, copied)
+                    return copied
+                copied += n
+        except OSError:
+            if copied > started:
+                raise
+    if copied < length:
+        fsrc.seek(offset + copied)
+        while copied < length:
+            chunk = fsrc.read(min(COPY_BUFFER_SIZE, length - copied))
+            if not chunk:
+                break
+            count(BYTES_READ, len(chunk))
+            written = 0
+            while written < len(chunk):
+                written += fdst.write(chunk[written:])
+            copied += len(chunk)
+    count(BYTES_WRITTEN, copied)
+    return copied
+
+
+def fast_copy(src: Path, dest: Path, hardlink: bool = False,
+              unless: Optional[str] = None) -> Tuple[Optional[str], str]:
+    """
+    Copy src to dest atomically, computing its SHA-256 in the same pass.
+
+    The source is read exactly once: a plain copy hashes the data as it
+    passes through, and a hardlink or reflink (which copy nothing) hashes
+    the source afterwards.
+
+    Args:
+        src: File to copy
+        dest: Destination path
+        hardlink: Hardlink dest to src when possible
+        unless: SHA-256 of dest's current content; if src hashes the same,
+            dest is left untouched
+
+    Returns:
+        Tuple of (method, sha256). The method is 'hardlink', 'reflink' or
+        'copy', or None if dest already matched ``unless``.
+    """
+    with span('copy'):
+        return _write_via_temp(dest, lambda tmp: _copy_to_temp(src, tmp, hardlink), unless)
+
+
+def fast_write(dest: Path, write: Callable[[Path], str],
+               unless: Optional[str] = None) -> Tuple[Optional[str], str]:
+    """
+    Produce dest atomically with a writer function, then hash the result.
+
+    Args:
+        dest: Destination path
+        write: Called with a temporary path to create; returns the method
+            name to report
+        unless: SHA-256 of dest's current content; if the new file hashes
+            the same, dest is left untouched
+
+    Returns:
+        Tuple of (method, sha256), as for fast_copy
+    """
+    def write_and_hash(tmp: Path) -> Tuple[str, str]:
+        method = write(tmp)
+        return method, hash_file(tmp)
+
+    with span('copy'):
+        return _write_via_temp(dest, write_and_hash, unless)
+
+
+def _write_via_temp(dest: Path, make: Callable[[Path], Tuple[str, str]],
+                    unless: Optional[str]) -> Tuple[Optional[str], str]:
+    tmp = dest.with_name(f".{dest.name}.tmp")
+    if tmp.exists():
+        tmp.unlink()
+    try:
+        method, digest = make(tmp)
+        if digest == unless:
+            tmp.unlink()
+            return None, digest
+        os.replace(tmp, dest)
+    except BaseException:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+    return method, digest
+
+
+def _copy_to_temp(src: Path, tmp: Path, hardlink: bool) -> Tuple[str, str]:
+    if hardlink:
+        try:
+            os.link(src, tmp)
+            return 'hardlink', hash_file(src)
+        except OSError:
+            pass
+
+    with open(src, 'rb', buffering=0) as fsrc, open(tmp, 'wb', buffering=0) as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        if _reflink(fsrc.fileno(), fdst.fileno()):
+            method, digest = 'reflink', None
+        else:
+            method, digest = 'copy', _copy_hashing(fsrc, fdst, size)
+    if digest is None:
+        digest = hash_file(src)
+    shutil.copystat(src, tmp)
+    return method, digest
+
+
+class BuildCache:
+    """
+    Manifest of the files written to one output directory.
+
+    Example:
+        cache = BuildCache(output_dir)
+        cache.install(fseq_file, output_dir / "LightShow" / "lightshow.fseq")
+        cache.save()
+    """
+
+    def __init__(self, output_dir: Path, cache_dir: Optional[Path] = None,
+                 hardlink: bool = False):
+        self.output_dir = Path(output_dir).absolute()
+        self.hardlink = hardlink
+        if cache_dir is None:
+            cache_dir = CACHE_DIR
+        key = hashlib.sha1(str(self.output_dir).encode('utf-8')).hexdigest()[:16]
+        self.manifest_path = Path(cache_dir) / f"{key}.json"
+        self.entries = self._load()
+        self.skipped = 0
+        self.written = 0
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.manifest_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('output_dir') != str(self.output_dir):
+            return {}
+        return data.get('files', {})
+
+    def save(self):
+        """Write the manifest atomically."""
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'output_dir': str(self.output_dir), 'files': self.entries}, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    def _key(self, dest: Path) -> str:
+        return os.path.relpath(Path(dest).absolute(), self.output_dir)
+
+    def _dest_intact(self, dest: Path, entry: Dict) -> bool:
+        try:
+            return file_signature(dest) == entry.get('dest')
+        except OSError:
+            return False
+
+    def install(self, src: Path, dest: Path, write: Optional[Callable[[Path], str]] = None,
+                variant: Optional[str] = None) -> Optional[str]:
+        """
+        Make dest a copy of src, skipping the write if it is already current.
+
+        Args:
+            src: Source file
+            dest: Output file
+            write: Produce dest from src some other way than a plain copy;
+                called with the path to write, returns the method name
+            variant: Describes what ``write`` does with src (e.g. where it
+                cuts it), so a change of options is rebuilt even when the
+                source is not
+
+        Returns:
+            None if the file was up to date, otherwise the copy method used
+        """
+        key = self._key(dest)
+        entry = self.entries.get(key)
+        signature = file_signature(src)
+
+        unless = None
+        if entry and self._dest_intact(dest, entry):
+            if entry.get('source') == signature and entry.get('variant') == variant:
+                self.skipped += 1
+                count(BUILD_CACHE_HITS)
+                return None
+            # Source was touched or replaced: copy it (hashing on the way)
+            # but keep the old output if the content turns out the same
+            unless = entry.get('sha256')
+
+        if write is None:
+            method, digest = fast_copy(src, dest, self.hardlink, unless=unless)
+        else:
+            method, digest = fast_write(dest, write, unless=unless)
+        if method is None:
+            entry['source'] = signature
+            self._set_variant(entry, variant)
+            self.skipped += 1
+            count(BUILD_CACHE_HITS)
+            return None
+
+        count(BUILD_CACHE_MISSES)
+        self.entries[key] = {
+            'source': file_signature(src),
+            'sha256': digest,
+            'dest': file_signature(dest),
+        }
+        self._set_variant(self.entries[key], variant)
+        self.written += 1
+        return method
+
+    @staticmethod
+    def _set_variant(entry: Dict, variant: Optional[str]):
+        if variant is None:
+            entry.pop('variant', None)
+        else:
+            entry['variant'] = variant
+
+    def digest(self, dest: Path) -> Optional[str]:
+        """Return the SHA-256 recorded for an output file, if any."""
+        entry = self.entries.get(self._key(dest))
+        return entry.get('sha256') if entry else None
+
+    def write_text(self, dest: Path, content: str) -> bool:
+        """
+        Write generated text to dest unless an identical copy is there.
+
+        Returns:
+            True if the file was written, False if it was up to date
+        """
+        data = content.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        key = self._key(dest)
+        entry = self.entries.get(key)
+        if entry and entry.get('sha256') == digest and self._dest_intact(dest, entry):
+            self.skipped += 1
+            count(BUILD_CACHE_HITS)
+            return False
+
+        count(BUILD_CACHE_MISSES)
+        tmp = dest.with_name(f".{dest.name}.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, dest)
+        count(BYTES_WRITTEN, len(data))
+        self.entries[key] = {'source': None, 'sha256': digest, 'dest': file_signature(dest)}
+        self.written += 1
+        return True
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""
+Bundle many Tesla Lightshows onto as few USB sticks as possible.
+
+Firmware that supports several shows plays every ``<name>.fseq`` in the
+``LightShow`` folder together with the audio file of the same name. This
+tool takes a list of shows and the capacity of a stick, drops shows whose
+sequence and audio are byte-identical to one already bundled, packs the
+rest onto sticks first-fit-decreasing by their on-disk size (in clusters
+of the target filesystem), and writes each stick's layout in one pass,
+either as a folder to copy or as a ready-to-flash disk image.
+
+Only files that share their size with another file are hashed, since a
+file with a unique size cannot be a duplicate.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from utils import (
+    find_all_shows, get_show_files, print_success, print_error, print_warning,
+    print_info, format_size, parse_size, Colors,
+    add_output_options, begin_output, end_output
+)
+from build_cache import hash_file, fast_copy
+from disk_image import FILESYSTEMS, ImageError, build_image, volume_capacity
+from verify import MANIFEST_NAME, write_manifest
+from tracing import traced
+
+
+BUNDLE_MANIFEST = "bundle.json"
+DEFAULT_OUTPUT = Path("build") / "bundle"
+
+
+class BundleFile(NamedTuple):
+    """One file of a show as it will be stored on the stick."""
+    name: str          # file name inside LightShow/
+    source: Path
+    size: int
+    key: str           # equal keys mean identical content
+
+
+class BundleShow(NamedTuple):
+    """A show to bundle: its sequence and audio file."""
+    name: str
+    show_dir: Path
+    files: Tuple[BundleFile, ...]
+
+    @property
+    def content(self) -> Tuple[str, ...]:
+        return tuple(f.key for f in self.files)
+
+
+def content_keys(paths: List[Path]) -> Dict[Path, str]:
+    """
+    Give every file a key that is equal only for identical contents.
+
+    Files are grouped by size first and only groups of two or more are
+    hashed, and a file reached through several paths (hardlinks) is
+    hashed once.
+
+    Returns:
+        Dict mapping each path to "<size>:<sha256>" or, for a file whose
+        size is unique, "<size>:<device>/<inode>"
+    """
+    by_size: Dict[int, List[Path]] = {}
+    inodes: Dict[Path, Tuple[int, int]] = {}
+    for path in paths:
+        st = os.stat(path)
+        inodes[path] = (st.st_dev, st.st_ino)
+        by_size.setdefault(st.st_size, []).append(path)
+
+    keys = {}
+    digests: Dict[Tuple[int, int], str] = {}
+    for size, group in by_size.items():
+        if len({inodes[path] for path in group}) == 1:
+            for path in group:
+                keys[path] = f"{size}:{inodes[path][0]}/{inodes[path][1]}"
+            continue
+        for path in group:
+            inode = inodes[path]
+            if inode not in digests:
+                digests[inode] = hash_file(path)
+            keys[path] = f"{size}:{digests[inode]}"
+    return keys
+
+
+def collect_shows(show_dirs: List[Path]) -> Tuple[List[BundleShow], List[Tuple[str, str]]]:
+    """
+    Find each show's files and drop exact duplicates.
+
+    Shows are named after their directory. Names that only differ in case
+    (which FAT cannot tell apart) get a numeric suffix.
+
+    Returns:
+        Tuple of (shows to bundle, [(duplicate show, show it duplicates)])
+    """
+    found = []
+    for show_dir in show_dirs:
+        fseq_file, audio_file, _ = get_show_files(show_dir)
+        if not fseq_file or not audio_file:
+            print_warning(f"Skipping {show_dir.name}: missing "
+                          f"{'.fseq' if not fseq_file else 'audio'} file")
+            continue
+        found.append((show_dir, fseq_file, audio_file))
+
+    keys = content_keys([path for _, fseq, audio in found for path in (fseq, audio)])
+
+    shows = []
+    duplicates = []
+    seen_content: Dict[Tuple[str, ...], str] = {}
+    seen_names = set()
+    for show_dir, fseq_file, audio_file in found:
+        name = show_dir.name
+        suffix = 2
+        while name.lower() in seen_names:
+            name = f"{show_dir.name}-{suffix}"
+            suffix += 1
+        files = tuple(
+            BundleFile(f"{name}{path.suffix.lower()}", path, path.stat().st_size, keys[path])
+            for path in (fseq_file, audio_file)
+        )
+        show = BundleShow(name, show_dir, files)
+        if show.content in seen_content:
+            duplicates.append((show_dir.name, seen_content[show.content]))
+            continue
+        seen_content[show.content] = name
+        seen_names.add(name.lower())
+        shows.append(show)
+    return shows, duplicates
+
+
+def _entry_bytes(name: str) -> int:
+    # Directory entries for one file: enough for both FAT32 long names
+    # (13 characters per entry) and exFAT entry sets
+    return 32 * (2 + -(-len(name) // 13))
+
+
+def _manifest_line_bytes(name: str) -> int:
+    # "<sha256>  LightShow/<name>\n"
+    return 64 + 2 + len(f"LightShow/{name}".encode('utf-8')) + 1
+
+
+class Stick:
+    """Shows assigned to one USB stick and the clusters they take up."""
+
+    def __init__(self, number: int, cluster_size: int, free_clusters: int):
+        self.number = number
+        self.cluster_size = cluster_size
+        self.free_clusters = free_clusters
+        self.shows: List[BundleShow] = []
+        self.data_clusters = 0
+        # '.', '..' and the end marker of LightShow/
+        self.dir_bytes = 96
+        self.manifest_bytes = 0
+
+    def clusters_for(self, show: BundleShow) -> int:
+        return sum(-(-f.size // self.cluster_size) for f in show.files)
+
+    def _used(self, data_clusters: int, dir_bytes: int, manifest_bytes: int) -> int:
+        # Root directory, LightShow/ and the checksum manifest
+        return (1 + -(-dir_bytes // self.cluster_size) + data_clusters
+                + -(-manifest_bytes // self.cluster_size))
+
+    def fits(self, show: BundleShow) -> bool:
+        dir_bytes = self.dir_bytes + sum(_entry_bytes(f.name) for f in show.files)
+        manifest_bytes = self.manifest_bytes + sum(_manifest_line_bytes(f.name)
+                                                   for f in show.files)
+        return self._used(self.data_clusters + self.clusters_for(show), dir_bytes,
+                          manifest_bytes) <= self.free_clusters
+
+    def add(self, show: BundleShow):
+        self.shows.append(show)
+        self.data_clusters += self.clusters_for(show)
+        self.dir_bytes += sum(_entry_bytes(f.name) for f in show.files)
+        self.manifest_bytes += sum(_manifest_line_bytes(f.name) for f in show.files)
+
+    @property
+    def used_bytes(self) -> int:
+        return self._used(self.data_clusters, self.dir_bytes,
+                          self.manifest_bytes) * self.cluster_size
+
+    @property
+    def capacity_bytes(self) -> int:
+        return self.free_clusters * self.cluster_size
+
+    @property
+    def name(self) -> str:
+        return f"stick-{self.number:02d}"
+
+
+def plan_bundle(shows: List[BundleShow], capacity: int, fs: str = 'fat32') -> List[Stick]:
+    """
+    Pack shows onto as few sticks as possible (first fit decreasing).
+
+    Args:
+        shows: Shows to pack
+        capacity: Usable size of one stick in bytes
+        fs: Filesystem the sticks are formatted with
+
+    Returns:
+        The sticks, each holding at least one show
+
+    Raises:
+        ValueError: If a show does not fit on an empty stick
+    """
+    cluster_size, free_clusters = volume_capacity(capacity, fs)
+    sticks: List[Stick] = []
+    empty = Stick(0, cluster_size, free_clusters)
+    order = sorted(shows, key=lambda show: (-empty.clusters_for(show), show.name))
+    for show in order:
+        for stick in sticks:
+            if stick.fits(show):
+                stick.add(show)
+                break
+        else:
+            stick = Stick(len(sticks) + 1, cluster_size, free_clusters)
+            if not stick.fits(show):
+                size = sum(f.size for f in show.files)
+                raise ValueError(f"{show.name} ({format_size(size)}) does not fit "
+                                 f"on a {format_size(capacity)} stick")
+            stick.add(show)
+            sticks.append(stick)
+    for stick in sticks:
+        stick.shows.sort(key=lambda show: show.name)
+    return sticks
+
+
+def write_stick_folder(stick: Stick, dest: Path):
+    """
+    Write a stick's LightShow/ folder and checksum manifest under dest.
+
+    Each distinct content is copied (and hashed) once; further files with
+    the same content are hardlinked to that copy (they still take their
+    own space once copied to a FAT stick).
+    """
+    lightshow_dir = dest / "LightShow"
+    lightshow_dir.mkdir(parents=True)
+    written: Dict[str, Tuple[Path, str]] = {}
+    digests = {}
+    for show in stick.shows:
+        for f in show.files:
+            target = lightshow_dir / f.name
+            if f.key in written:
+                first, digest = written[f.key]
+                digests[f"LightShow/{f.name}"] = digest
+                try:
+                    os.link(first, target)
+                    continue
+                except OSError:
+                    pass
+            _, digest = fast_copy(f.source, target)
+            written[f.key] = (target, digest)
+            digests[f"LightShow/{f.name}"] = digest
+    write_manifest(dest / MANIFEST_NAME, digests)
+
+
+def _stick_digests(stick: Stick) -> Dict[str, str]:
+    """SHA-256 of each of a stick's files, reusing those content_keys computed."""
+    by_key: Dict[str, str] = {}
+    digests = {}
+    for show in stick.shows:
+        for f in show.files:
+            if f.key not in by_key:
+                known = f.key.partition(':')[2]
+                by_key[f.key] = known if len(known) == 64 else hash_file(f.source)
+            digests[f"LightShow/{f.name}"] = by_key[f.key]
+    return digests
+
+
+def write_stick_image(stick: Stick, dest: Path, fs: str, capacity: int):
+    """Write a stick and its checksum manifest as a disk image no larger than capacity."""
+    files = {
+        f"LightShow/{f.name}": f.source
+        for show in stick.shows
+        for f in show.files
+    }
+    with tempfile.TemporaryDirectory(dir=dest.parent) as scratch:
+        manifest = Path(scratch) / MANIFEST_NAME
+        write_manifest(manifest, _stick_digests(stick),
+                       max(source.stat().st_mtime for source in files.values()))
+        files[MANIFEST_NAME] = manifest
+        build_image(dest, files, fs=fs, max_size=capacity)
+
+
+def _clear_previous(output_dir: Path) -> bool:
+    """Remove the sticks of an earlier bundle, refusing to touch anything else."""
+    if not output_dir.exists() or not any(output_dir.iterdir()):
+        return True
+    manifest = output_dir / BUNDLE_MANIFEST
+    if not manifest.exists():
+        print_error(f"{output_dir} is not empty and holds no earlier bundle; "
+                    f"choose another output directory")
+        return False
+    for entry in output_dir.iterdir():
+        if entry.name.startswith("stick-"):
+            if entry.is_dir():
+                shutil.rmtree(entry)
+            else:
+                entry.unlink()
+    manifest.unlink()
+    return True
+
+
+def stick_summary(stick: Stick) -> Dict:
+    """Return the manifest/JSON record of one stick."""
+    return {
+        'stick': stick.name,
+        'used_bytes': stick.used_bytes,
+        'capacity_bytes': stick.capacity_bytes,
+        'shows': [
+            {
+                'name': show.name,
+                'show_dir': str(show.show_dir),
+                'files': [f.name for f in show.files],
+            }
+            for show in stick.shows
+        ],
+    }
+
+
+def print_plan(sticks: List[Stick]):
+    """Print each stick's fill level and shows."""
+    for stick in sticks:
+        print(f"\n{Colors.BOLD}{stick.name}{Colors.END}  "
+              f"{format_size(stick.used_bytes)} / {format_size(stick.capacity_bytes)}")
+        for show in stick.shows:
+            size = sum(f.size for f in show.files)
+            print(f"  {show.name:<40} {format_size(size):>12}")
+    print()
+
+
+@traced('bundle')
+def bundle_shows(show_dirs: List[Path], capacity: int, output_dir: Path = None,
+                 fs: str = 'fat32', image: bool = False, dry_run: bool = False,
+                 show_plan: bool = True) -> Optional[List[Stick]]:
+    """
+    Plan and write a multi-show bundle.
+
+    Args:
+        show_dirs: Show directories to bundle
+        capacity: Usable size of one stick in bytes
+        output_dir: Where to write the sticks (default: build/bundle)
+        fs: Filesystem of the sticks ('fat32' or 'exfat')
+        image: Write each stick as a disk image instead of a folder
+        dry_run: Only print the plan
+        show_plan: Print the shows on each stick
+
+    Returns:
+        The planned sticks, or None on failure
+    """
+    if output_dir is None:
+        output_dir = DEFAULT_OUTPUT
+
+    shows, duplicates = collect_shows(show_dirs)
+    for duplicate, original in duplicates:
+        print_info(f"Skipping {duplicate}: identical to {original}")
+    if not shows:
+        print_error("No shows to bundle")
+        return None
+
+    try:
+        sticks = plan_bundle(shows, capacity, fs)
+    except (ValueError, ImageError) as e:
+        print_error(f"Cannot plan bundle: {e}")
+        return None
+
+    total = sum(f.size for show in shows for f in show.files)
+    print_info(f"{len(shows)} show(s), {format_size(total)}, on {len(sticks)} "
+               f"stick(s) of {format_size(capacity)} ({fs})")
+    if show_plan:
+        print_plan(sticks)
+
+    if dry_run:
+        return sticks
+
+    if not _clear_previous(output_dir):
+        return None
+    output_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        for stick in sticks:
+            if image:
+                dest = output_dir / f"{stick.name}.img"
+                write_stick_image(stick, dest, fs, capacity)
+            else:
+                dest = output_dir / stick.name
+                write_stick_folder(stick, dest)
+            print_success(f"Wrote {dest}")
+    except (ImageError, OSError) as e:
+        print_error(f"Failed to write bundle: {e}")
+        return None
+
+    with open(output_dir / BUNDLE_MANIFEST, 'w') as f:
+        json.dump({
+            'capacity_bytes': capacity,
+            'filesystem': fs,
+            'duplicates': [{'show': d, 'same_as': o} for d, o in duplicates],
+            'sticks': [stick_summary(stick) for stick in sticks],
+        }, f, indent=2)
+
+    print_success(f"\n✓ Bundle written to {output_dir.absolute()}")
+    if image:
+        print_info("Flash each image with e.g. sudo dd if=stick-01.img of=/dev/sdX bs=4M")
+    else:
+        print_info(f"Copy each stick-NN/LightShow folder and {MANIFEST_NAME} to the root "
+                   f"of its USB drive, then check it with tools/verify.py")
+    return sticks
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Bundle many Tesla Lightshows onto as few USB sticks as possible',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s --capacity 7.2G                    Bundle every show in shows/
+  %(prog)s shows/a shows/b --capacity 3.6G    Bundle specific shows
+  %(prog)s --capacity 28G --fs exfat --image  Write ready-to-flash images
+  %(prog)s --capacity 7.2G --dry-run          Only print the plan
+
+Sticks are sold in decimal gigabytes: an "8 GB" stick holds about 7.4G
+in the binary units used here.
+        """
+    )
+
+    parser.add_argument(
+        'shows',
+        nargs='*',
+        type=Path,
+        help='Show directories (default: every show in --directory)'
+    )
+
+    parser.add_argument(
+        '-c', '--capacity',
+        type=parse_size,
+        required=True,
+        metavar='SIZE',
+        help='Usable size of each stick, e.g. 7.2G or 950M'
+    )
+
+    parser.add_argument(
+        '-d', '--directory',
+        type=Path,
+        default=Path('shows'),
+        help='Shows directory (default: shows/)'
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        type=Path,
+        default=DEFAULT_OUTPUT,
+        help='Output directory (default: build/bundle)'
+    )
+
+    parser.add_argument(
+        '--fs',
+        choices=FILESYSTEMS,
+        default='fat32',
+        help='Filesystem of the sticks (default: fat32)'
+    )
+
+    parser.add_argument(
+        '--image',
+        action='store_true',
+        help='Write each stick as a disk image (stick-NN.img) instead of a folder'
+    )
+
+    parser.add_argument(
+        '-n', '--dry-run',
+        action='store_true',
+        help='Print the plan without writing anything'
+    )
+
+    add_output_options(parser)
+
+    args = parser.parse_args()
+
+    with begin_output(args) as messages:
+        shows = args.shows or find_all_shows(args.directory)
+        sticks = bundle_shows(shows, args.capacity, args.output, fs=args.fs,
+                              image=args.image, dry_run=args.dry_run,
+                              show_plan=args.format == 'text')
+    end_output(args, {
+        'tool': 'bundle',
+        'ok': sticks is not None,
+        'capacity_bytes': args.capacity,
+        'filesystem': args.fs,
+        'output_dir': None if args.dry_run else str(args.output),
+        'sticks': [stick_summary(stick) for stick in sticks or []],
+        'messages': messages,
+    })
+
+    sys.exit(0 if sticks is not None else 1)
+
+
+if __name__ == '__main__':
+    main()
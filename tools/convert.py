@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Convert any readable .fseq variant into the canonical FSEQ v2 layout.
+
+Archived shows come as FSEQ v1 files, v2 files with zlib or zstd blocks of
+uneven size, or sparse files holding only some channel ranges. This
+rewrites any of them as a plain v2 file with the full 48 or 200 channel
+layout Tesla plays: uncompressed by default, or re-blocked with zlib/zstd
+for archive copies.
+
+The source is read block by block with positioned reads rather than
+through a memory map, and blocks are decoded and encoded on a thread pool
+(zlib and zstd release the GIL) with a bounded number in flight, written
+out in order. Memory use is a fixed number of blocks whatever the size of
+the file, and every core is kept busy on compressed files.
+"""
+import os
+import sys
+import argparse
+from collections import deque
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+from utils import (
+    print_success, print_error, print_warning, print_info,
+    add_output_options, begin_output, end_output, format_size
+)
+from fseq import (
+    FseqHeader, FseqWriter, FseqError, parse_header, compress_block, decompress_block,
+    COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_ZSTD, COMPRESSION_NAMES,
+    V1_HEADER_SIZE,
+)
+from optimize import resolve_sequence
+from tracing import span, count, traced, BYTES_READ
+import tesla
+
+
+COMPRESSIONS = {'none': COMPRESSION_NONE, 'zlib': COMPRESSION_ZLIB, 'zstd': COMPRESSION_ZSTD}
+
+# Source bytes per read when the source is uncompressed
+READ_CHUNK_BYTES = 1024 * 1024
+# Decoded bytes allowed in flight across the pipeline; at least two blocks
+# per stage are always allowed
+MEMORY_LIMIT = 32 * 1024 * 1024
+
+
+class ConvertResult(NamedTuple):
+    """Summary of one conversion."""
+    source_layout: str
+    output_layout: str
+    source_size: int
+    output_size: int
+    channels: Tuple[int, int]       # (before, after)
+
+
+def read_header(f) -> FseqHeader:
+    """
+    Parse the header of an open FSEQ file, reading only the header bytes.
+
+    Raises:
+        FseqError: If the file is not a readable FSEQ sequence
+    """
+    size = os.fstat(f.fileno()).st_size
+    start = os.pread(f.fileno(), V1_HEADER_SIZE, 0)
+    if len(start) < 6:
+        raise FseqError("Not an FSEQ file (bad magic)")
+    data_offset = int.from_bytes(start[4:6], 'little')
+    return parse_header(os.pread(f.fileno(), max(data_offset, V1_HEADER_SIZE), 0), size)
+
+
+def target_channels(header: FseqHeader) -> int:
+    """Smallest Tesla channel count that holds every channel of the source."""
+    needed = header.channel_count
+    if header.sparse_ranges:
+        needed = max(r.start_channel + r.channel_count for r in header.sparse_ranges)
+    for tesla_count in tesla.CHANNEL_COUNTS:
+        if needed <= tesla_count:
+            return tesla_count
+    return needed
+
+
+def source_pieces(header: FseqHeader) -> List[Tuple[int, int, int]]:
+    """
+    Split the channel data into pieces to read and decode independently.
+
+    Returns:
+        (offset, stored_length, frame_count) per piece, in frame order
+    """
+    frame_size = header.channel_count
+    if header.compression != COMPRESSION_NONE:
+        return [(b.offset, b.length, b.frame_count) for b in header.blocks]
+    step = max(1, READ_CHUNK_BYTES // max(frame_size, 1))
+    pieces = []
+    for first in range(0, header.frame_count, step):
+        frames = min(step, header.frame_count - first)
+        pieces.append((header.data_offset + first * frame_size, frames * frame_size, frames))
+    return pieces
+
+
+class _Layout:
+    """Moves the source's stored channels into the output channel layout."""
+
+    def __init__(self, header: FseqHeader, out_channels: int):
+        self.in_channels = header.channel_count
+        self.out_channels = out_channels
+        self.columns = None
+        if header.sparse_ranges:
+            self.columns = [c for r in header.sparse_ranges
+                            for c in range(r.start_channel, r.start_channel + r.channel_count)]
+        elif out_channels != self.in_channels:
+            self.columns = list(range(self.in_channels))
+
+    def apply(self, data) -> bytes:
+        if self.columns is None:
+            return bytes(data)
+        import numpy as np
+
+        frames = np.frombuffer(data, dtype=np.uint8).reshape(-1, self.in_channels)
+        out = np.zeros((len(frames), self.out_channels), dtype=np.uint8)
+        out[:, self.columns] = frames
+        return out.tobytes()
+
+
+@traced('convert')
+def convert_sequence(src: Path, dest: Path, compression: str = 'none',
+                     level: Optional[int] = None, workers: Optional[int] = None) -> ConvertResult:
+    """
+    Rewrite any readable .fseq as a canonical FSEQ v2 file.
+
+    Args:
+        src: Source sequence (v1 or v2, any compression, sparse or not)
+        dest: Output file (must differ from src)
+        compression: 'none' (what Tesla plays), 'zlib' or 'zstd'
+        level: Compression level
+        workers: Threads decoding and encoding blocks (default: one per core)
+
+    Returns:
+        ConvertResult
+
+    Raises:
+        FseqError: If the source is unreadable or a codec is unavailable
+        OSError: If a file cannot be read or written
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    codec = COMPRESSIONS.get(compression)
+    if codec is None:
+        raise ValueError(f"Unknown compression: {compression}")
+    workers = max(1, workers or os.cpu_count() or 1)
+
+    with open(src, 'rb') as f, ThreadPoolExecutor(max_workers=workers) as pool:
+        fd = f.fileno()
+        header = read_header(f)
+        out_channels = target_channels(header)
+        layout = _Layout(header, out_channels)
+        if layout.columns is not None:
+            try:
+                import numpy  # noqa: F401
+            except ImportError:
+                raise FseqError("Converting sparse or non-Tesla channel layouts requires NumPy")
+
+        writer = FseqWriter(
+            dest, out_channels, header.frame_count, header.step_time_ms,
+            compression=codec, level=level,
+            variable_headers=header.variable_headers, unique_id=header.unique_id,
+        )
+        if codec == COMPRESSION_NONE:
+            out_frames = max(1, READ_CHUNK_BYTES // out_channels)
+        else:
+            out_frames = writer.frames_per_block
+        in_block = out_frames * header.channel_count
+        # Blocks in flight per stage, within the memory limit
+        window = max(2, min(2 * workers, MEMORY_LIMIT // (2 * max(in_block, 1))))
+
+        def decode(piece) -> bytes:
+            offset, length, frames = piece
+            stored = os.pread(fd, length, offset)
+            if len(stored) < length:
+                raise FseqError("Sequence is truncated")
+            expected = frames * header.channel_count
+            return decompress_block(stored, header.compression, expected)[:expected]
+
+        def encode(data) -> bytes:
+            data = layout.apply(data)
+            return compress_block(data, codec, level) if codec != COMPRESSION_NONE else data
+
+        decoded = deque()
+        encoded = deque()
+        pending = bytearray()
+
+        def write_oldest():
+            future, frames = encoded.popleft()
+            data = future.result()
+            if codec == COMPRESSION_NONE:
+                writer.write_frames(data)
+            else:
+                writer.write_block(data, frames)
+
+        def take(data):
+            # Re-block the decoded frames into output blocks
+            pending.extend(data)
+            while len(pending) >= in_block:
+                encoded.append((pool.submit(encode, bytes(pending[:in_block])), out_frames))
+                del pending[:in_block]
+                while len(encoded) > window:
+                    write_oldest()
+
+        with writer, span('blocks'):
+            for piece in source_pieces(header):
+                count(BYTES_READ, piece[1])
+                decoded.append(pool.submit(decode, piece))
+                while len(decoded) > window:
+                    take(decoded.popleft().result())
+            while decoded:
+                take(decoded.popleft().result())
+            if pending:
+                encoded.append((pool.submit(encode, bytes(pending)),
+                                len(pending) // header.channel_count))
+                pending.clear()
+            while encoded:
+                write_oldest()
+
+    output_layout = f"v2.0, {'uncompressed' if codec == COMPRESSION_NONE else COMPRESSION_NAMES[codec]}"
+    return ConvertResult(
+        header.layout, output_layout, os.path.getsize(src), os.path.getsize(dest),
+        (header.channel_count, out_channels),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert any FSEQ variant to the canonical v2 layout Tesla plays',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s archive/old-show.fseq -o shows/old-show/lightshow.fseq
+  %(prog)s shows/old-show --in-place             Convert a show's sequence in place
+  %(prog)s big.fseq -o big-v2.fseq --compress zstd -j 8
+                                                 Archive copy, 8 compression threads
+
+Reads FSEQ v1 and v2 files with any block layout, zlib or zstd compression
+and sparse channel ranges. Sparse files are expanded to the full 48 or 200
+channel layout.
+        """
+    )
+
+    parser.add_argument(
+        'source',
+        type=Path,
+        help='Path to .fseq file or show directory'
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        type=Path,
+        help='Output .fseq file'
+    )
+
+    parser.add_argument(
+        '--in-place',
+        action='store_true',
+        help='Replace the source file with the converted sequence'
+    )
+
+    parser.add_argument(
+        '--compress',
+        choices=sorted(COMPRESSIONS),
+        default='none',
+        help='Block compression (default: none, which Tesla requires)'
+    )
+
+    parser.add_argument(
+        '--level',
+        type=int,
+        help='Compression level'
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        help='Threads decoding and compressing blocks (default: one per core)'
+    )
+
+    add_output_options(parser)
+
+    args = parser.parse_args()
+
+    src = resolve_sequence(args.source)
+    if src is None:
+        print_error(f"No .fseq file found at: {args.source}")
+        sys.exit(1)
+
+    if args.in_place == bool(args.output):
+        print_error("Give exactly one of --output or --in-place")
+        sys.exit(1)
+
+    dest = src.with_name(f".{src.name}.converted") if args.in_place else args.output
+    if dest.absolute() == src.absolute():
+        print_error("Output must differ from the source (use --in-place)")
+        sys.exit(1)
+
+    result = None
+    with begin_output(args) as messages:
+        print_info(f"Converting: {src}")
+        try:
+            result = convert_sequence(src, dest, args.compress, args.level, args.jobs)
+        except (FseqError, ValueError, OSError) as e:
+            print_error(f"Failed to convert sequence: {e}")
+        else:
+            if args.in_place:
+                os.replace(dest, src)
+                dest = src
+            before, after = result.channels
+            print_info(f"  Source: {result.source_layout}, {before} channels")
+            if after != before:
+                print_info(f"  Channels: {before} → {after}")
+            if args.compress != 'none':
+                print_warning("Tesla only plays uncompressed sequences; keep this file for archiving")
+            print_success(
+                f"Wrote {dest} ({result.output_layout}): {format_size(result.source_size)} → "
+                f"{format_size(result.output_size)}"
+            )
+    end_output(args, {
+        'tool': 'convert',
+        'source': str(src),
+        'output': str(dest),
+        'ok': result is not None,
+        'result': result._asdict() if result else None,
+        'messages': messages,
+    })
+
+    sys.exit(0 if result is not None else 1)
+
+
+if __name__ == '__main__':
+    main()
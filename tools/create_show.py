@@ -5,23 +5,68 @@ Create a new Tesla Lightshow from template.
 Sets up directory structure and metadata file for a new show.
 """
 import sys
+import shutil
+import time
 import argparse
 from pathlib import Path
-from datetime import datetime
 
 from utils import (
     normalize_show_name, save_metadata, print_success,
-    print_error, print_info
+    print_error, print_info, print_warning
 )
+from audio import probe_audio, AudioError
 
 
-def create_show(show_name: str, shows_dir: Path = None) -> bool:
+def add_audio(show_dir: Path, audio_file: Path, metadata: dict, fps: int) -> bool:
+    """
+    Copy the show's music in and, for WAV files, draft a starter sequence.
+    
+    Updates metadata with the audio format and probed duration.
+    
+    Returns:
+        True if a draft lightshow.fseq was written
+    """
+    suffix = audio_file.suffix.lower()
+    dest = show_dir / f"lightshow{suffix}"
+    shutil.copyfile(audio_file, dest)
+    print_success(f"Created: {dest.name}")
+    
+    metadata["audio_format"] = suffix.lstrip('.')
+    try:
+        metadata["duration"] = round(probe_audio(dest).duration, 2)
+    except AudioError as e:
+        print_warning(f"Could not read audio duration: {e}")
+        return False
+    
+    if suffix != '.wav':
+        print_info("Starter sequences are only drafted from WAV audio")
+        return False
+    try:
+        from analyze import analyze_wav, write_starter_sequence
+        analysis = analyze_wav(dest)
+    except ImportError:
+        print_info("Install NumPy to draft a starter sequence from the audio")
+        return False
+    except AudioError as e:
+        print_warning(f"Could not analyse the audio for a starter sequence: {e}")
+        return False
+    
+    description = write_starter_sequence(analysis, show_dir / "lightshow.fseq",
+                                         int(round(1000 / fps)))
+    print_success(f"Created: lightshow.fseq (draft at {analysis.tempo:.0f} BPM, "
+                  f"{description})")
+    return True
+
+
+def create_show(show_name: str, shows_dir: Path = None,
+                audio_file: Path = None) -> bool:
     """
     Create a new show directory with template files.
     
     Args:
         show_name: Human-readable name for the show
         shows_dir: Directory to create show in (default: shows/)
+        audio_file: Music to copy in and draft a starter sequence from
     
     Returns:
         True if successful, False otherwise
@@ -39,6 +84,10 @@ def create_show(show_name: str, shows_dir: Path = None) -> bool:
         print_error(f"Show already exists: {show_dir}")
         return False
     
+    if audio_file is not None and audio_file.suffix.lower() not in ('.wav', '.mp3'):
+        print_error(f"Audio must be a .wav or .mp3 file: {audio_file}")
+        return False
+    
     print_info(f"Creating new show: {show_name}")
     print_info(f"Directory: {show_dir}")
     
@@ -52,11 +101,15 @@ def create_show(show_name: str, shows_dir: Path = None) -> bool:
             "artist": "Unknown Artist",
             "duration": 0,
             "description": "A custom Tesla light show",
-            "created": datetime.now().strftime("%Y-%m-%d"),
+            "created": time.strftime("%Y-%m-%d"),
             "fps": 25,
             "audio_format": "wav"
         }
         
+        drafted = False
+        if audio_file is not None:
+            drafted = add_audio(show_dir, audio_file, metadata, metadata["fps"])
+        
         metadata_file = show_dir / "metadata.json"
         save_metadata(metadata_file, metadata)
         print_success(f"Created: metadata.json")
@@ -119,6 +172,14 @@ Edit `metadata.json` to update show information:
         print_success(f"Created: README.md")
         
         # Create placeholder file to remind about required files
+        if drafted:
+            print_success(f"\n✓ Show created successfully!")
+            print_info(f"\nNext steps:")
+            print_info(f"  1. Open the draft lightshow.fseq in xLights and refine it")
+            print_info(f"  2. Validate: python tools/validate.py {show_dir}")
+            print_info(f"  3. Package: python tools/package.py {show_dir}")
+            return True
+        
         placeholder_file = show_dir / "PLACE_YOUR_FILES_HERE.txt"
         placeholder_content = """Place your show files here:
 
@@ -163,6 +224,7 @@ def main():
 Examples:
   %(prog)s "My Awesome Show"           Create show in shows/ directory
   %(prog)s "Holiday Special" -d custom Create show in custom/ directory
+  %(prog)s "Jingle" --audio jingle.wav Copy the music in and draft a sequence
         """
     )
     
@@ -178,10 +240,20 @@ Examples:
         help='Base directory for shows (default: shows/)'
     )
     
+    parser.add_argument(
+        '--audio',
+        type=Path,
+        help='Audio file to add; a WAV also gets a starter lightshow.fseq'
+    )
+    
     args = parser.parse_args()
     
+    if args.audio is not None and not args.audio.is_file():
+        print_error(f"Audio file not found: {args.audio}")
+        sys.exit(1)
+    
     # Create the show
-    success = create_show(args.name, args.directory)
+    success = create_show(args.name, args.directory, args.audio)
     
     sys.exit(0 if success else 1)
 
@@ -0,0 +1,800 @@
+"""
+Build ready-to-flash FAT32 or exFAT USB disk images.
+
+The image holds an MBR partition table with one partition at 1 MiB, like a
+freshly formatted stick. Every file and directory is laid out in one
+contiguous run of clusters, decided up front, so the image is written in a
+single pass of increasing offsets: boot region, FAT, directories, then the
+file data streamed straight from the sources in large copies. The image is
+created as a sparse file, so free space costs nothing on disk.
+
+Timestamps and volume serial numbers are derived from the sources, so the
+same show always produces a byte-identical image.
+"""
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from tracing import span, count, BYTES_WRITTEN
+
+
+SECTOR_SIZE = 512
+# Partition start in sectors: 1 MiB, as fdisk and Windows align it
+PARTITION_START = 2048
+MB = 1024 * 1024
+# Images are at least this large when no size is given
+MIN_AUTO_SIZE = 64 * MB
+COPY_CHUNK = 8 * MB
+
+FILESYSTEMS = ('fat32', 'exfat')
+DEFAULT_LABEL = "LIGHTSHOW"
+
+# MBR partition type codes
+PARTITION_TYPES = {'fat32': 0x0C, 'exfat': 0x07}
+
+FAT32_RESERVED_SECTORS = 32
+FAT32_MIN_CLUSTERS = 65525
+FAT32_MAX_CLUSTERS = 0x0FFFFFF5
+FAT32_MAX_FILE_SIZE = 0xFFFFFFFF
+FAT32_END_OF_CHAIN = 0x0FFFFFFF
+
+EXFAT_BOOT_REGION_SECTORS = 12
+EXFAT_FAT_OFFSET = 128
+EXFAT_END_OF_CHAIN = 0xFFFFFFFF
+
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_ARCHIVE = 0x20
+ATTR_LONG_NAME = 0x0F
+
+# Characters allowed in FAT short names besides A-Z and 0-9
+SHORT_NAME_CHARS = set("!#$%&'()-@^_`{}~")
+# Characters never allowed in a file name
+INVALID_NAME_CHARS = set('"*/:<>?\\|') | {chr(c) for c in range(32)}
+
+
+class ImageError(ValueError):
+    """Raised when the files do not fit or cannot be stored in the image."""
+
+
+class ImageInfo(NamedTuple):
+    """Summary of a built image."""
+    filesystem: str
+    size: int              # image file size in bytes
+    cluster_size: int
+    used_bytes: int        # bytes of clusters in use
+    file_count: int
+
+
+class _Node:
+    """A file or directory to be placed in the image."""
+    __slots__ = ('name', 'source', 'size', 'mtime', 'children',
+                 'first_cluster', 'clusters', 'parent')
+
+    def __init__(self, name: str, source: Optional[Path] = None,
+                 size: int = 0, mtime: float = 0.0):
+        self.name = name
+        self.source = source
+        self.size = size
+        self.mtime = mtime
+        self.children = None if source is not None else {}
+        self.first_cluster = 0
+        self.clusters = 0
+        self.parent = None
+
+    @property
+    def is_dir(self) -> bool:
+        return self.children is not None
+
+    def walk_dirs(self) -> List['_Node']:
+        """This directory and all directories below it, breadth first."""
+        dirs = [self]
+        for node in dirs:
+            dirs.extend(child for child in node.sorted_children() if child.is_dir)
+        return dirs
+
+    def walk_files(self) -> List['_Node']:
+        files = []
+        for directory in self.walk_dirs():
+            files.extend(child for child in directory.sorted_children() if not child.is_dir)
+        return files
+
+    def sorted_children(self) -> List['_Node']:
+        return [self.children[key] for key in sorted(self.children)]
+
+
+def _check_name(name: str):
+    if not name or name in ('.', '..') or len(name) > 255:
+        raise ImageError(f"Invalid file name: {name!r}")
+    if any(c in INVALID_NAME_CHARS for c in name) or name.endswith(('.', ' ')):
+        raise ImageError(f"File name not allowed on FAT/exFAT: {name!r}")
+
+
+def build_tree(files: Dict[str, Path]) -> _Node:
+    """
+    Arrange the files into a directory tree.
+
+    Args:
+        files: Maps '/'-separated paths inside the image to source files
+    """
+    root = _Node('')
+    for path in sorted(files):
+        parts = [part for part in path.split('/') if part]
+        if not parts:
+            raise ImageError(f"Invalid image path: {path!r}")
+        node = root
+        for part in parts[:-1]:
+            _check_name(part)
+            child = node.children.get(part.lower())
+            if child is None:
+                child = node.children[part.lower()] = _Node(part)
+                child.parent = node
+            elif not child.is_dir:
+                raise ImageError(f"{part} is both a file and a directory")
+            node = child
+        name = parts[-1]
+        _check_name(name)
+        if name.lower() in node.children:
+            raise ImageError(f"Duplicate path in image: {path}")
+        source = Path(files[path])
+        st = os.stat(source)
+        leaf = node.children[name.lower()] = _Node(name, source, st.st_size, st.st_mtime)
+        leaf.parent = node
+    return root
+
+
+def _dir_mtime(node: _Node) -> float:
+    """Directories take the newest time of the files below them."""
+    times = [_dir_mtime(c) if c.is_dir else c.mtime for c in node.children.values()]
+    return max(times) if times else 0.0
+
+
+def _dos_datetime(timestamp: float):
+    """Return (date, time, tenths of 10 ms) in FAT's local-time encoding."""
+    t = time.localtime(max(timestamp, 315532800))  # not before 1980
+    year = min(max(t.tm_year, 1980), 2107)
+    date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    clock = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return date, clock, (t.tm_sec % 2) * 100
+
+
+def _volume_serial(root: _Node) -> int:
+    signature = ''.join(
+        f"{node.name}:{node.size}:{int(node.mtime)};" for node in root.walk_files()
+    )
+    return zlib.crc32(signature.encode('utf-8')) or 1
+
+
+def _ceil_div(a: int, b: int) -> int:
+    return -(-a // b)
+
+
+def _mbr(fs: str, partition_sectors: int, serial: int) -> bytes:
+    mbr = bytearray(SECTOR_SIZE)
+    struct.pack_into('<I', mbr, 440, serial)
+    # One partition; CHS fields set to the "use LBA" maximum
+    struct.pack_into('<B3sB3sII', mbr, 446, 0x00, b'\xfe\xff\xff',
+                     PARTITION_TYPES[fs], b'\xfe\xff\xff',
+                     PARTITION_START, partition_sectors)
+    mbr[510:512] = b'\x55\xaa'
+    return bytes(mbr)
+
+
+def _copy_into(out, source: Path, offset: int, length: int):
+    """Stream length bytes of source into the image at offset."""
+    copied = 0
+    with span('copy'), open(source, 'rb') as f:
+        if hasattr(os, 'copy_file_range'):
+            out.flush()
+            try:
+                while copied < length:
+                    n = os.copy_file_range(f.fileno(), out.fileno(), length - copied,
+                                           copied, offset + copied)
+                    if n == 0:
+                        break
+                    copied += n
+            except OSError:
+                if copied:
+                    raise
+        if copied < length:
+            f.seek(copied)
+            out.seek(offset + copied)
+            while copied < length:
+                chunk = f.read(min(COPY_CHUNK, length - copied))
+                if not chunk:
+                    break
+                out.write(chunk)
+                copied += len(chunk)
+        if copied != length:
+            raise ImageError(f"{source} changed size while building the image")
+        count(BYTES_WRITTEN, length)
+
+
+# FAT32
+
+def fat32_cluster_size(volume_bytes: int) -> int:
+    """Default cluster size for a FAT32 volume, as Windows formats it."""
+    if volume_bytes <= 260 * MB:
+        return 512
+    if volume_bytes <= 8 * 1024 * MB:
+        return 4096
+    if volume_bytes <= 16 * 1024 * MB:
+        return 8192
+    if volume_bytes <= 32 * 1024 * MB:
+        return 16384
+    return 32768
+
+
+def _short_name_char(c: str) -> str:
+    if c.isascii() and (c.isalnum() or c in SHORT_NAME_CHARS):
+        return c.upper()
+    return '_'
+
+
+def short_name(name: str, taken: set):
+    """
+    Return the 11-byte 8.3 name for a file, and whether it needs long name
+    entries. Names that are not already uppercase 8.3 get a "~N" alias.
+    """
+    base, dot, ext = name.rpartition('.')
+    if not dot:
+        base, ext = name, ''
+    exact = (1 <= len(base) <= 8 and len(ext) <= 3 and name.count('.') <= 1
+             and all(c.isascii() and (c.isalnum() or c in SHORT_NAME_CHARS)
+                     for c in base + ext))
+    if exact:
+        candidate = (base.upper().ljust(8) + ext.upper().ljust(3)).encode('ascii')
+        if candidate not in taken:
+            taken.add(candidate)
+            return candidate, name != name.upper()
+
+    stem = ''.join(_short_name_char(c) for c in base.replace(' ', '').lstrip('.')) or '_'
+    suffix = ''.join(_short_name_char(c) for c in ext.replace(' ', ''))[:3]
+    for n in range(1, 1000000):
+        tail = f"~{n}"
+        candidate = (stem[:8 - len(tail)] + tail).ljust(8) + suffix.ljust(3)
+        candidate = candidate.encode('ascii')
+        if candidate not in taken:
+            taken.add(candidate)
+            return candidate, True
+    raise ImageError(f"Too many similar names for {name}")
+
+
+def _short_checksum(name11: bytes) -> int:
+    total = 0
+    for b in name11:
+        total = (((total & 1) << 7) + (total >> 1) + b) & 0xFF
+    return total
+
+
+def _fat_entry(name11: bytes, attr: int, cluster: int, size: int, mtime: float) -> bytes:
+    date, clock, tenths = _dos_datetime(mtime)
+    return struct.pack('<11sBBBHHHHHHHI', name11, attr, 0, tenths, clock, date, date,
+                       cluster >> 16, clock, date, cluster & 0xFFFF, size)
+
+
+def _lfn_entries(name: str, checksum: int) -> bytes:
+    units = name.encode('utf-16-le')
+    chars = [units[i:i + 2] for i in range(0, len(units), 2)]
+    if len(chars) % 13:
+        chars.append(b'\x00\x00')
+        chars.extend([b'\xff\xff'] * (-len(chars) % 13))
+    pieces = [chars[i:i + 13] for i in range(0, len(chars), 13)]
+    entries = []
+    for seq, piece in enumerate(pieces, 1):
+        order = seq | (0x40 if seq == len(pieces) else 0)
+        entries.append(
+            bytes([order]) + b''.join(piece[0:5]) + bytes([ATTR_LONG_NAME, 0, checksum])
+            + b''.join(piece[5:11]) + b'\x00\x00' + b''.join(piece[11:13])
+        )
+    return b''.join(reversed(entries))
+
+
+def _fat32_directory(node: _Node, label: str) -> bytes:
+    mtime = _dir_mtime(node)
+    entries = []
+    if node.parent is None:
+        volume = label.upper().encode('ascii', 'replace')[:11].ljust(11)
+        entries.append(_fat_entry(volume, ATTR_VOLUME_ID, 0, 0, mtime))
+    else:
+        parent = node.parent.first_cluster if node.parent.parent is not None else 0
+        entries.append(_fat_entry(b'.'.ljust(11), ATTR_DIRECTORY, node.first_cluster, 0, mtime))
+        entries.append(_fat_entry(b'..'.ljust(11), ATTR_DIRECTORY, parent, 0, mtime))
+
+    taken = set()
+    for child in node.sorted_children():
+        name11, needs_lfn = short_name(child.name, taken)
+        if needs_lfn:
+            entries.append(_lfn_entries(child.name, _short_checksum(name11)))
+        if child.is_dir:
+            entries.append(_fat_entry(name11, ATTR_DIRECTORY, child.first_cluster, 0,
+                                      _dir_mtime(child)))
+        else:
+            entries.append(_fat_entry(name11, ATTR_ARCHIVE, child.first_cluster,
+                                      child.size, child.mtime))
+    return b''.join(entries)
+
+
+def _fat32_directory_size(node: _Node, label: str) -> int:
+    """Bytes of directory entries, including the end marker."""
+    # Cluster numbers do not change the size, so they need not be assigned yet
+    return len(_fat32_directory(node, label)) + 32
+
+
+class _Fat32Layout(NamedTuple):
+    total_sectors: int
+    sectors_per_cluster: int
+    reserved_sectors: int
+    fat_sectors: int
+    cluster_count: int
+
+    @property
+    def cluster_size(self) -> int:
+        return self.sectors_per_cluster * SECTOR_SIZE
+
+    @property
+    def data_offset(self) -> int:
+        """Byte offset of cluster 2 from the partition start."""
+        return (self.reserved_sectors + 2 * self.fat_sectors) * SECTOR_SIZE
+
+
+def fat32_layout(volume_bytes: int, cluster_size: Optional[int] = None) -> _Fat32Layout:
+    """
+    Work out the reserved area, FAT size and cluster count of a volume.
+
+    Raises:
+        ImageError: If the volume is too small or large for FAT32
+    """
+    if cluster_size is None:
+        cluster_size = fat32_cluster_size(volume_bytes)
+    spc = cluster_size // SECTOR_SIZE
+    total = volume_bytes // SECTOR_SIZE
+    fat_sectors = 1
+    while True:
+        # Pad the reserved area so clusters are aligned to the cluster size
+        reserved = FAT32_RESERVED_SECTORS
+        reserved += -(reserved + 2 * fat_sectors) % spc
+        clusters = (total - reserved - 2 * fat_sectors) // spc
+        needed = _ceil_div((clusters + 2) * 4, SECTOR_SIZE)
+        if needed <= fat_sectors:
+            break
+        fat_sectors = needed
+    if clusters < FAT32_MIN_CLUSTERS:
+        raise ImageError(
+            f"{volume_bytes // MB} MB is too small for FAT32 with "
+            f"{cluster_size}-byte clusters (use a larger size or exFAT)"
+        )
+    if clusters > FAT32_MAX_CLUSTERS:
+        raise ImageError("Volume is too large for FAT32; use a larger cluster size or exFAT")
+    return _Fat32Layout(total, spc, reserved, fat_sectors, clusters)
+
+
+def _fat32_boot_sector(layout: _Fat32Layout, serial: int, label: str) -> bytes:
+    boot = bytearray(SECTOR_SIZE)
+    boot[0:3] = b'\xeb\x58\x90'
+    boot[3:11] = b'MSWIN4.1'
+    struct.pack_into('<HBHBHHBHHHII', boot, 11,
+                     SECTOR_SIZE, layout.sectors_per_cluster, layout.reserved_sectors,
+                     2, 0, 0, 0xF8, 0, 63, 255, PARTITION_START, layout.total_sectors)
+    struct.pack_into('<IHHIHH', boot, 36, layout.fat_sectors, 0, 0, 2, 1, 6)
+    struct.pack_into('<BBBI', boot, 64, 0x80, 0, 0x29, serial)
+    boot[71:82] = label.upper().encode('ascii', 'replace')[:11].ljust(11)
+    boot[82:90] = b'FAT32   '
+    boot[510:512] = b'\x55\xaa'
+    return bytes(boot)
+
+
+def _fat32_fsinfo(free_clusters: int, next_free: int) -> bytes:
+    info = bytearray(SECTOR_SIZE)
+    struct.pack_into('<I', info, 0, 0x41615252)
+    struct.pack_into('<IIII', info, 484, 0x61417272, free_clusters, next_free, 0)
+    struct.pack_into('<I', info, 508, 0xAA550000)
+    return bytes(info)
+
+
+def _allocate(nodes_and_sizes, cluster_size: int, first: int = 2) -> int:
+    """Give each (node, byte size) a contiguous cluster run; return the next free cluster."""
+    cluster = first
+    for node, size in nodes_and_sizes:
+        node.clusters = max(1, _ceil_div(size, cluster_size)) if node.is_dir else \
+            _ceil_div(size, cluster_size)
+        node.first_cluster = cluster if node.clusters else 0
+        cluster += node.clusters
+    return cluster
+
+
+def _fat_table(runs, entry_count: int, media: int, end_of_chain: int) -> bytes:
+    """FAT entries 0 .. entry_count-1 with a chain for each (first, length) run."""
+    fat = array('I', bytes(4 * entry_count))
+    fat[0] = media
+    fat[1] = end_of_chain
+    for first, length in runs:
+        for cluster in range(first, first + length - 1):
+            fat[cluster] = cluster + 1
+        if length:
+            fat[first + length - 1] = end_of_chain
+    if sys.byteorder == 'big':
+        fat.byteswap()
+    return fat.tobytes()
+
+
+def _write_fat32(out, root: _Node, layout: _Fat32Layout, label: str, serial: int):
+    cluster_size = layout.cluster_size
+    dirs = root.walk_dirs()
+    files = root.walk_files()
+
+    # Directory clusters first (their entries need the children's clusters)
+    next_free = _allocate([(d, _fat32_directory_size(d, label)) for d in dirs], cluster_size)
+    next_free = _allocate([(f, f.size) for f in files], cluster_size, next_free)
+    used = next_free - 2
+    if used > layout.cluster_count:
+        raise ImageError(
+            f"Files need {used * cluster_size // MB + 1} MB but the volume has "
+            f"{layout.cluster_count * cluster_size // MB} MB"
+        )
+
+    base = PARTITION_START * SECTOR_SIZE
+    boot = _fat32_boot_sector(layout, serial, label)
+    fsinfo = _fat32_fsinfo(layout.cluster_count - used, next_free)
+    for offset in (0, 6 * SECTOR_SIZE):
+        out.seek(base + offset)
+        out.write(boot + fsinfo)
+        # Sector 2 of each boot record only carries the signature
+        out.write(bytes(510) + b'\x55\xaa')
+
+    runs = [(node.first_cluster, node.clusters) for node in dirs + files]
+    fat = _fat_table(runs, next_free, 0x0FFFFFF8, FAT32_END_OF_CHAIN)
+    fat_start = base + layout.reserved_sectors * SECTOR_SIZE
+    for copy in range(2):
+        out.seek(fat_start + copy * layout.fat_sectors * SECTOR_SIZE)
+        out.write(fat)
+
+    data_start = base + layout.data_offset
+    for node in dirs:
+        out.seek(data_start + (node.first_cluster - 2) * cluster_size)
+        out.write(_fat32_directory(node, label))
+    for node in files:
+        if node.size:
+            _copy_into(out, node.source,
+                       data_start + (node.first_cluster - 2) * cluster_size, node.size)
+    return used
+
+
+# exFAT
+
+def exfat_cluster_size(volume_bytes: int) -> int:
+    """Default cluster size for an exFAT volume, as Windows formats it."""
+    if volume_bytes <= 256 * MB:
+        return 4096
+    if volume_bytes <= 32 * 1024 * MB:
+        return 32768
+    return 131072
+
+
+_UPCASE = None
+
+
+def upcase_table() -> bytes:
+    """The volume's up-case table: every BMP character mapped to its uppercase."""
+    # Built once (with its checksum): it is the same for every image
+    global _UPCASE
+    if _UPCASE is None:
+        table = array('H', range(65536))
+        for code in range(65536):
+            if 0xD800 <= code <= 0xDFFF:
+                continue
+            upper = chr(code).upper()
+            if len(upper) == 1 and ord(upper) < 0x10000:
+                table[code] = ord(upper)
+        if sys.byteorder == 'big':
+            table.byteswap()
+        table = table.tobytes()
+        _UPCASE = (table, _exfat_checksum32(table))
+    return _UPCASE[0]
+
+
+def upcase_checksum() -> int:
+    upcase_table()
+    return _UPCASE[1]
+
+
+def _exfat_checksum32(data: bytes, checksum: int = 0, skip=()) -> int:
+    for i, b in enumerate(data):
+        if i in skip:
+            continue
+        checksum = (((checksum & 1) << 31) | (checksum >> 1)) + b & 0xFFFFFFFF
+    return checksum
+
+
+def _exfat_checksum16(data: bytes, checksum: int = 0, skip=()) -> int:
+    for i, b in enumerate(data):
+        if i in skip:
+            continue
+        checksum = (((checksum & 1) << 15) | (checksum >> 1)) + b & 0xFFFF
+    return checksum
+
+
+def _exfat_name_hash(name: str) -> int:
+    table = upcase_table()
+    upper = bytearray()
+    for unit in struct.unpack(f'<{len(name.encode("utf-16-le")) // 2}H',
+                              name.encode('utf-16-le')):
+        upper += table[unit * 2:unit * 2 + 2]
+    return _exfat_checksum16(bytes(upper))
+
+
+def _exfat_timestamp(mtime: float) -> int:
+    date, clock, _ = _dos_datetime(mtime)
+    return (date << 16) | clock
+
+
+def _exfat_file_set(node: _Node, cluster_size: int) -> bytes:
+    name_units = node.name.encode('utf-16-le')
+    name_entries = _ceil_div(len(name_units) // 2, 15)
+    mtime = _dir_mtime(node) if node.is_dir else node.mtime
+    stamp = _exfat_timestamp(mtime)
+    _, _, tenths = _dos_datetime(mtime)
+
+    attributes = ATTR_DIRECTORY if node.is_dir else ATTR_ARCHIVE
+    primary = bytearray(32)
+    struct.pack_into('<BBHHHIIIBB', primary, 0, 0x85, 1 + name_entries, 0, attributes, 0,
+                     stamp, stamp, stamp, tenths, tenths)
+
+    length = node.clusters * cluster_size if node.is_dir else node.size
+    stream = bytearray(32)
+    flags = 0x01  # allocation possible; FAT chains are written for every run
+    struct.pack_into('<BBBBHHQIIQ', stream, 0, 0xC0, flags, 0, len(name_units) // 2,
+                     _exfat_name_hash(node.name), 0, length, 0, node.first_cluster, length)
+
+    names = b''
+    for i in range(name_entries):
+        chunk = name_units[i * 30:(i + 1) * 30].ljust(30, b'\x00')
+        names += b'\xc1\x00' + chunk
+
+    entry_set = bytearray(primary + stream + names)
+    struct.pack_into('<H', entry_set, 2, _exfat_checksum16(entry_set, skip=(2, 3)))
+    return bytes(entry_set)
+
+
+def _exfat_set_size(node: _Node) -> int:
+    return 32 * (2 + _ceil_div(len(node.name.encode('utf-16-le')) // 2, 15))
+
+
+class _ExfatLayout(NamedTuple):
+    total_sectors: int
+    sectors_per_cluster: int
+    fat_offset: int          # sectors
+    fat_length: int          # sectors
+    heap_offset: int         # sectors
+    cluster_count: int
+
+    @property
+    def cluster_size(self) -> int:
+        return self.sectors_per_cluster * SECTOR_SIZE
+
+
+def exfat_layout(volume_bytes: int, cluster_size: Optional[int] = None) -> _ExfatLayout:
+    """Work out the FAT and cluster heap positions of an exFAT volume."""
+    if cluster_size is None:
+        cluster_size = exfat_cluster_size(volume_bytes)
+    spc = cluster_size // SECTOR_SIZE
+    total = volume_bytes // SECTOR_SIZE
+    fat_length = 1
+    while True:
+        heap = EXFAT_FAT_OFFSET + fat_length
+        heap += -heap % spc
+        clusters = (total - heap) // spc
+        needed = _ceil_div((clusters + 2) * 4, SECTOR_SIZE)
+        if needed <= fat_length:
+            break
+        fat_length = needed
+    if clusters < 1:
+        raise ImageError(f"{volume_bytes} bytes is too small for exFAT")
+    return _ExfatLayout(total, spc, EXFAT_FAT_OFFSET, fat_length, heap, clusters)
+
+
+def _exfat_boot_region(layout: _ExfatLayout, serial: int, root_cluster: int,
+                       percent_used: int) -> bytes:
+    boot = bytearray(SECTOR_SIZE)
+    boot[0:3] = b'\xeb\x76\x90'
+    boot[3:11] = b'EXFAT   '
+    struct.pack_into('<QQIIIIIIHHBBBBB', boot, 64,
+                     PARTITION_START, layout.total_sectors,
+                     layout.fat_offset, layout.fat_length, layout.heap_offset,
+                     layout.cluster_count, root_cluster, serial,
+                     0x0100, 0, 9, layout.sectors_per_cluster.bit_length() - 1,
+                     1, 0x80, percent_used)
+    boot[510:512] = b'\x55\xaa'
+
+    extended = bytes(508) + b'\x00\x00\x55\xaa'
+    sectors = [bytes(boot)] + [extended] * 8 + [bytes(SECTOR_SIZE)] * 2
+    checksum = 0
+    for index, sector in enumerate(sectors):
+        skip = (106, 107, 112) if index == 0 else ()
+        checksum = _exfat_checksum32(sector, checksum, skip)
+    sectors.append(struct.pack('<I', checksum) * (SECTOR_SIZE // 4))
+    return b''.join(sectors)
+
+
+def _exfat_root_entries(label: str, bitmap: _Node, upcase: _Node, upcase_checksum: int) -> bytes:
+    label_units = label.encode('utf-16-le')[:22]
+    volume = struct.pack('<BB22s8x', 0x83, len(label_units) // 2, label_units)
+    bitmap_entry = struct.pack('<BB18xIQ', 0x81, 0, bitmap.first_cluster, bitmap.size)
+    upcase_entry = struct.pack('<B3xI12xIQ', 0x82, upcase_checksum,
+                               upcase.first_cluster, upcase.size)
+    return volume + bitmap_entry + upcase_entry
+
+
+def _write_exfat(out, root: _Node, layout: _ExfatLayout, label: str, serial: int):
+    cluster_size = layout.cluster_size
+    dirs = root.walk_dirs()
+    files = root.walk_files()
+
+    table = upcase_table()
+    bitmap = _Node('$bitmap', Path(os.devnull), _ceil_div(layout.cluster_count, 8))
+    upcase = _Node('$upcase', Path(os.devnull), len(table))
+
+    dir_sizes = []
+    for node in dirs:
+        size = sum(_exfat_set_size(child) for child in node.children.values()) + 32
+        if node.parent is None:
+            size += 3 * 32
+        dir_sizes.append((node, size))
+    next_free = _allocate([(bitmap, bitmap.size), (upcase, upcase.size)], cluster_size)
+    next_free = _allocate(dir_sizes, cluster_size, next_free)
+    next_free = _allocate([(f, f.size) for f in files], cluster_size, next_free)
+    used = next_free - 2
+    if used > layout.cluster_count:
+        raise ImageError(
+            f"Files need {used * cluster_size // MB + 1} MB but the volume has "
+            f"{layout.cluster_count * cluster_size // MB} MB"
+        )
+
+    base = PARTITION_START * SECTOR_SIZE
+    region = _exfat_boot_region(layout, serial, root.first_cluster,
+                                used * 100 // layout.cluster_count)
+    out.seek(base)
+    out.write(region)
+    out.write(region)  # backup boot region
+
+    runs = [(node.first_cluster, node.clusters) for node in [bitmap, upcase] + dirs + files]
+    out.seek(base + layout.fat_offset * SECTOR_SIZE)
+    out.write(_fat_table(runs, next_free, 0xFFFFFFF8, EXFAT_END_OF_CHAIN))
+
+    heap = base + layout.heap_offset * SECTOR_SIZE
+    bits = bytearray(bitmap.size)
+    bits[:used // 8] = b'\xff' * (used // 8)
+    if used % 8:
+        bits[used // 8] = (1 << (used % 8)) - 1
+    out.seek(heap)
+    out.write(bits)
+    out.seek(heap + (upcase.first_cluster - 2) * cluster_size)
+    out.write(table)
+
+    for node in dirs:
+        entries = b''
+        if node.parent is None:
+            entries = _exfat_root_entries(label, bitmap, upcase, upcase_checksum())
+        entries += b''.join(_exfat_file_set(child, cluster_size)
+                            for child in node.sorted_children())
+        out.seek(heap + (node.first_cluster - 2) * cluster_size)
+        out.write(entries)
+    for node in files:
+        if node.size:
+            _copy_into(out, node.source,
+                       heap + (node.first_cluster - 2) * cluster_size, node.size)
+    return used
+
+
+def _content_bytes(root: _Node, cluster_size: int) -> int:
+    files = root.walk_files()
+    dirs = root.walk_dirs()
+    clusters = sum(_ceil_div(f.size, cluster_size) for f in files) + 4 * len(dirs)
+    return clusters * cluster_size
+
+
+def auto_size(root: _Node, fs: str) -> int:
+    """Smallest whole-MiB image size (at least MIN_AUTO_SIZE) that fits the files."""
+    size = MIN_AUTO_SIZE
+    while True:
+        volume = size - PARTITION_START * SECTOR_SIZE
+        if fs == 'fat32':
+            layout = fat32_layout(volume)
+            overhead = layout.data_offset
+        else:
+            layout = exfat_layout(volume)
+            overhead = (layout.heap_offset * SECTOR_SIZE
+                        + _ceil_div(layout.cluster_count, 8) + len(upcase_table())
+                        + 2 * layout.cluster_size)
+        needed = _content_bytes(root, layout.cluster_size) + overhead
+        if needed <= volume:
+            return size
+        size = max(size + MB, _ceil_div(needed * 21 // 20 + PARTITION_START * SECTOR_SIZE, MB) * MB)
+
+
+def volume_capacity(size: int, fs: str) -> Tuple[int, int]:
+    """
+    Return (cluster size, clusters free for files and directories) of an
+    image of the given size.
+
+    Raises:
+        ImageError: If the size is too small for the filesystem
+    """
+    volume = size - size % SECTOR_SIZE - PARTITION_START * SECTOR_SIZE
+    if volume <= 0:
+        raise ImageError(f"Image size {size} is too small")
+    if fs == 'fat32':
+        layout = fat32_layout(volume)
+        return layout.cluster_size, layout.cluster_count
+    layout = exfat_layout(volume)
+    system = (_ceil_div(_ceil_div(layout.cluster_count, 8), layout.cluster_size)
+              + _ceil_div(len(upcase_table()), layout.cluster_size))
+    return layout.cluster_size, layout.cluster_count - system
+
+
+def build_image(dest: Path, files: Dict[str, Path], fs: str = 'fat32',
+                size: Optional[int] = None, label: str = DEFAULT_LABEL,
+                max_size: Optional[int] = None) -> ImageInfo:
+    """
+    Write a partitioned disk image containing the given files.
+
+    Args:
+        dest: Image file to create (replaced if it exists)
+        files: Maps '/'-separated paths inside the image to source files,
+            e.g. {'LightShow/lightshow.fseq': Path('shows/x/lightshow.fseq')}
+        fs: 'fat32' or 'exfat'
+        size: Image size in bytes (default: just large enough, at least 64 MiB)
+        label: Volume label (at most 11 characters)
+        max_size: Upper bound for the default size, e.g. the target stick's size
+
+    Returns:
+        ImageInfo describing the image
+
+    Raises:
+        ImageError: If the files do not fit or cannot be represented
+    """
+    if fs not in FILESYSTEMS:
+        raise ImageError(f"Unknown filesystem: {fs}")
+    root = build_tree(files)
+    if fs == 'fat32':
+        for node in root.walk_files():
+            if node.size > FAT32_MAX_FILE_SIZE:
+                raise ImageError(f"{node.name} is larger than FAT32's 4 GB file limit")
+
+    if size is None:
+        size = auto_size(root, fs)
+        if max_size is not None:
+            size = min(size, max_size)
+    size -= size % SECTOR_SIZE
+    volume = size - PARTITION_START * SECTOR_SIZE
+    if volume <= 0:
+        raise ImageError(f"Image size {size} is too small")
+    serial = _volume_serial(root)
+    label = label[:11]
+
+    dest = Path(dest)
+    tmp = dest.with_name(f".{dest.name}.tmp")
+    with span('image'):
+        try:
+            with open(tmp, 'wb', buffering=0) as out:
+                out.truncate(size)
+                out.write(_mbr(fs, volume // SECTOR_SIZE, serial))
+                if fs == 'fat32':
+                    layout = fat32_layout(volume)
+                    used = _write_fat32(out, root, layout, label, serial)
+                else:
+                    layout = exfat_layout(volume)
+                    used = _write_exfat(out, root, layout, label, serial)
+            os.replace(tmp, dest)
+        except BaseException:
+            if tmp.exists():
+                tmp.unlink()
+            raise
+
+    return ImageInfo(fs, size, layout.cluster_size, used * layout.cluster_size,
+                     len(root.walk_files()))
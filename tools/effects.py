@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+Build sequences from a timeline of effects instead of exporting them from
+xLights.
+
+A ``Timeline`` is a list of effects (on, off, fade, blink, ramp), each
+applied to some channels over a span of time; later effects are drawn over
+earlier ones. ``Timeline.write`` renders the frame matrix a batch of frames
+at a time with NumPy and streams each batch into an ``FseqWriter``, so
+memory stays flat however long the show is, and a script can turn out
+hundreds of variants of a show in a batch job.
+
+Timelines can also be described in JSON and rendered from the command line:
+
+    {
+        "duration": 60, "fps": 40,
+        "effects": [
+            {"effect": "blink", "channels": ["Left Front Turn"], "start": 0, "end": 4},
+            {"effect": "fade", "channels": "lights", "start": 4, "end": 6,
+             "from": 255, "to": 0}
+        ]
+    }
+"""
+import sys
+import json
+import argparse
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Tuple, Union
+
+from utils import (
+    print_success, print_error, print_info, add_output_options, begin_output, end_output,
+    format_size
+)
+from fseq import FseqWriter, FseqError, COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_ZSTD
+import tesla
+
+
+# Frames rendered and written at a time
+BATCH_FRAMES = 4096
+
+DEFAULT_STEP_MS = 20
+
+COMPRESSIONS = {'none': COMPRESSION_NONE, 'zlib': COMPRESSION_ZLIB, 'zstd': COMPRESSION_ZSTD}
+
+# Named groups usable in place of a channel list
+CHANNEL_GROUPS = {
+    'lights': tesla.LIGHT_CHANNELS,
+    'ramp': tesla.RAMP_CHANNELS,
+    'closures': tesla.CLOSURE_CHANNELS,
+}
+
+ChannelSpec = Union[int, str, Iterable[Union[int, str]]]
+
+
+class EffectError(ValueError):
+    """Raised when an effect or timeline description is invalid."""
+
+
+class Effect(NamedTuple):
+    """One effect placed on the timeline, in frames."""
+    kind: str                 # 'on', 'off', 'fade', 'blink' or 'ramp'
+    channels: Tuple[int, ...]
+    first_frame: int
+    stop_frame: int           # exclusive
+    params: Tuple             # kind-specific, see the Timeline methods
+
+
+def ramp_value(rate: int, on: bool) -> int:
+    """
+    Channel value that tells the car to ramp a light on or off.
+
+    Tesla reads the distance of a light's value from fully on or off as a
+    ramp rate from 0 (switch instantly) to 3; see ``tesla.command_count``.
+    """
+    if not 1 <= rate <= 3:
+        raise EffectError(f"Ramp rate must be 1-3, got {rate}")
+    return 255 - 26 * rate if on else 26 * rate
+
+
+class Timeline:
+    """
+    Effects over time, rendered to a sequence on demand.
+
+    Example:
+        show = Timeline(duration=30, step_time_ms=25)
+        show.blink("Left Front Turn", 0, 4, period=0.5)
+        show.fade("lights", 4, 6, start_level=255, end_level=0)
+        show.ramp(["Left Outer Main Beam", "Right Outer Main Beam"], 6, 10, rate=2)
+        show.write(Path("shows/my-show/lightshow.fseq"))
+    """
+
+    def __init__(self, duration: float, step_time_ms: int = DEFAULT_STEP_MS,
+                 channel_count: int = tesla.CHANNEL_COUNTS[0]):
+        if not 0 < step_time_ms < 256:
+            raise EffectError(f"Frame interval must be 1-255 ms, got {step_time_ms}")
+        if duration <= 0:
+            raise EffectError(f"Duration must be positive, got {duration}")
+        self.step_time_ms = step_time_ms
+        self.channel_count = channel_count
+        self.frame_count = self.to_frame(duration)
+        self.effects: List[Effect] = []
+        self._spans = None    # (first frames, stop frames) as NumPy arrays
+
+    @property
+    def duration(self) -> float:
+        return self.frame_count * self.step_time_ms / 1000.0
+
+    def to_frame(self, seconds: float) -> int:
+        """Frame number at a time in seconds."""
+        return int(round(seconds * 1000.0 / self.step_time_ms))
+
+    def channels(self, spec: ChannelSpec) -> Tuple[int, ...]:
+        """
+        Resolve channel numbers, Tesla channel names and group names
+        ('lights', 'ramp', 'closures') to channel numbers.
+
+        Raises:
+            EffectError: If a channel is unknown or out of range
+        """
+        if isinstance(spec, (int, str)):
+            spec = [spec]
+        resolved = []
+        for item in spec:
+            if isinstance(item, str) and item.lower() in CHANNEL_GROUPS:
+                resolved.extend(CHANNEL_GROUPS[item.lower()])
+                continue
+            if isinstance(item, str):
+                try:
+                    item = tesla.channel_index(item)
+                except ValueError as e:
+                    raise EffectError(str(e))
+            if not 0 <= item < self.channel_count:
+                raise EffectError(f"Channel {item} is out of range (0-{self.channel_count - 1})")
+            resolved.append(item)
+        return tuple(dict.fromkeys(resolved))
+
+    def add(self, kind: str, channels: ChannelSpec, start: float, end: float,
+            params: Tuple = ()) -> Effect:
+        """
+        Place an effect between two times in seconds. The Timeline methods
+        named after each kind are the usual way to call this.
+
+        Raises:
+            EffectError: If the effect is invalid
+        """
+        if kind not in RENDERERS:
+            raise EffectError(f"Unknown effect: {kind}")
+        if end <= start:
+            raise EffectError(f"{kind} effect ends ({end}s) before it starts ({start}s)")
+        first = max(0, self.to_frame(start))
+        stop = min(self.frame_count, self.to_frame(end))
+        effect = Effect(kind, self.channels(channels), first, stop, params)
+        self.effects.append(effect)
+        self._spans = None
+        return effect
+
+    def on(self, channels: ChannelSpec, start: float, end: float, level: int = 255) -> Effect:
+        """Hold channels at a level (fully on by default)."""
+        return self.add('on', channels, start, end, (_level(level),))
+
+    def off(self, channels: ChannelSpec, start: float, end: float) -> Effect:
+        """Turn channels off, over anything placed before."""
+        return self.add('off', channels, start, end)
+
+    def fade(self, channels: ChannelSpec, start: float, end: float,
+             start_level: int = 255, end_level: int = 0) -> Effect:
+        """
+        Change channels linearly from one level to another. Every step of a
+        fade is a command for the car; ``ramp`` is far cheaper for lights.
+        """
+        return self.add('fade', channels, start, end, (_level(start_level), _level(end_level)))
+
+    def blink(self, channels: ChannelSpec, start: float, end: float, period: float = 0.5,
+              duty: float = 0.5, level: int = 255) -> Effect:
+        """
+        Switch channels on and off every ``period`` seconds, on for
+        ``duty`` of each period.
+        """
+        period_ms = int(round(period * 1000))
+        if period_ms < 1 or not 0 < duty < 1:
+            raise EffectError("Blink needs a positive period and a duty between 0 and 1")
+        return self.add('blink', channels, start, end,
+                        (period_ms, int(round(period_ms * duty)), _level(level)))
+
+    def ramp(self, channels: ChannelSpec, start: float, end: float, rate: int = 1,
+             on: bool = True) -> Effect:
+        """
+        Let the car ramp lights on (or off) smoothly at rate 1-3. Only the
+        first 14 light channels can ramp.
+        """
+        value = ramp_value(rate, on)
+        resolved = self.channels(channels)
+        unable = [c for c in resolved if c not in tesla.RAMP_CHANNELS]
+        if unable:
+            raise EffectError(f"{tesla.channel_name(unable[0])} cannot ramp")
+        return self.add('ramp', resolved, start, end, (value,))
+
+    # Rendering
+
+    def render(self, start: int = 0, stop: int = None):
+        """
+        Render frames ``start`` to ``stop`` as a ``(frames, channels)``
+        uint8 NumPy array.
+        """
+        import numpy as np
+
+        if stop is None:
+            stop = self.frame_count
+        matrix = np.zeros((stop - start, self.channel_count), dtype=np.uint8)
+        if self._spans is None:
+            self._spans = (np.array([e.first_frame for e in self.effects], dtype=np.int64),
+                           np.array([e.stop_frame for e in self.effects], dtype=np.int64))
+        firsts, stops = self._spans
+        # Effects overlapping the batch, in the order they were added
+        for i in np.flatnonzero((firsts < stop) & (stops > start)).tolist():
+            effect = self.effects[i]
+            lo = max(effect.first_frame, start)
+            hi = min(effect.stop_frame, stop)
+            values = RENDERERS[effect.kind](self, effect, lo, hi)
+            columns = list(effect.channels)
+            if np.ndim(values):
+                matrix[lo - start:hi - start, columns] = values[:, None]
+            else:
+                matrix[lo - start:hi - start, columns] = values
+        return matrix
+
+    def iter_batches(self, batch_frames: int = BATCH_FRAMES):
+        """Yield the rendered show in ``(frames, channels)`` batches."""
+        for start in range(0, self.frame_count, batch_frames):
+            yield self.render(start, min(start + batch_frames, self.frame_count))
+
+    def write(self, path: Path, compression: int = COMPRESSION_NONE, level: int = None,
+              batch_frames: int = BATCH_FRAMES) -> int:
+        """
+        Render the timeline into an FSEQ v2 file, one batch at a time.
+
+        Args:
+            path: Output file
+            compression: COMPRESSION_NONE (what Tesla plays), _ZLIB or _ZSTD
+            level: Compression level
+            batch_frames: Frames rendered per batch
+
+        Returns:
+            Size of the written file in bytes
+
+        Raises:
+            FseqError: If the sequence cannot be written
+        """
+        with FseqWriter(path, self.channel_count, self.frame_count, self.step_time_ms,
+                        compression=compression, level=level) as out:
+            for batch in self.iter_batches(batch_frames):
+                out.write_frames(batch)
+        return out.data_offset + out.bytes_written
+
+    # JSON
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Timeline':
+        """
+        Build a timeline from its JSON description.
+
+        Raises:
+            EffectError: If the description is invalid
+        """
+        if not isinstance(data, dict) or 'duration' not in data:
+            raise EffectError("Timeline needs a 'duration' in seconds")
+        step = data.get('step_ms')
+        if step is None:
+            step = int(round(1000 / data['fps'])) if data.get('fps') else DEFAULT_STEP_MS
+        timeline = cls(float(data['duration']), int(step),
+                       int(data.get('channels', tesla.CHANNEL_COUNTS[0])))
+
+        for number, item in enumerate(data.get('effects', []), 1):
+            try:
+                item = dict(item)
+                kind = item.pop('effect')
+                args = (item.pop('channels'), float(item.pop('start')), float(item.pop('end')))
+                if 'from' in item:
+                    item['start_level'] = item.pop('from')
+                if 'to' in item:
+                    item['end_level'] = item.pop('to')
+                method = getattr(timeline, kind) if kind in RENDERERS else None
+                if method is None:
+                    raise EffectError(f"unknown effect {kind!r}")
+                method(*args, **item)
+            except EffectError as e:
+                raise EffectError(f"Effect {number}: {e}")
+            except (KeyError, TypeError, ValueError) as e:
+                raise EffectError(f"Effect {number}: invalid or missing field ({e})")
+        return timeline
+
+
+def _level(level: int) -> int:
+    if not 0 <= level <= 255:
+        raise EffectError(f"Level must be 0-255, got {level}")
+    return int(level)
+
+
+def _render_constant(timeline: Timeline, effect: Effect, lo: int, hi: int):
+    return effect.params[0]
+
+
+def _render_off(timeline: Timeline, effect: Effect, lo: int, hi: int):
+    return 0
+
+
+def _render_fade(timeline: Timeline, effect: Effect, lo: int, hi: int):
+    import numpy as np
+
+    start_level, end_level = effect.params
+    span = max(effect.stop_frame - effect.first_frame - 1, 1)
+    t = (np.arange(lo, hi) - effect.first_frame) / span
+    return np.rint(start_level + (end_level - start_level) * t).astype(np.uint8)
+
+
+def _render_blink(timeline: Timeline, effect: Effect, lo: int, hi: int):
+    import numpy as np
+
+    period_ms, on_ms, level = effect.params
+    elapsed = (np.arange(lo, hi) - effect.first_frame) * timeline.step_time_ms
+    return np.where(elapsed % period_ms < on_ms, level, 0).astype(np.uint8)
+
+
+RENDERERS = {
+    'on': _render_constant,
+    'off': _render_off,
+    'fade': _render_fade,
+    'blink': _render_blink,
+    'ramp': _render_constant,
+}
+
+
+def render_file(source: Path, dest: Path, compression: str = 'none',
+                level: int = None) -> Timeline:
+    """
+    Render a JSON timeline file to a sequence.
+
+    Raises:
+        EffectError: If the timeline is invalid
+        FseqError: If the sequence cannot be written
+        OSError: If a file cannot be read or written
+    """
+    try:
+        with open(source, 'r') as f:
+            data = json.load(f)
+    except ValueError as e:
+        raise EffectError(f"Invalid JSON in {source}: {e}")
+    timeline = Timeline.from_dict(data)
+    timeline.write(dest, COMPRESSIONS[compression], level)
+    return timeline
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Render a timeline of effects to a Tesla Lightshow sequence',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s timeline.json -o shows/my-show/lightshow.fseq
+  %(prog)s timeline.json -o lightshow.fseq --check     Also validate the result
+
+Effects: on, off, fade (from/to), blink (period/duty/level), ramp (rate/on).
+Channels are numbers, Tesla channel names or the groups lights, ramp and
+closures. Later effects are drawn over earlier ones.
+        """
+    )
+
+    parser.add_argument(
+        'timeline',
+        type=Path,
+        help='JSON timeline file'
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        type=Path,
+        required=True,
+        help='Sequence file to write'
+    )
+
+    parser.add_argument(
+        '--compress',
+        choices=sorted(COMPRESSIONS),
+        default='none',
+        help='Block compression (default: none, which Tesla requires)'
+    )
+
+    parser.add_argument(
+        '--level',
+        type=int,
+        help='Compression level'
+    )
+
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='Validate the written sequence against Tesla\'s limits'
+    )
+
+    add_output_options(parser)
+
+    args = parser.parse_args()
+
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print_error("effects.py requires NumPy: pip install numpy")
+        sys.exit(1)
+
+    timeline = None
+    valid = False
+    with begin_output(args) as messages:
+        try:
+            timeline = render_file(args.timeline, args.output, args.compress, args.level)
+        except (EffectError, FseqError, OSError) as e:
+            print_error(f"Cannot render {args.timeline}: {e}")
+        else:
+            print_success(
+                f"Wrote {args.output}: {len(timeline.effects)} effects, "
+                f"{timeline.frame_count} frames ({timeline.duration:.2f}s), "
+                f"{format_size(args.output.stat().st_size)}"
+            )
+            valid = True
+            if args.check:
+                from validate import validate_sequence
+                print_info("Validating...")
+                valid = validate_sequence(args.output)
+                if valid:
+                    print_success("Sequence passes Tesla's checks")
+                else:
+                    print_error("Sequence fails Tesla's checks")
+    end_output(args, {
+        'tool': 'effects',
+        'timeline': str(args.timeline),
+        'output': str(args.output),
+        'ok': valid,
+        'frames': timeline.frame_count if timeline else None,
+        'messages': messages,
+    })
+
+    sys.exit(0 if valid else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,687 @@
+"""
+Reader and writer for xLights/Tesla FSEQ sequence files.
+
+Parses the v1 and v2 headers, the sparse-range table and the compression
+block index, and exposes frames as zero-copy views over a memory-mapped
+file so large shows can be inspected without reading them into RAM.
+
+Compressed v2 files are decoded lazily: only the blocks covering the
+requested frames are decompressed, and decoded blocks are kept in a
+size-bounded LRU cache so scrubbing back and forth never decodes the same
+block twice. zlib blocks use the standard library; zstd blocks need the
+optional ``zstandard`` package.
+
+FseqWriter streams frames to disk one compression block at a time, so
+writing a show never needs the whole frame matrix in memory.
+"""
+import bisect
+import mmap
+import struct
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from tracing import span, count, BYTES_READ, BLOCK_CACHE_HITS, BLOCK_CACHE_MISSES
+
+
+FSEQ_MAGIC = (b'PSEQ', b'FSEQ')
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZSTD = 1
+COMPRESSION_ZLIB = 2
+
+COMPRESSION_NAMES = {
+    COMPRESSION_NONE: 'none',
+    COMPRESSION_ZSTD: 'zstd',
+    COMPRESSION_ZLIB: 'zlib',
+}
+
+# Size of the fixed part of the v2 header; the block index follows it
+V2_HEADER_SIZE = 32
+# Fixed part of the v1 header; variable headers start here
+V1_HEADER_SIZE = 28
+
+# Default upper bound on decoded block bytes kept in memory per file
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Writer defaults: blocks of about a second of frames, and no more blocks
+# than fit the 8-bit block count of a v2.0 header
+DEFAULT_FRAMES_PER_BLOCK = 32
+MAX_BLOCKS = 255
+
+# Frames per chunk when streaming through a whole sequence
+DEFAULT_CHUNK_FRAMES = 1024
+
+
+class FseqError(ValueError):
+    """Raised when a file is not a readable FSEQ sequence."""
+
+
+class CompressionBlock(NamedTuple):
+    """One entry of the v2 compression block index."""
+    first_frame: int
+    frame_count: int
+    offset: int
+    length: int
+
+
+class SparseRange(NamedTuple):
+    """A run of channels stored in a sparse v2 file."""
+    start_channel: int
+    channel_count: int
+
+
+class FseqHeader(NamedTuple):
+    """Parsed FSEQ header fields."""
+    major_version: int
+    minor_version: int
+    data_offset: int
+    channel_count: int
+    frame_count: int
+    step_time_ms: int
+    compression: int
+    unique_id: int
+    blocks: List[CompressionBlock]
+    sparse_ranges: List[SparseRange]
+    variable_headers: Dict[str, bytes]
+
+    @property
+    def version(self) -> str:
+        return f"{self.major_version}.{self.minor_version}"
+
+    @property
+    def fps(self) -> float:
+        return 1000.0 / self.step_time_ms if self.step_time_ms else 0.0
+
+    @property
+    def duration(self) -> float:
+        """Sequence length in seconds."""
+        return self.frame_count * self.step_time_ms / 1000.0
+
+    @property
+    def frame_size(self) -> int:
+        return self.channel_count
+
+    @property
+    def compression_name(self) -> str:
+        return COMPRESSION_NAMES.get(self.compression, f"unknown ({self.compression})")
+
+    @property
+    def layout(self) -> str:
+        """
+        One-line description of how the channel data is stored, e.g.
+        "v2.0, zstd in 12 blocks of 32-64 frames, 3 sparse ranges".
+        """
+        parts = [f"v{self.version}"]
+        if self.compression == COMPRESSION_NONE:
+            parts.append("uncompressed")
+        else:
+            sizes = sorted({block.frame_count for block in self.blocks[:-1]}) or \
+                [self.blocks[0].frame_count if self.blocks else 0]
+            frames = f"{sizes[0]}" if len(sizes) == 1 else f"{sizes[0]}-{sizes[-1]}"
+            parts.append(f"{self.compression_name} in {len(self.blocks)} blocks of {frames} frames")
+        if self.sparse_ranges:
+            parts.append(f"{len(self.sparse_ranges)} sparse ranges")
+        return ", ".join(parts)
+
+
+def _parse_variable_headers(data: bytes, start: int, end: int) -> Dict[str, bytes]:
+    """Parse the ``<len:u16><code:2s><value>`` records between start and end."""
+    headers = {}
+    pos = start
+    while pos + 4 <= end:
+        length, code = struct.unpack_from('<H2s', data, pos)
+        if length < 4 or pos + length > end:
+            break
+        value = bytes(data[pos + 4:pos + length]).rstrip(b'\x00')
+        headers[code.decode('latin-1')] = value
+        pos += length
+    return headers
+
+
+def decompress_block(data, compression: int, expected_size: int) -> bytes:
+    """
+    Decompress one compression block.
+
+    Raises:
+        FseqError: If the codec is unavailable or the block is corrupt
+    """
+    if compression == COMPRESSION_ZLIB:
+        try:
+            decoded = zlib.decompress(data)
+        except zlib.error as e:
+            raise FseqError(f"Corrupt zlib block: {e}")
+    elif compression == COMPRESSION_ZSTD:
+        try:
+            import zstandard
+        except ImportError:
+            raise FseqError("Reading zstd-compressed sequences requires: pip install zstandard")
+        try:
+            # xLights streams its blocks, so the frame header may omit the size
+            decoded = zstandard.ZstdDecompressor().decompress(
+                data, max_output_size=expected_size)
+        except zstandard.ZstdError as e:
+            raise FseqError(f"Corrupt zstd block: {e}")
+    else:
+        return bytes(data)
+
+    if len(decoded) < expected_size:
+        raise FseqError(
+            f"Block decoded to {len(decoded)} bytes, expected {expected_size}"
+        )
+    return decoded
+
+
+def compress_block(data, compression: int, level: Optional[int] = None) -> bytes:
+    """
+    Compress one block of channel data.
+
+    Raises:
+        FseqError: If the codec is unavailable
+    """
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(data, 6 if level is None else level)
+    if compression == COMPRESSION_ZSTD:
+        try:
+            import zstandard
+        except ImportError:
+            raise FseqError("Writing zstd-compressed sequences requires: pip install zstandard")
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    return bytes(data)
+
+
+def parse_header(data, file_size: Optional[int] = None) -> FseqHeader:
+    """
+    Parse an FSEQ header from a buffer holding at least the header bytes.
+
+    Args:
+        data: Buffer starting at byte 0 of the file (bytes, mmap, memoryview)
+        file_size: Total file size, used to size the last compression block
+
+    Returns:
+        Parsed FseqHeader
+
+    Raises:
+        FseqError: If the buffer does not contain a valid header
+    """
+    if file_size is None:
+        file_size = len(data)
+
+    if len(data) < V1_HEADER_SIZE or bytes(data[0:4]) not in FSEQ_MAGIC:
+        raise FseqError("Not an FSEQ file (bad magic)")
+
+    data_offset, minor, major, header_len, channel_count, frame_count, step_time = \
+        struct.unpack_from('<HBBHIIB', data, 4)
+
+    if major not in (1, 2):
+        raise FseqError(f"Unsupported FSEQ version {major}.{minor}")
+    if data_offset > file_size:
+        raise FseqError("Channel data offset is past the end of the file")
+
+    if major == 1:
+        variable_headers = _parse_variable_headers(data, V1_HEADER_SIZE, data_offset)
+        length = frame_count * channel_count
+        return FseqHeader(
+            major, minor, data_offset, channel_count, frame_count, step_time,
+            COMPRESSION_NONE, 0,
+            [CompressionBlock(0, frame_count, data_offset, length)],
+            [], variable_headers,
+        )
+
+    if len(data) < V2_HEADER_SIZE:
+        raise FseqError("Truncated FSEQ v2 header")
+
+    compression_byte, block_count_low, range_count, _flags, unique_id = \
+        struct.unpack_from('<BBBBQ', data, 20)
+    compression = compression_byte & 0x0F
+    # v2.1+ keeps the high bits of the block count in the compression byte
+    block_count = block_count_low | ((compression_byte & 0xF0) << 4)
+
+    if compression not in COMPRESSION_NAMES:
+        raise FseqError(f"Unknown compression type {compression}")
+
+    index_end = V2_HEADER_SIZE + block_count * 8
+    ranges_end = index_end + range_count * 6
+    if ranges_end > data_offset:
+        raise FseqError("Block index and sparse ranges overlap channel data")
+
+    blocks = []
+    if compression == COMPRESSION_NONE:
+        blocks.append(CompressionBlock(0, frame_count, data_offset, frame_count * channel_count))
+    else:
+        entries = []
+        for i in range(block_count):
+            first_frame, length = struct.unpack_from('<II', data, V2_HEADER_SIZE + i * 8)
+            # xLights pre-allocates index slots and leaves unused ones zeroed
+            if length == 0:
+                continue
+            entries.append((first_frame, length))
+        # Every frame must fall in a block, or reading it has nothing to decode
+        if frame_count and (not entries or entries[0][0] != 0):
+            raise FseqError(f"Compression blocks do not cover all {frame_count} frames")
+        offset = data_offset
+        for i, (first_frame, length) in enumerate(entries):
+            next_frame = entries[i + 1][0] if i + 1 < len(entries) else frame_count
+            if next_frame < first_frame:
+                raise FseqError("Compression block index is not in frame order")
+            blocks.append(CompressionBlock(first_frame, next_frame - first_frame, offset, length))
+            offset += length
+        if offset > file_size:
+            raise FseqError("Compressed blocks extend past the end of the file")
+
+    sparse_ranges = []
+    for i in range(range_count):
+        raw = bytes(data[index_end + i * 6:index_end + i * 6 + 6])
+        start = int.from_bytes(raw[0:3], 'little')
+        count = int.from_bytes(raw[3:6], 'little')
+        sparse_ranges.append(SparseRange(start, count))
+    if sparse_ranges and sum(r.channel_count for r in sparse_ranges) != channel_count:
+        raise FseqError(
+            f"Sparse ranges hold {sum(r.channel_count for r in sparse_ranges)} channels, "
+            f"but frames have {channel_count}"
+        )
+
+    variable_headers = _parse_variable_headers(data, max(header_len, ranges_end), data_offset)
+
+    return FseqHeader(
+        major, minor, data_offset, channel_count, frame_count, step_time,
+        compression, unique_id, blocks, sparse_ranges, variable_headers,
+    )
+
+
+class FseqFile:
+    """
+    Memory-mapped FSEQ file.
+
+    Frame accessors return views into the mapping rather than copies. Views
+    may outlive ``close()``: the mapping is then unmapped once the last view
+    is dropped.
+
+    For compressed files, frames within one block are views into the cached
+    decoded block; a range spanning several blocks is assembled into a new
+    buffer.
+
+    Example:
+        with FseqFile(path) as seq:
+            first = seq.frame(0)          # memoryview of channel bytes
+            matrix = seq.as_array()       # (frames, channels) NumPy view
+    """
+
+    def __init__(self, path: Path, cache_bytes: int = DEFAULT_CACHE_BYTES):
+        self.path = Path(path)
+        self.cache_bytes = cache_bytes
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._file = open(self.path, 'rb')
+        try:
+            size = self._file.seek(0, 2)
+            if size == 0:
+                raise FseqError("File is empty")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.size = size
+            with span('parse'):
+                self.header = parse_header(self._mmap, size)
+        except Exception:
+            self.close()
+            raise
+        self._check_data_length()
+        self._block_starts = [block.first_frame for block in self.header.blocks]
+
+    def _check_data_length(self):
+        if self.header.compression != COMPRESSION_NONE:
+            return
+        needed = self.header.data_offset + self.header.frame_count * self.header.channel_count
+        if needed > self.size:
+            self.close()
+            raise FseqError(
+                f"Channel data is truncated ({self.size} bytes, expected {needed})"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._cache.clear()
+        self._cached_bytes = 0
+        mm = getattr(self, '_mmap', None)
+        if mm is not None:
+            try:
+                mm.close()
+            except BufferError:
+                # Views are still exported; they keep the mapping alive
+                # and it is unmapped when the last one goes away
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def frame_count(self) -> int:
+        return self.header.frame_count
+
+    @property
+    def channel_count(self) -> int:
+        return self.header.channel_count
+
+    @property
+    def is_compressed(self) -> bool:
+        return self.header.compression != COMPRESSION_NONE
+
+    def _check_range(self, start: int, stop: int):
+        if not 0 <= start <= stop <= self.header.frame_count:
+            raise IndexError(
+                f"Frame range {start}:{stop} out of bounds (0:{self.header.frame_count})"
+            )
+
+    def block_index(self, frame: int) -> int:
+        """Return the index of the compression block holding a frame."""
+        return bisect.bisect_right(self._block_starts, frame) - 1
+
+    def read_block(self, index: int) -> memoryview:
+        """
+        Return the decoded channel data of one compression block.
+
+        Uncompressed data is a view over the mapping; compressed blocks are
+        decoded on first use and served from the LRU cache afterwards.
+        """
+        block = self.header.blocks[index]
+        expected = block.frame_count * self.header.channel_count
+        if not self.is_compressed:
+            count(BYTES_READ, expected)
+            return memoryview(self._mmap)[block.offset:block.offset + expected]
+
+        cached = self._cache.get(index)
+        if cached is not None:
+            self._cache.move_to_end(index)
+            self.cache_hits += 1
+            count(BLOCK_CACHE_HITS)
+            return memoryview(cached)
+
+        self.cache_misses += 1
+        count(BLOCK_CACHE_MISSES)
+        count(BYTES_READ, block.length)
+        raw = memoryview(self._mmap)[block.offset:block.offset + block.length]
+        try:
+            with span('decode'):
+                decoded = decompress_block(raw, self.header.compression, expected)
+        finally:
+            raw.release()
+
+        self._cache[index] = decoded
+        self._cached_bytes += len(decoded)
+        # Always keep the block just decoded, even if it alone exceeds the budget
+        while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+        return memoryview(decoded)
+
+    def raw_block(self, index: int) -> memoryview:
+        """
+        Return the stored (still compressed) bytes of one compression block
+        as a view over the mapping, without decoding it.
+        """
+        block = self.header.blocks[index]
+        count(BYTES_READ, block.length)
+        return memoryview(self._mmap)[block.offset:block.offset + block.length]
+
+    def iter_blocks(self, start: int = 0, stop: Optional[int] = None):
+        """
+        Yield ``(first_frame, data)`` pairs covering frames [start, stop),
+        one per compression block, decoding each block only when reached.
+        """
+        if stop is None:
+            stop = self.header.frame_count
+        self._check_range(start, stop)
+        size = self.header.channel_count
+        frame = start
+        while frame < stop:
+            index = self.block_index(frame)
+            block = self.header.blocks[index]
+            end = min(stop, block.first_frame + block.frame_count)
+            data = self.read_block(index)
+            lo = (frame - block.first_frame) * size
+            yield frame, data[lo:lo + (end - frame) * size]
+            frame = end
+
+    def iter_chunks(self, chunk_frames: int = DEFAULT_CHUNK_FRAMES,
+                    start: int = 0, stop: Optional[int] = None):
+        """
+        Yield ``(first_frame, data)`` pairs of at most chunk_frames frames
+        covering [start, stop), so a whole sequence can be streamed with
+        bounded memory.
+        """
+        if stop is None:
+            stop = self.header.frame_count
+        for first in range(start, stop, chunk_frames):
+            yield first, self.frames(first, min(stop, first + chunk_frames))
+
+    def frames(self, start: int = 0, stop: Optional[int] = None) -> memoryview:
+        """
+        Return frames [start, stop) as one contiguous memoryview.
+
+        Zero-copy unless the range spans several compressed blocks.
+        """
+        if stop is None:
+            stop = self.header.frame_count
+        self._check_range(start, stop)
+        size = self.header.channel_count
+        if not self.is_compressed:
+            base = self.header.data_offset
+            count(BYTES_READ, (stop - start) * size)
+            return memoryview(self._mmap)[base + start * size:base + stop * size]
+
+        parts = list(self.iter_blocks(start, stop))
+        if len(parts) == 1:
+            return parts[0][1]
+        buffer = bytearray((stop - start) * size)
+        pos = 0
+        for _, data in parts:
+            buffer[pos:pos + len(data)] = data
+            pos += len(data)
+        return memoryview(buffer)
+
+    def frame(self, index: int) -> memoryview:
+        """Return the channel bytes of a single frame as a memoryview."""
+        if index < 0:
+            index += self.header.frame_count
+        return self.frames(index, index + 1)
+
+    def as_array(self, start: int = 0, stop: Optional[int] = None):
+        """
+        Return frames [start, stop) as a read-only ``(frames, channels)``
+        NumPy uint8 array. Requires NumPy.
+        """
+        import numpy as np
+
+        if stop is None:
+            stop = self.header.frame_count
+        data = self.frames(start, stop)
+        return np.frombuffer(data, dtype=np.uint8).reshape(
+            stop - start, self.header.channel_count)
+
+
+class FseqWriter:
+    """
+    Streaming FSEQ v2 writer.
+
+    Frames are buffered until a compression block is full, then compressed
+    and written; the header and block index are filled in on ``close()``.
+    Uncompressed output is the v2.0 layout Tesla's validator accepts.
+
+    Example:
+        with FseqWriter(path, channel_count=48, frame_count=n,
+                        step_time_ms=20) as out:
+            for chunk in chunks:
+                out.write_frames(chunk)
+    """
+
+    def __init__(self, path: Path, channel_count: int, frame_count: int,
+                 step_time_ms: int, compression: int = COMPRESSION_NONE,
+                 level: Optional[int] = None,
+                 frames_per_block: int = DEFAULT_FRAMES_PER_BLOCK,
+                 sparse_ranges: Optional[List[SparseRange]] = None,
+                 variable_headers: Optional[Dict[str, bytes]] = None,
+                 unique_id: int = 0):
+        if compression not in COMPRESSION_NAMES:
+            raise FseqError(f"Unknown compression type {compression}")
+        if not 0 < step_time_ms < 256:
+            raise FseqError(f"Frame interval must be 1-255 ms, got {step_time_ms}")
+
+        self.path = Path(path)
+        self.channel_count = channel_count
+        self.frame_count = frame_count
+        self.step_time_ms = step_time_ms
+        self.compression = compression
+        self.level = level
+        self.sparse_ranges = list(sparse_ranges or [])
+        self.variable_headers = dict(variable_headers or {})
+        self.unique_id = unique_id
+        self.bytes_written = 0
+
+        if compression == COMPRESSION_NONE:
+            self.frames_per_block = max(frame_count, 1)
+            self._block_slots = 0
+        else:
+            needed = -(-frame_count // MAX_BLOCKS) if frame_count else 1
+            self.frames_per_block = max(frames_per_block, needed)
+            self._block_slots = -(-frame_count // self.frames_per_block) if frame_count else 0
+
+        self._variable = b''.join(
+            struct.pack('<H2s', 4 + len(value), code.encode('latin-1')) + value
+            for code, value in self.variable_headers.items()
+        )
+        self._header_len = (V2_HEADER_SIZE + self._block_slots * 8
+                            + len(self.sparse_ranges) * 6)
+        self.data_offset = self._header_len + len(self._variable)
+        # Keep channel data aligned like xLights does
+        self.data_offset = (self.data_offset + 3) & ~3
+
+        self._blocks = []
+        self._pending = bytearray()
+        self._frames_written = 0
+        self._file = open(self.path, 'wb')
+        self._file.write(b'\x00' * self.data_offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write_frames(self, data):
+        """
+        Append whole frames of channel data (any bytes-like object, e.g. a
+        C-contiguous uint8 NumPy array of shape (frames, channels)).
+        """
+        view = memoryview(data).cast('B')
+        if len(view) % self.channel_count:
+            raise FseqError(
+                f"Frame data length {len(view)} is not a multiple of "
+                f"{self.channel_count} channels"
+            )
+        frames = len(view) // self.channel_count
+        if self._frames_written + frames > self.frame_count:
+            raise FseqError(f"More than the declared {self.frame_count} frames written")
+        self._frames_written += frames
+
+        if self.compression == COMPRESSION_NONE:
+            self._file.write(view)
+            self.bytes_written += len(view)
+            return
+
+        block_size = self.frames_per_block * self.channel_count
+        pos = 0
+        if self._pending:
+            take = min(block_size - len(self._pending), len(view))
+            self._pending += view[:take]
+            pos = take
+            if len(self._pending) == block_size:
+                self._flush_block(self._pending)
+                self._pending = bytearray()
+        while len(view) - pos >= block_size:
+            self._flush_block(view[pos:pos + block_size])
+            pos += block_size
+        if pos < len(view):
+            self._pending += view[pos:]
+
+    def write_block(self, compressed: bytes, frames: int):
+        """
+        Append one block that was compressed elsewhere, e.g. by a worker
+        thread. Every block but the last must hold ``frames_per_block``
+        frames, and blocks cannot be mixed with a partial ``write_frames``.
+        """
+        if self.compression == COMPRESSION_NONE:
+            raise FseqError("Uncompressed sequences have no blocks to write")
+        if self._pending:
+            raise FseqError("Cannot write a block after a partial block of frames")
+        if self._frames_written + frames > self.frame_count:
+            raise FseqError(f"More than the declared {self.frame_count} frames written")
+        if frames != self.frames_per_block and self._frames_written + frames != self.frame_count:
+            raise FseqError(
+                f"Block of {frames} frames, expected {self.frames_per_block}"
+            )
+        self._frames_written += frames
+        self._append_block(compressed, frames)
+
+    def _flush_block(self, data):
+        compressed = compress_block(data, self.compression, self.level)
+        self._append_block(compressed, len(data) // self.channel_count)
+
+    def _append_block(self, compressed: bytes, frames: int):
+        first_frame = sum(count for _, count, _ in self._blocks)
+        self._file.write(compressed)
+        self.bytes_written += len(compressed)
+        self._blocks.append((first_frame, frames, len(compressed)))
+
+    def abort(self):
+        """Close and delete a partially written file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.path.unlink()
+
+    def close(self):
+        """Flush the last block and write the header and block index."""
+        if self._file is None:
+            return
+        if self._pending:
+            self._flush_block(self._pending)
+            self._pending = bytearray()
+        if self._frames_written != self.frame_count:
+            self.abort()
+            raise FseqError(
+                f"Wrote {self._frames_written} frames, declared {self.frame_count}"
+            )
+
+        block_count = self._block_slots
+        header = b'PSEQ' + struct.pack(
+            '<HBBHIIBBBBBBQ',
+            self.data_offset, 0, 2, self._header_len,
+            self.channel_count, self.frame_count, self.step_time_ms, 0,
+            self.compression | ((block_count >> 8) << 4), block_count & 0xFF,
+            len(self.sparse_ranges), 0, self.unique_id,
+        )
+        index = b''.join(
+            struct.pack('<II', first_frame, length)
+            for first_frame, _, length in self._blocks
+        )
+        index += b'\x00' * (block_count * 8 - len(index))
+        ranges = b''.join(
+            r.start_channel.to_bytes(3, 'little') + r.channel_count.to_bytes(3, 'little')
+            for r in self.sparse_ranges
+        )
+
+        self._file.seek(0)
+        self._file.write(header + index + ranges + self._variable)
+        self._file.close()
+        self._file = None
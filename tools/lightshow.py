@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Single entry point for the Tesla Lightshow tools.
+
+    lightshow <command> [options]
+
+Each command is one of the scripts in this directory; ``lightshow validate
+shows/my-show`` is the same as ``python tools/validate.py shows/my-show``.
+A command's module is imported only when that command runs, and the tools
+themselves import NumPy and the compression codecs only when a feature
+needs them, so hooks and scripts that call this thousands of times pay for
+little more than the interpreter's own startup.
+
+To put it on your PATH, symlink it (``make install``) — Python resolves the
+link, so the tools are still found next to the real file.
+"""
+import sys
+
+
+PROG = "lightshow"
+
+# command: (module, summary), in the order they are listed
+COMMANDS = {
+    'create': ('create_show', 'Create a new show from the template'),
+    'validate': ('validate', 'Validate show files against Tesla\'s limits'),
+    'package': ('package', 'Package a show for USB deployment'),
+    'list': ('list_shows', 'List all shows'),
+    'batch': ('batch', 'Validate or package every show in parallel'),
+    'bundle': ('bundle', 'Pack many shows onto as few USB sticks as possible'),
+    'verify': ('verify', 'Check a deployed stick against its checksums'),
+    'diff': ('diff', 'Show what changed between two sequences'),
+    'preview': ('preview', 'Render a sequence as a timeline thumbnail'),
+    'render': ('effects', 'Render a timeline of effects to a sequence'),
+    'optimize': ('optimize', 'Shrink a sequence to the USB size budget'),
+    'convert': ('convert', 'Rewrite an old or unusual sequence as plain FSEQ v2'),
+    'analyze': ('analyze', 'Draft a sequence from the music\'s beats'),
+    'serve': ('serve', 'Validate and package uploaded shows over HTTP'),
+}
+
+
+def usage() -> str:
+    lines = [
+        f"usage: {PROG} <command> [options]",
+        "",
+        "Tesla Lightshow tools",
+        "",
+        "commands:",
+    ]
+    width = max(len(name) for name in COMMANDS)
+    for name, (_, summary) in COMMANDS.items():
+        lines.append(f"  {name:<{width}}  {summary}")
+    lines += ["", f"Run '{PROG} <command> --help' for a command's options."]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """
+    Run one command.
+
+    Args:
+        argv: Command line without the program name (default: sys.argv[1:])
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if not argv:
+        print(usage(), file=sys.stderr)
+        sys.exit(2)
+    if argv[0] in ('-h', '--help', 'help'):
+        print(usage())
+        return
+
+    name = argv[0]
+    if name not in COMMANDS:
+        # Only pay for difflib when a command is mistyped
+        import difflib
+        print(f"{PROG}: unknown command '{name}'", file=sys.stderr)
+        close = difflib.get_close_matches(name, COMMANDS, n=1)
+        if close:
+            print(f"Did you mean '{PROG} {close[0]}'?", file=sys.stderr)
+        print(f"Run '{PROG} --help' for the list of commands.", file=sys.stderr)
+        sys.exit(2)
+
+    module = __import__(COMMANDS[name][0])
+    # argparse takes the program name from argv[0]: "lightshow validate ..."
+    sys.argv = [f"{PROG} {name}"] + argv[1:]
+    module.main()
+
+
+if __name__ == '__main__':
+    main()
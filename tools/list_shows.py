@@ -7,50 +7,131 @@ Displays a summary of all shows with metadata and file information.
 import sys
 import argparse
 from pathlib import Path
+from typing import Dict, List, Optional
 
 from utils import (
-    find_all_shows, get_show_files, load_metadata,
-    print_info, print_success, format_size, Colors
+    print_info, print_success, print_error, format_size, Colors,
+    add_output_options, begin_output, end_output
 )
+from show_index import ShowIndex, SORT_KEYS
+from show import Show
+from tracing import traced
 
 
-def list_shows(shows_dir: Path = None, verbose: bool = False):
+@traced('list')
+def find_shows(shows_dir: Path, search: str = None, sort: str = 'name',
+               reverse: bool = False, rescan: bool = False) -> List[Show]:
+    """
+    Refresh the show index and return the matching shows.
+    
+    The shows are built from their index entries, so their metadata, file
+    sizes and audio durations are not read again.
+    
+    Args:
+        shows_dir: Directory containing shows
+        search: Only return shows whose name or artist contains this text
+        sort: Sort by 'name', 'artist' or 'duration'
+        reverse: Sort in descending order
+        rescan: Ignore the index and rescan every show directory
+    """
+    index = ShowIndex(shows_dir)
+    index.refresh(force=rescan)
+    return [Show.from_index(shows_dir, entry)
+            for entry in index.query(search=search, sort=sort, reverse=reverse)]
+
+
+@traced('preview')
+def show_previews(shows: List[Show]) -> Dict[str, Optional[str]]:
+    """
+    Return the path of each show's timeline thumbnail, by directory name.
+    
+    Thumbnails come from the preview cache, so only shows whose sequence
+    changed since the last run are rendered. Shows without a readable
+    sequence map to None.
+    """
+    from preview import PreviewCache
+    from fseq import FseqError
+    
+    cache = PreviewCache()
+    previews = {}
+    try:
+        for show in shows:
+            previews[show.name] = None
+            if show.fseq_file:
+                try:
+                    previews[show.name] = str(cache.get(show))
+                except (OSError, FseqError):
+                    pass
+    finally:
+        cache.save()
+    return previews
+
+
+def show_summary(show: Show, previews: Optional[Dict[str, Optional[str]]] = None) -> Dict:
+    """Return the JSON output record for one show."""
+    summary = {
+        'dir': show.name,
+        'name': show.title,
+        'artist': show.artist,
+        'duration': show.duration,
+        'fseq': show.file_info('fseq'),
+        'audio': show.file_info('audio'),
+        'metadata': show.metadata or None,
+    }
+    if previews is not None:
+        summary['preview'] = previews.get(show.name)
+    return summary
+
+
+def list_shows(shows_dir: Path = None, verbose: bool = False, search: str = None,
+               sort: str = 'name', reverse: bool = False, rescan: bool = False,
+               previews: bool = False):
     """
     List all shows in the repository.
     
+    Show details come from the persistent show index, so only directories
+    that changed since the last run are scanned again.
+    
     Args:
         shows_dir: Directory containing shows (default: shows/)
         verbose: Show detailed information
+        search: Only list shows whose name or artist contains this text
+        sort: Sort by 'name', 'artist' or 'duration'
+        reverse: Sort in descending order
+        rescan: Ignore the index and rescan every show directory
+        previews: Also render (or reuse) each show's timeline thumbnail
+    
+    Returns:
+        The listed shows
     """
     if shows_dir is None:
         shows_dir = Path("shows")
     
     if not shows_dir.exists():
         print_info("No shows directory found. Create one with: mkdir shows")
-        return
+        return []
     
-    shows = find_all_shows(shows_dir)
+    shows = find_shows(shows_dir, search, sort, reverse, rescan)
     
     if not shows:
-        print_info("No shows found in the shows/ directory.")
-        print_info("Create your first show with: python tools/create_show.py \"My Show\"")
-        return
+        if search:
+            print_info(f"No shows match '{search}'.")
+        else:
+            print_info("No shows found in the shows/ directory.")
+            print_info("Create your first show with: python tools/create_show.py \"My Show\"")
+        return []
+    
+    preview_paths = show_previews(shows) if previews else {}
     
     print(f"{Colors.BOLD}Found {len(shows)} show(s):{Colors.END}\n")
     
-    for i, show_dir in enumerate(shows, 1):
-        print(f"{Colors.BLUE}{i}. {show_dir.name}{Colors.END}")
-        
-        # Get files
-        fseq_file, audio_file, metadata_file = get_show_files(show_dir)
+    for i, show in enumerate(shows, 1):
+        print(f"{Colors.BLUE}{i}. {show.name}{Colors.END}")
         
-        # Load metadata if available
-        metadata = None
-        if metadata_file:
-            try:
-                metadata = load_metadata(metadata_file)
-            except Exception:
-                pass
+        fseq_file = show.file_info('fseq')
+        audio_file = show.file_info('audio')
+        metadata = show.metadata
+        preview = preview_paths.get(show.name)
         
         # Display metadata
         if metadata:
@@ -58,21 +139,25 @@ def list_shows(shows_dir: Path = None, verbose: bool = False):
                 print(f"   Name: {metadata['name']}")
             if 'artist' in metadata:
                 print(f"   Artist: {metadata['artist']}")
-            if 'duration' in metadata:
-                duration = metadata['duration']
-                minutes = duration // 60
-                seconds = duration % 60
-                print(f"   Duration: {minutes}m {seconds}s")
+        
+        # Duration from metadata, or probed from the audio file
+        duration = int(round(show.duration))
+        if duration:
+            minutes = duration // 60
+            seconds = duration % 60
+            print(f"   Duration: {minutes}m {seconds}s")
         
         # Display files
         if verbose:
             print(f"   Files:")
             if fseq_file:
-                print(f"     • {fseq_file.name} ({format_size(fseq_file.stat().st_size)})")
+                print(f"     • {fseq_file['name']} ({format_size(fseq_file['size'])})")
             if audio_file:
-                print(f"     • {audio_file.name} ({format_size(audio_file.stat().st_size)})")
-            if metadata_file:
+                print(f"     • {audio_file['name']} ({format_size(audio_file['size'])})")
+            if show.has_metadata:
                 print(f"     • metadata.json")
+            if preview:
+                print(f"   Preview: {preview}")
         else:
             status_parts = []
             if fseq_file:
@@ -86,10 +171,14 @@ def list_shows(shows_dir: Path = None, verbose: bool = False):
                 status_parts.append("✗ audio")
             
             print(f"   Status: {', '.join(status_parts)}")
+            if preview:
+                print(f"   Preview: {preview}")
         
         print()  # Blank line between shows
     
     print_success(f"Total: {len(shows)} show(s)")
+    
+    return shows
 
 
 def main():
@@ -100,6 +189,12 @@ def main():
 Examples:
   %(prog)s           List all shows
   %(prog)s -v        List with detailed file information
+  %(prog)s -s jingle --sort duration
+                     Shows matching "jingle", shortest first
+  %(prog)s -v --previews
+                     Also render timeline thumbnails (cached)
+  %(prog)s --format json
+                     Show details as JSON
         """
     )
     
@@ -116,9 +211,63 @@ Examples:
         help='Shows directory (default: shows/)'
     )
     
+    parser.add_argument(
+        '-s', '--search',
+        help='Only list shows whose name or artist contains this text'
+    )
+    
+    parser.add_argument(
+        '--sort',
+        choices=SORT_KEYS,
+        default='name',
+        help='Sort order (default: name)'
+    )
+    
+    parser.add_argument(
+        '-r', '--reverse',
+        action='store_true',
+        help='Reverse the sort order'
+    )
+    
+    parser.add_argument(
+        '--rescan',
+        action='store_true',
+        help='Ignore the show index and rescan every show directory'
+    )
+    
+    parser.add_argument(
+        '--previews',
+        action='store_true',
+        help='Render each show\'s timeline thumbnail (see preview.py; needs numpy)'
+    )
+    
+    add_output_options(parser)
+    
     args = parser.parse_args()
     
-    list_shows(args.directory, args.verbose)
+    if args.previews:
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            print_error("--previews requires NumPy: pip install numpy")
+            sys.exit(1)
+    
+    with begin_output(args) as messages:
+        if args.format == 'json':
+            shows = find_shows(args.directory, args.search, args.sort,
+                               args.reverse, args.rescan)
+            previews = show_previews(shows) if args.previews else None
+        else:
+            shows = list_shows(args.directory, args.verbose, search=args.search,
+                               sort=args.sort, reverse=args.reverse, rescan=args.rescan,
+                               previews=args.previews)
+            previews = None
+    end_output(args, {
+        'tool': 'list_shows',
+        'shows_dir': str(args.directory),
+        'shows': [show_summary(show, previews) for show in shows],
+        'messages': messages,
+    })
 
 
 if __name__ == '__main__':
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Shrink a Tesla Lightshow sequence to fit the USB size budget.
+
+Streams the .fseq through the reader and writer a chunk at a time, so the
+decoded show is never held in memory. Depending on the options it:
+
+- drops unused channels (a 200-channel file whose extra channels are all
+  zero becomes a 48-channel file, or with --sparse only used channel runs
+  are stored),
+- resamples high frame rates (e.g. 50 -> 25 FPS) by frame decimation,
+- re-blocks and recompresses the frame data with the best codec and level.
+
+Tesla only plays uncompressed, non-sparse 48 or 200 channel files, so
+--compress and --sparse are meant for archiving shows, not for the USB
+drive.
+"""
+import os
+import sys
+import argparse
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+from utils import (
+    get_show_files, print_success, print_error, print_warning, print_info,
+    format_size
+)
+from fseq import (
+    FseqFile, FseqWriter, FseqError, SparseRange, compress_block,
+    COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_ZSTD, COMPRESSION_NAMES,
+    DEFAULT_FRAMES_PER_BLOCK,
+)
+import tesla
+
+
+DEFAULT_BUDGET_MB = 50
+CHUNK_FRAMES = 2048
+
+# (compression, level) pairs tried by --compress auto
+CODEC_CANDIDATES = [
+    (COMPRESSION_ZLIB, 1), (COMPRESSION_ZLIB, 6), (COMPRESSION_ZLIB, 9),
+    (COMPRESSION_ZSTD, 1), (COMPRESSION_ZSTD, 3), (COMPRESSION_ZSTD, 10),
+    (COMPRESSION_ZSTD, 19),
+]
+# Blocks compressed when picking a codec
+SAMPLE_BLOCKS = 8
+
+
+class OptimizeResult(NamedTuple):
+    """Summary of one optimizer run."""
+    source_size: int
+    output_size: int
+    channels: Tuple[int, int]       # (before, after)
+    fps: Tuple[float, float]        # (before, after)
+    compression: str
+    level: Optional[int]
+
+
+def find_used_channels(seq: FseqFile):
+    """Return a boolean array marking channels that are ever non-zero."""
+    import numpy as np
+
+    used = np.zeros(seq.channel_count, dtype=bool)
+    for _, data in seq.iter_chunks(CHUNK_FRAMES):
+        chunk = np.frombuffer(data, dtype=np.uint8).reshape(-1, seq.channel_count)
+        used |= chunk.any(axis=0)
+        del chunk
+    return used
+
+
+def channel_runs(used) -> List[SparseRange]:
+    """Collapse a boolean channel mask into contiguous sparse ranges."""
+    import numpy as np
+
+    padded = np.concatenate(([False], used, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return [SparseRange(int(start), int(stop - start))
+            for start, stop in zip(edges[::2], edges[1::2])]
+
+
+def decimation_factor(step_time_ms: int, target_fps: float) -> int:
+    """
+    Return how many source frames make up one output frame.
+
+    Raises:
+        ValueError: If the target rate is not an integer divisor of the source
+    """
+    target_step = 1000.0 / target_fps
+    factor = target_step / step_time_ms
+    if factor < 1 or abs(factor - round(factor)) > 1e-6:
+        raise ValueError(
+            f"Cannot resample {1000.0 / step_time_ms:g} FPS to {target_fps:g} FPS; "
+            "the target must divide the source rate"
+        )
+    return int(round(factor))
+
+
+def iter_output_chunks(seq: FseqFile, columns, factor: int):
+    """
+    Yield transformed chunks: decimated frames restricted to the kept columns.
+
+    ``columns`` is a slice or an index array over the source channels.
+    """
+    import numpy as np
+
+    # Keep chunks aligned to the decimation factor
+    chunk_frames = max(factor, CHUNK_FRAMES // factor * factor)
+    for _, data in seq.iter_chunks(chunk_frames):
+        chunk = np.frombuffer(data, dtype=np.uint8).reshape(-1, seq.channel_count)
+        yield np.ascontiguousarray(chunk[::factor, columns])
+        del chunk
+
+
+def pick_codec(sample, candidates=CODEC_CANDIDATES) -> Tuple[int, Optional[int]]:
+    """Return the (compression, level) that compresses the sample smallest."""
+    best = None
+    for compression, level in candidates:
+        try:
+            size = sum(len(compress_block(block, compression, level)) for block in sample)
+        except FseqError:
+            continue  # codec not installed
+        if best is None or size < best[0]:
+            best = (size, compression, level)
+    if best is None:
+        return COMPRESSION_NONE, None
+    return best[1], best[2]
+
+
+def optimize_sequence(src: Path, dest: Path, target_fps: Optional[float] = None,
+                      trim: bool = True, sparse: bool = False,
+                      compression: str = 'none', level: Optional[int] = None) -> OptimizeResult:
+    """
+    Write an optimized copy of an .fseq file.
+
+    Args:
+        src: Source sequence
+        dest: Output path (must differ from src)
+        target_fps: Resample to this frame rate (must divide the source rate)
+        trim: Drop Tesla's extended channels when they are all zero
+        sparse: Store only the channel runs that are ever used
+        compression: 'none', 'zlib', 'zstd' or 'auto'
+        level: Compression level (default: codec default, or best for 'auto')
+
+    Returns:
+        OptimizeResult describing the output
+    """
+    import numpy as np
+
+    with FseqFile(src) as seq:
+        header = seq.header
+        if header.sparse_ranges:
+            raise FseqError("Sparse source sequences are not supported")
+
+        factor = 1
+        if target_fps:
+            factor = decimation_factor(header.step_time_ms, target_fps)
+        out_step = header.step_time_ms * factor
+        out_frames = -(-header.frame_count // factor)
+
+        columns = slice(0, header.channel_count)
+        ranges = []
+        if trim or sparse:
+            used = find_used_channels(seq)
+            if sparse:
+                ranges = channel_runs(used)
+                columns = np.flatnonzero(used)
+                if len(columns) == 0:
+                    ranges = [SparseRange(0, 1)]
+                    columns = np.array([0])
+            elif header.channel_count > tesla.CHANNEL_COUNTS[0] \
+                    and not used[tesla.CHANNEL_COUNTS[0]:].any():
+                columns = slice(0, tesla.CHANNEL_COUNTS[0])
+        out_channels = len(np.arange(header.channel_count)[columns])
+
+        codec = {'none': COMPRESSION_NONE, 'zlib': COMPRESSION_ZLIB,
+                 'zstd': COMPRESSION_ZSTD}.get(compression)
+        if compression == 'auto':
+            sample = []
+            for chunk in iter_output_chunks(seq, columns, factor):
+                for start in range(0, len(chunk), DEFAULT_FRAMES_PER_BLOCK):
+                    sample.append(chunk[start:start + DEFAULT_FRAMES_PER_BLOCK].tobytes())
+                if len(sample) >= SAMPLE_BLOCKS:
+                    break
+            candidates = CODEC_CANDIDATES
+            if level is not None:
+                candidates = [(c, level) for c in (COMPRESSION_ZLIB, COMPRESSION_ZSTD)]
+            codec, level = pick_codec(sample[:SAMPLE_BLOCKS], candidates)
+        elif codec is None:
+            raise ValueError(f"Unknown compression: {compression}")
+
+        writer = FseqWriter(
+            dest, out_channels, out_frames, out_step,
+            compression=codec, level=level, sparse_ranges=ranges,
+            variable_headers=header.variable_headers, unique_id=header.unique_id,
+        )
+        with writer:
+            for chunk in iter_output_chunks(seq, columns, factor):
+                writer.write_frames(chunk)
+
+        return OptimizeResult(
+            seq.size, os.path.getsize(dest),
+            (header.channel_count, out_channels),
+            (header.fps, 1000.0 / out_step),
+            COMPRESSION_NAMES[codec], level if codec != COMPRESSION_NONE else None,
+        )
+
+
+def resolve_sequence(path: Path) -> Optional[Path]:
+    """Accept either an .fseq file or a show directory."""
+    if path.is_dir():
+        fseq_file, _, _ = get_show_files(path)
+        return fseq_file
+    return path if path.exists() else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Shrink a Tesla Lightshow sequence to fit the USB size budget',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s shows/my-show --in-place              Drop unused channels
+  %(prog)s shows/my-show --fps 25 --in-place     Also resample 50 FPS to 25 FPS
+  %(prog)s lightshow.fseq -o archive.fseq --compress auto --sparse
+                                                 Smallest file for archiving
+        """
+    )
+
+    parser.add_argument(
+        'source',
+        type=Path,
+        help='Show directory or .fseq file'
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        type=Path,
+        help='Output .fseq file'
+    )
+
+    parser.add_argument(
+        '--in-place',
+        action='store_true',
+        help='Replace the source file with the optimized sequence'
+    )
+
+    parser.add_argument(
+        '--fps',
+        type=float,
+        help='Resample to this frame rate (e.g. 25 or 20)'
+    )
+
+    parser.add_argument(
+        '--compress',
+        choices=['none', 'zlib', 'zstd', 'auto'],
+        default='none',
+        help='Block compression (default: none, which Tesla requires)'
+    )
+
+    parser.add_argument(
+        '--level',
+        type=int,
+        help='Compression level'
+    )
+
+    parser.add_argument(
+        '--sparse',
+        action='store_true',
+        help='Store only channels that are ever used (not playable by Tesla)'
+    )
+
+    parser.add_argument(
+        '--no-trim',
+        action='store_true',
+        help='Keep all channels even if the extended ones are unused'
+    )
+
+    parser.add_argument(
+        '--budget',
+        type=float,
+        default=DEFAULT_BUDGET_MB,
+        help=f'Size budget in MB (default: {DEFAULT_BUDGET_MB})'
+    )
+
+    args = parser.parse_args()
+
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print_error("optimize.py requires NumPy: pip install numpy")
+        sys.exit(1)
+
+    src = resolve_sequence(args.source)
+    if src is None:
+        print_error(f"No .fseq file found at: {args.source}")
+        sys.exit(1)
+
+    if args.in_place == bool(args.output):
+        print_error("Give exactly one of --output or --in-place")
+        sys.exit(1)
+
+    dest = src.with_name(f".{src.name}.optimized") if args.in_place else args.output
+    if dest.absolute() == src.absolute():
+        print_error("Output must differ from the source (use --in-place)")
+        sys.exit(1)
+
+    print_info(f"Optimizing: {src}")
+    try:
+        result = optimize_sequence(
+            src, dest, target_fps=args.fps, trim=not args.no_trim,
+            sparse=args.sparse, compression=args.compress, level=args.level,
+        )
+    except (FseqError, ValueError, OSError) as e:
+        print_error(f"Failed to optimize sequence: {e}")
+        sys.exit(1)
+
+    if args.in_place:
+        os.replace(dest, src)
+        dest = src
+
+    before_channels, after_channels = result.channels
+    before_fps, after_fps = result.fps
+    if after_channels != before_channels:
+        print_info(f"  Channels: {before_channels} → {after_channels}")
+    if after_fps != before_fps:
+        print_info(f"  Frame rate: {before_fps:g} → {after_fps:g} FPS")
+    if result.compression != 'none':
+        level = f" level {result.level}" if result.level is not None else ""
+        print_info(f"  Compression: {result.compression}{level}")
+        print_warning("Tesla only plays uncompressed sequences; keep this file for archiving")
+    if args.sparse:
+        print_warning("Tesla does not play sparse sequences; keep this file for archiving")
+
+    saved = 1 - result.output_size / result.source_size if result.source_size else 0
+    print_success(
+        f"Wrote {dest}: {format_size(result.source_size)} → "
+        f"{format_size(result.output_size)} ({saved:.0%} smaller)"
+    )
+
+    budget = args.budget * 1024 * 1024
+    if result.output_size > budget:
+        print_error(
+            f"Still over the {args.budget:g} MB budget by "
+            f"{format_size(result.output_size - budget)}"
+        )
+        sys.exit(1)
+    print_success(f"Within the {args.budget:g} MB budget "
+                  f"({result.output_size / budget:.0%} used)")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,35 +5,114 @@ Package Tesla Lightshow for USB deployment.
 Creates a build directory with properly named files ready for Tesla.
 """
 import sys
-import shutil
 import argparse
+import tempfile
 from pathlib import Path
+from typing import Optional, Union
 
 from utils import (
-    get_show_files, print_success, print_error, print_info,
-    load_metadata
+    print_success, print_error, print_warning, print_info,
+    add_output_options, begin_output, end_output,
+    format_size, parse_size
 )
+from show import Show
+from audio import AudioCut, AudioError, plan_cut, write_cut
+from fseq import FseqError
+from build_cache import BuildCache, hash_file
+from verify import MANIFEST_NAME, format_manifest, write_manifest
+from tracing import traced
 
 
-def package_show(show_dir: Path, output_dir: Path = None) -> bool:
+def _check_playable(show: Show) -> bool:
+    """
+    Check the sequence is stored the way Tesla plays it (FSEQ v2,
+    uncompressed, every channel), printing why not otherwise.
+    """
+    from validate import check_layout
+    
+    try:
+        header = show.header
+    except (FseqError, OSError) as e:
+        print_error(f"Cannot package: Invalid sequence file: {e}")
+        return False
+    if not check_layout(header):
+        print_error("Cannot package: Tesla cannot play this sequence")
+        return False
+    return True
+
+
+def _report_install(cache: BuildCache, src: Path, dest: Path, label: str):
+    """Install one file through the build cache and report what happened."""
+    method = cache.install(src, dest)
+    if method is None:
+        print_info(f"Up to date: {label}")
+    else:
+        print_success(f"Copied: {label} ({method})")
+
+
+def _plan_trim(show: Show, tail_pad: float) -> Optional[AudioCut]:
+    """
+    Plan cutting the show's audio to the sequence length plus tail_pad.
+
+    Returns:
+        The cut, or None if the audio is no longer than that or cannot be cut
+    """
+    try:
+        seconds = show.header.duration + tail_pad
+        return plan_cut(show.audio_file, seconds)
+    except (FseqError, AudioError, OSError) as e:
+        print_warning(f"Not trimming audio: {e}")
+        return None
+
+
+def _install_trimmed(cache: BuildCache, show: Show, cut: AudioCut, dest: Path):
+    """Install the cut audio through the build cache and report it."""
+    src = show.audio_file
+    method = cache.install(src, dest, write=lambda tmp: write_cut(src, tmp, cut) or 'trim',
+                           variant=f"trim {cut.size}")
+    label = f"{src.name} → {dest.name}"
+    if method is None:
+        print_info(f"Up to date: {label} (trimmed)")
+    else:
+        saved = show.audio_size - cut.size
+        print_success(f"Trimmed: {label} (cut at {cut.duration:.1f}s, "
+                      f"{format_size(saved)} saved)")
+
+
+@traced('package')
+def package_show(show_dir: Union[Path, Show], output_dir: Path = None, force: bool = False,
+                 hardlink: bool = False, trim_audio: bool = False,
+                 tail_pad: float = 0.0) -> bool:
     """
     Package a show for USB deployment.
     
+    Files already packaged from unchanged sources are skipped, using the
+    build manifest kept under build/.cache/. The SHA-256 of each LightShow/
+    file is computed while it is copied and written to SHA256SUMS, for
+    verify.py to check the deployed stick against.
+    
     Args:
-        show_dir: Path to show directory
+        show_dir: Path to show directory, or an already loaded Show
         output_dir: Output directory (default: build/<show-name>)
+        force: Ignore the build manifest and rewrite every file
+        hardlink: Hardlink outputs to their sources when possible
+        trim_audio: Cut the audio to the sequence's length; only the new
+            header is written by Python, the kept audio is copied by the
+            kernel
+        tail_pad: With trim_audio, seconds of audio to keep past the last frame
     
     Returns:
         True if successful, False otherwise
     """
+    show = show_dir if isinstance(show_dir, Show) else Show.load(show_dir)
+    show_dir = show.path
     print_info(f"Packaging show: {show_dir.name}")
     
     # Set default output directory
     if output_dir is None:
         output_dir = Path("build") / show_dir.name
     
-    # Get show files
-    fseq_file, audio_file, metadata_file = get_show_files(show_dir)
+    fseq_file, audio_file, metadata_file = show.fseq_file, show.audio_file, show.metadata_file
     
     if not fseq_file:
         print_error("Cannot package: Missing .fseq file")
@@ -43,6 +122,9 @@ def package_show(show_dir: Path, output_dir: Path = None) -> bool:
         print_error("Cannot package: Missing audio file")
         return False
     
+    if not _check_playable(show):
+        return False
+    
     # Create output directory
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -51,23 +133,36 @@ def package_show(show_dir: Path, output_dir: Path = None) -> bool:
     lightshow_dir = output_dir / "LightShow"
     lightshow_dir.mkdir(exist_ok=True)
     
+    cache = BuildCache(output_dir, hardlink=hardlink)
+    if force:
+        cache.entries = {}
+    
     # Copy and rename files to Tesla's expected names
     try:
         # Copy .fseq file
         dest_fseq = lightshow_dir / "lightshow.fseq"
-        shutil.copy2(fseq_file, dest_fseq)
-        print_success(f"Copied: {fseq_file.name} → lightshow.fseq")
+        _report_install(cache, fseq_file, dest_fseq, f"{fseq_file.name} → lightshow.fseq")
         
-        # Copy audio file with proper name
+        # Copy audio file with proper name, cut to the sequence if asked
         dest_audio = lightshow_dir / f"lightshow{audio_file.suffix}"
-        shutil.copy2(audio_file, dest_audio)
-        print_success(f"Copied: {audio_file.name} → lightshow{audio_file.suffix}")
+        cut = _plan_trim(show, tail_pad) if trim_audio else None
+        if cut is not None:
+            _install_trimmed(cache, show, cut, dest_audio)
+        else:
+            _report_install(cache, audio_file, dest_audio,
+                            f"{audio_file.name} → lightshow{audio_file.suffix}")
+        
+        # Checksum manifest for verify.py, next to LightShow/ on the stick
+        digests = {
+            f"LightShow/{dest.name}": cache.digest(dest)
+            for dest in (dest_fseq, dest_audio)
+        }
+        cache.write_text(output_dir / MANIFEST_NAME, format_manifest(digests))
         
         # Copy metadata if it exists
         if metadata_file:
             dest_metadata = output_dir / "metadata.json"
-            shutil.copy2(metadata_file, dest_metadata)
-            print_success(f"Copied: metadata.json")
+            _report_install(cache, metadata_file, dest_metadata, "metadata.json")
         
         # Create a README for the USB drive
         readme_content = f"""# Tesla Lightshow
@@ -76,22 +171,24 @@ Show: {show_dir.name}
 
 ## Installation
 
-1. Copy the 'LightShow' folder to the root of your USB drive
-2. Safely eject the USB drive
-3. Insert into your Tesla's front USB port
-4. Put car in Park
-5. Navigate to: Toybox > Light Show > Custom
+1. Copy the 'LightShow' folder and {MANIFEST_NAME} to the root of your USB drive
+2. Check the copy with: python tools/verify.py /path/to/usb
+3. Safely eject the USB drive
+4. Insert into your Tesla's front USB port
+5. Put car in Park
+6. Navigate to: Toybox > Light Show > Custom
 
 ## Files
 
 - lightshow.fseq: Light sequence data
 - lightshow{audio_file.suffix}: Audio track
+- {MANIFEST_NAME}: Checksums of the files above
 
 """
         
         if metadata_file:
             try:
-                metadata = load_metadata(metadata_file)
+                metadata = show.metadata
                 readme_content += f"\n## Show Details\n\n"
                 for key, value in metadata.items():
                     readme_content += f"- **{key.title()}**: {value}\n"
@@ -99,17 +196,20 @@ Show: {show_dir.name}
                 pass
         
         readme_path = output_dir / "README.txt"
-        with open(readme_path, 'w') as f:
-            f.write(readme_content)
+        if cache.write_text(readme_path, readme_content):
+            print_success(f"Created: README.txt")
+        else:
+            print_info(f"Up to date: README.txt")
         
-        print_success(f"Created: README.txt")
+        cache.save()
         
         print_success(f"\n✓ Show packaged successfully!")
         print_info(f"Output directory: {output_dir.absolute()}")
         print_info(f"\nNext steps:")
-        print_info(f"  1. Copy '{lightshow_dir}' folder to your USB drive root")
-        print_info(f"  2. Eject USB safely")
-        print_info(f"  3. Play on your Tesla: Toybox > Light Show > Custom")
+        print_info(f"  1. Copy '{lightshow_dir}' folder and {MANIFEST_NAME} to your USB drive root")
+        print_info(f"  2. Check the copy: python tools/verify.py /path/to/usb")
+        print_info(f"  3. Eject USB safely")
+        print_info(f"  4. Play on your Tesla: Toybox > Light Show > Custom")
         
         return True
     
@@ -118,6 +218,105 @@ Show: {show_dir.name}
         return False
 
 
+@traced('package')
+def package_image(show_dir: Path, image: Path, fs: str = 'fat32',
+                  size: int = None, trim_audio: bool = False,
+                  tail_pad: float = 0.0) -> bool:
+    """
+    Package a show straight into a ready-to-flash USB disk image.
+    
+    The image holds a single FAT32 or exFAT partition with the LightShow/
+    folder and its checksum manifest, so it can be written to a stick with
+    dd or a flashing tool without mounting or formatting anything.
+    
+    Args:
+        show_dir: Path to show directory
+        image: Image file to write
+        fs: 'fat32' or 'exfat'
+        size: Image size in bytes (default: just large enough for the show)
+        trim_audio: Cut the audio to the sequence's length
+        tail_pad: With trim_audio, seconds of audio to keep past the last frame
+    
+    Returns:
+        True if successful, False otherwise
+    """
+    from disk_image import build_image, ImageError
+    
+    print_info(f"Packaging show: {show_dir.name} → {image} ({fs})")
+    
+    show = Show.load(show_dir)
+    fseq_file, audio_file = show.fseq_file, show.audio_file
+    
+    if not fseq_file:
+        print_error("Cannot package: Missing .fseq file")
+        return False
+    
+    if not audio_file:
+        print_error("Cannot package: Missing audio file")
+        return False
+    
+    if not _check_playable(show):
+        return False
+    
+    files = {
+        "LightShow/lightshow.fseq": fseq_file,
+        f"LightShow/lightshow{audio_file.suffix}": audio_file,
+    }
+    cut = _plan_trim(show, tail_pad) if trim_audio else None
+    
+    try:
+        image.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=image.parent) as scratch:
+            if cut is not None:
+                # The image builder copies whole files, so stage the cut audio
+                trimmed = Path(scratch) / f"lightshow{audio_file.suffix}"
+                write_cut(audio_file, trimmed, cut)
+                files[f"LightShow/{trimmed.name}"] = trimmed
+                print_success(f"Trimmed: {audio_file.name} (cut at {cut.duration:.1f}s)")
+            # Checksum manifest for verify.py, next to LightShow/ as in a folder package
+            manifest = Path(scratch) / MANIFEST_NAME
+            write_manifest(manifest, {path: hash_file(source) for path, source in files.items()},
+                           max(fseq_file.stat().st_mtime, audio_file.stat().st_mtime))
+            files[MANIFEST_NAME] = manifest
+            info = build_image(image, files, fs=fs, size=size)
+    except (ImageError, AudioError, OSError) as e:
+        print_error(f"Failed to build image: {e}")
+        return False
+    
+    print_success(f"Wrote {info.file_count} files ({format_size(info.used_bytes)} used) "
+                  f"to a {format_size(info.size)} {fs} image")
+    print_info(f"Image: {image.absolute()}")
+    print_info(f"\nNext steps:")
+    print_info(f"  1. Write it to a USB drive, e.g. sudo dd if={image} of=/dev/sdX bs=4M")
+    print_info(f"  2. Eject USB safely")
+    print_info(f"  3. Play on your Tesla: Toybox > Light Show > Custom")
+    
+    return True
+
+
+def watch_package(shows_dir: Path, output_root: Path = None, polling: bool = False,
+                  only: Path = None, trim_audio: bool = False, tail_pad: float = 0.0):
+    """
+    Repackage shows as their files change, until interrupted.
+    
+    Only the changed show is repackaged, and the build cache skips any of
+    its files that did not change.
+    """
+    from watch import watch_shows
+    
+    def on_change(show_dir: Path, kinds):
+        output_dir = output_root / show_dir.name if output_root else None
+        package_show(show_dir, output_dir, trim_audio=trim_audio, tail_pad=tail_pad)
+        print()
+        sys.stdout.flush()
+    
+    print_info(f"Watching {shows_dir}/ for changes (Ctrl+C to stop)")
+    try:
+        watch_shows(shows_dir, on_change, polling=polling, only=only)
+    except KeyboardInterrupt:
+        print()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Package Tesla Lightshow for USB deployment',
@@ -126,13 +325,20 @@ def main():
 Examples:
   %(prog)s shows/my-show                    Package to build/my-show/
   %(prog)s shows/my-show -o /path/to/usb    Package directly to USB drive
+  %(prog)s --watch                          Repackage shows as they change
+  %(prog)s shows/my-show --timings          Show time and throughput per phase
+  %(prog)s shows/my-show --image usb.img    Build a ready-to-flash FAT32 image
+  %(prog)s shows/my-show --image usb.img --fs exfat --image-size 1G
+  %(prog)s shows/my-show --trim-audio --tail-pad 2
+                                            Cut the audio 2s after the last frame
         """
     )
     
     parser.add_argument(
         'show_dir',
         type=Path,
-        help='Path to show directory'
+        nargs='?',
+        help='Path to show directory (with --watch: only watch this show)'
     )
     
     parser.add_argument(
@@ -141,15 +347,122 @@ Examples:
         help='Output directory (default: build/<show-name>)'
     )
     
+    parser.add_argument(
+        '-f', '--force',
+        action='store_true',
+        help='Rewrite all files even if the build is up to date'
+    )
+    
+    parser.add_argument(
+        '--link',
+        action='store_true',
+        help='Hardlink output files to their sources instead of copying'
+    )
+    
+    parser.add_argument(
+        '--trim-audio',
+        action='store_true',
+        help='Cut the audio to the length of the sequence (WAV or MP3)'
+    )
+    
+    parser.add_argument(
+        '--tail-pad',
+        type=float,
+        default=0.0,
+        metavar='SECONDS',
+        help='With --trim-audio: keep this much audio past the last frame (default: 0)'
+    )
+    
+    parser.add_argument(
+        '-w', '--watch',
+        action='store_true',
+        help='Keep running and repackage shows whenever their files change'
+    )
+    
+    parser.add_argument(
+        '-d', '--directory',
+        type=Path,
+        default=Path('shows'),
+        help='Shows directory to watch (default: shows/)'
+    )
+    
+    parser.add_argument(
+        '--poll',
+        action='store_true',
+        help='With --watch: poll for changes instead of using inotify'
+    )
+    
+    parser.add_argument(
+        '--image',
+        type=Path,
+        metavar='FILE',
+        help='Write a partitioned USB disk image instead of a directory'
+    )
+    
+    parser.add_argument(
+        '--fs',
+        choices=['fat32', 'exfat'],
+        default='fat32',
+        help='With --image: filesystem to format the image with (default: fat32)'
+    )
+    
+    parser.add_argument(
+        '--image-size',
+        type=parse_size,
+        metavar='SIZE',
+        help='With --image: image size such as 512M or 8G (default: fit the show)'
+    )
+    
+    add_output_options(parser)
+    
     args = parser.parse_args()
     
+    if args.tail_pad < 0:
+        parser.error("--tail-pad cannot be negative")
+    
+    if args.watch:
+        if args.timings or args.format != 'text':
+            parser.error("--timings and --format json cannot be used with --watch")
+        if args.image:
+            parser.error("--image cannot be used with --watch")
+        # With --watch, -o is the output root holding one folder per show
+        shows_dir = args.show_dir.parent if args.show_dir else args.directory
+        watch_package(shows_dir, args.output, polling=args.poll, only=args.show_dir,
+                      trim_audio=args.trim_audio, tail_pad=args.tail_pad)
+        sys.exit(0)
+    
+    if args.show_dir is None:
+        parser.error("the following arguments are required: show_dir")
+    
     # Check if show directory exists
     if not args.show_dir.exists():
         print_error(f"Show directory does not exist: {args.show_dir}")
         sys.exit(1)
     
+    if args.image and args.output:
+        parser.error("--image and --output cannot be used together")
+    
     # Package the show
-    success = package_show(args.show_dir, args.output)
+    with begin_output(args) as messages:
+        if args.image:
+            success = package_image(args.show_dir, args.image, fs=args.fs,
+                                    size=args.image_size, trim_audio=args.trim_audio,
+                                    tail_pad=args.tail_pad)
+        else:
+            success = package_show(args.show_dir, args.output, force=args.force,
+                                   hardlink=args.link, trim_audio=args.trim_audio,
+                                   tail_pad=args.tail_pad)
+    document = {
+        'tool': 'package',
+        'show': str(args.show_dir),
+        'ok': success,
+        'messages': messages,
+    }
+    if args.image:
+        document['image'] = str(args.image)
+    else:
+        document['output_dir'] = str(args.output or Path("build") / args.show_dir.name)
+    end_output(args, document)
     
     sys.exit(0 if success else 1)
 
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Render a show's channel timeline as a PNG thumbnail.
+
+The image is a channels × time heatmap: one band of pixels per channel, top
+to bottom, and one column per slice of the show, left to right, coloured by
+the channel's average level over that slice. The frame matrix is streamed
+through the FSEQ reader and downsampled with NumPy one chunk at a time, so
+even long 200-channel sequences render in a few tens of milliseconds.
+
+Previews are cached by the sequence's content hash under
+``build/.cache/previews/``. The hash itself is remembered per file
+signature, so a repeat preview of an unchanged show costs one stat.
+"""
+import os
+import sys
+import json
+import zlib
+import struct
+import shutil
+import argparse
+from pathlib import Path
+from typing import Dict, Optional
+
+from utils import print_success, print_error, add_output_options, begin_output, end_output
+from fseq import FseqFile, FseqError
+from show import Show
+from build_cache import CACHE_DIR, file_signature, hash_file
+from tracing import span, count, traced, PREVIEW_CACHE_HITS, PREVIEW_CACHE_MISSES
+
+
+PREVIEW_DIR = CACHE_DIR / "previews"
+HASHES_NAME = "hashes.json"
+# Bump when the rendering changes so old cached images are not reused
+RENDER_VERSION = 1
+
+DEFAULT_WIDTH = 600
+DEFAULT_ROW_HEIGHT = 3
+# Frames decoded and reduced at a time
+CHUNK_FRAMES = 4096
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _palette():
+    """Black → deep red → amber → white, indexed by channel level."""
+    import numpy as np
+
+    levels = np.arange(256, dtype=np.float64) / 255.0
+    red = np.clip(levels * 2.0, 0.0, 1.0)
+    green = np.clip(levels * 2.0 - 0.6, 0.0, 1.0) * 0.85
+    blue = np.clip(levels * 3.0 - 2.0, 0.0, 1.0)
+    return (np.stack([red, green, blue], axis=1) * 255).round().astype(np.uint8)
+
+
+def timeline(seq: FseqFile, width: int = DEFAULT_WIDTH):
+    """
+    Downsample a sequence to its average channel levels over time.
+
+    Args:
+        seq: Open sequence
+        width: Number of time slices (capped at the frame count)
+
+    Returns:
+        ``(channels, width)`` uint8 NumPy array
+    """
+    import numpy as np
+
+    frames = seq.frame_count
+    channels = seq.channel_count
+    width = max(1, min(width, frames))
+    sums = np.zeros((width, channels), dtype=np.uint64)
+    if frames:
+        for first, data in seq.iter_chunks(CHUNK_FRAMES):
+            n = len(data) // channels
+            block = np.frombuffer(data, dtype=np.uint8).reshape(n, channels)
+            # Slice index of every frame; each slice is a contiguous run of
+            # frames, so one reduceat sums a chunk's share of every slice
+            slices = np.arange(first, first + n, dtype=np.int64) * width // frames
+            starts = np.flatnonzero(np.r_[True, slices[1:] != slices[:-1]])
+            sums[slices[starts]] += np.add.reduceat(block, starts, axis=0, dtype=np.uint64)
+            del block, data
+    # Frames per slice, from the slice boundaries
+    edges = -(-np.arange(width + 1, dtype=np.int64) * frames // width)
+    sizes = np.maximum(np.diff(edges), 1).astype(np.uint64)
+    return (sums // sizes[:, None]).astype(np.uint8).T
+
+
+def heatmap(levels, row_height: int = DEFAULT_ROW_HEIGHT):
+    """Colour a ``(channels, width)`` level array into an RGB image array."""
+    import numpy as np
+
+    rows = np.repeat(levels, max(1, row_height), axis=0)
+    return _palette()[rows]
+
+
+def png_bytes(image) -> bytes:
+    """Encode a ``(height, width, 3)`` uint8 array as an RGB PNG."""
+    import numpy as np
+
+    height, width = image.shape[:2]
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    # Filter type 0 (none) in front of every scanline
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(height, width * 3)
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (PNG_SIGNATURE + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b''))
+
+
+def render_preview(show: Show, width: int = DEFAULT_WIDTH,
+                   row_height: int = DEFAULT_ROW_HEIGHT) -> bytes:
+    """
+    Render a show's timeline heatmap.
+
+    Returns:
+        PNG file contents
+
+    Raises:
+        FseqError: If the sequence cannot be read
+    """
+    with span('downsample'):
+        levels = show.timeline(width)
+    with span('encode'):
+        return png_bytes(heatmap(levels, row_height))
+
+
+class PreviewCache:
+    """
+    Content-addressed store of rendered previews.
+
+    Example:
+        cache = PreviewCache()
+        png = cache.get(Show.load(Path("shows/my-show")))
+        cache.save()
+    """
+
+    def __init__(self, cache_dir: Optional[Path] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else PREVIEW_DIR
+        self.hashes_path = self.cache_dir / HASHES_NAME
+        self.hashes = self._load()
+        self._dirty = False
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.hashes_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def save(self):
+        """Write the hash index atomically if it changed."""
+        if not self._dirty:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.hashes_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.hashes, f)
+        os.replace(tmp, self.hashes_path)
+        self._dirty = False
+
+    def content_hash(self, fseq_path: Path) -> str:
+        """Return the sequence's SHA-256, re-hashing only if it changed."""
+        key = str(Path(fseq_path).absolute())
+        signature = file_signature(fseq_path)
+        entry = self.hashes.get(key)
+        if entry and entry.get('signature') == signature:
+            return entry['sha256']
+        digest = hash_file(fseq_path)
+        self.hashes[key] = {'signature': signature, 'sha256': digest}
+        self._dirty = True
+        return digest
+
+    def get(self, show: Show, width: int = DEFAULT_WIDTH,
+            row_height: int = DEFAULT_ROW_HEIGHT) -> Path:
+        """
+        Return the cached preview of a show's sequence, rendering it if
+        needed.
+
+        Raises:
+            FseqError: If the sequence cannot be read
+        """
+        digest = self.content_hash(show.fseq_file)
+        path = self.cache_dir / f"{digest}-v{RENDER_VERSION}-{width}x{row_height}.png"
+        if path.exists():
+            count(PREVIEW_CACHE_HITS)
+            return path
+
+        count(PREVIEW_CACHE_MISSES)
+        data = render_preview(show, width, row_height)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return path
+
+
+@traced('preview')
+def preview_show(target: Path, output: Optional[Path] = None,
+                 width: int = DEFAULT_WIDTH, row_height: int = DEFAULT_ROW_HEIGHT,
+                 cache: Optional[PreviewCache] = None) -> Optional[Path]:
+    """
+    Produce the timeline preview of a show.
+
+    Args:
+        target: Show directory or .fseq file
+        output: Copy the PNG here (default: return the cached image)
+        width: Image width in pixels (one column per slice of the show)
+        row_height: Pixel rows per channel
+        cache: Preview cache to use (saved by the caller)
+
+    Returns:
+        Path of the PNG, or None if the show has no readable sequence
+    """
+    show = Show.load(target) if target.is_dir() else Show.for_sequence(target)
+    fseq_file = show.fseq_file
+    if fseq_file is None or not fseq_file.exists():
+        print_error(f"No .fseq file found at: {target}")
+        return None
+
+    own_cache = cache is None
+    if own_cache:
+        cache = PreviewCache()
+    try:
+        path = cache.get(show, width, row_height)
+    except FseqError as e:
+        print_error(f"Cannot render {fseq_file}: {e}")
+        return None
+    finally:
+        if own_cache:
+            cache.save()
+
+    if output is not None:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, output)
+        path = output
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Render a Tesla Lightshow sequence as a timeline thumbnail',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s shows/my-show                    Render (or reuse) the cached preview
+  %(prog)s shows/my-show -o my-show.png     Write the preview to a file
+  %(prog)s lightshow.fseq --width 1200 --row-height 1
+
+Each channel is a band of pixels, top to bottom in channel order; time runs
+left to right. Brighter means the channel was on for more of that slice.
+        """
+    )
+
+    parser.add_argument(
+        'target',
+        type=Path,
+        help='Show directory or .fseq file'
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        type=Path,
+        help='Write the PNG here (default: print the cached image path)'
+    )
+
+    parser.add_argument(
+        '--width',
+        type=int,
+        default=DEFAULT_WIDTH,
+        help=f'Image width in pixels (default: {DEFAULT_WIDTH})'
+    )
+
+    parser.add_argument(
+        '--row-height',
+        type=int,
+        default=DEFAULT_ROW_HEIGHT,
+        help=f'Pixel rows per channel (default: {DEFAULT_ROW_HEIGHT})'
+    )
+
+    add_output_options(parser)
+
+    args = parser.parse_args()
+
+    if args.width < 1 or args.row_height < 1:
+        parser.error("--width and --row-height must be at least 1")
+
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print_error("preview.py requires NumPy: pip install numpy")
+        sys.exit(1)
+
+    with begin_output(args) as messages:
+        path = preview_show(args.target, args.output, args.width, args.row_height)
+        if path is not None:
+            print_success(f"Preview: {path}")
+    end_output(args, {
+        'tool': 'preview',
+        'target': str(args.target),
+        'ok': path is not None,
+        'preview': str(path) if path is not None else None,
+        'messages': messages,
+    })
+
+    sys.exit(0 if path is not None else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,640 @@
+#!/usr/bin/env python3
+"""
+HTTP service that validates and packages uploaded shows.
+
+Designers POST (or PUT) a show as a tar stream (plain or gzip-compressed) and get
+back the same report ``validate.py`` or ``package.py`` would print, as
+JSON. The service is plain standard library: a threading HTTP server in
+front of the process pool ``batch.py`` uses, so every request runs the
+same code whatever Python setup the client has.
+
+- Uploads are extracted straight from the socket to disk, one buffer at a
+  time, and hashed on the way; nothing is held in memory.
+- Results are stored by the hash of the show's content, the options and
+  the tools' source, so re-submitting an identical show answers without
+  running anything, identical submissions already running share one job,
+  and a change to the tools never serves a verdict of the old code.
+  Results are kept in ``<state dir>/results/``; delete that directory to
+  clear them.
+- ``GET /metrics`` reports the queue depth and percentiles of upload,
+  queue wait, run and total latency.
+
+Endpoints:
+
+    POST /validate[?name=&verbose=1]    Validate a show
+    POST /package[?name=]               Package a show
+    GET  /results/<key>                 A stored result
+    GET  /packages/<key>.tar            The packaged LightShow files
+    GET  /metrics                       Queue depth, cache and latency
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tarfile
+import argparse
+import tempfile
+import threading
+from collections import deque
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path, PurePosixPath
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+from utils import print_success, print_error, print_info, format_size
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+STATE_DIR = Path("build") / "serve"
+
+# Request path: task run by batch.run_task
+TASKS = {'/validate': 'validate', '/package': 'build'}
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = 1024 * 1024 * 1024
+# Latency samples kept per measurement for the percentiles
+LATENCY_SAMPLES = 1000
+
+
+class UploadError(ValueError):
+    """An upload the service cannot accept; carries the HTTP status."""
+
+    def __init__(self, message: str, status: HTTPStatus = HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+class _Body:
+    """File-like reader over a request body of known length."""
+
+    def __init__(self, stream, length: int):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size) if size else b''
+        if len(data) < size:
+            raise UploadError("Upload ended early")
+        self.remaining -= len(data)
+        return data
+
+
+class _ChunkedBody:
+    """File-like reader over a ``Transfer-Encoding: chunked`` request body."""
+
+    def __init__(self, stream, limit: int):
+        self.stream = stream
+        self.limit = limit
+        self.chunk_left = 0
+        self.done = False
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        while not self.done and size != 0:
+            if self.chunk_left == 0:
+                line = self.stream.readline(1024)
+                try:
+                    self.chunk_left = int(line.split(b';', 1)[0], 16)
+                except ValueError:
+                    raise UploadError("Malformed chunked upload")
+                if self.chunk_left == 0:
+                    # Skip any trailers up to the blank line
+                    while self.stream.readline(1024).strip():
+                        pass
+                    self.done = True
+                    break
+                self.limit -= self.chunk_left
+                if self.limit < 0:
+                    raise UploadError("Upload is too large", HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            want = self.chunk_left if size < 0 else min(size, self.chunk_left)
+            data = self.stream.read(want)
+            if len(data) < want:
+                raise UploadError("Upload ended early")
+            self.chunk_left -= want
+            if self.chunk_left == 0:
+                self.stream.readline(16)
+            parts.append(data)
+            if size > 0:
+                size -= want
+        return b''.join(parts)
+
+
+def _member_path(member: tarfile.TarInfo) -> PurePosixPath:
+    path = PurePosixPath(member.name)
+    parts = [p for p in path.parts if p not in ('', '.')]
+    if path.is_absolute() or '..' in parts:
+        raise UploadError(f"Unsafe path in upload: {member.name}")
+    return PurePosixPath(*parts)
+
+
+def receive_show(body, dest: Path, name: Optional[str] = None,
+                 max_bytes: Optional[int] = None) -> Tuple[Path, str]:
+    """
+    Extract an uploaded show tar stream into dest.
+
+    Members are read straight from the stream and written in chunks, and
+    each file is hashed as it is written. The upload may hold the show's
+    files at its top level or inside a single directory.
+
+    Args:
+        body: File-like object yielding the tar stream
+        dest: Empty directory to extract into
+        name: Show name (default: the tar's top directory, or 'show')
+        max_bytes: Largest total size of the extracted files. A compressed
+            upload can expand far beyond its own length, so this is counted
+            on what is written, not on what is received.
+
+    Returns:
+        Tuple of (show directory, SHA-256 of the show's names and content)
+
+    Raises:
+        UploadError: If the upload is not a tar of plain files, or expands
+            past max_bytes
+    """
+    staging = dest / ".upload"
+    staging.mkdir()
+    files = []
+    extracted = 0
+    try:
+        with tarfile.open(fileobj=body, mode='r|*') as tar:
+            for member in tar:
+                path = _member_path(member)
+                if member.isdir() or not path.parts:
+                    continue
+                if not member.isfile():
+                    raise UploadError(f"Only regular files can be uploaded: {member.name}")
+                target = staging.joinpath(*path.parts)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                digest = hashlib.sha256()
+                source = tar.extractfile(member)
+                with open(target, 'wb') as f:
+                    while True:
+                        chunk = source.read(UPLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        extracted += len(chunk)
+                        if max_bytes is not None and extracted > max_bytes:
+                            raise UploadError("Upload expands past the size limit",
+                                              HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                        digest.update(chunk)
+                        f.write(chunk)
+                files.append((path, digest.hexdigest()))
+        # Drain anything after the end of the archive, such as its padding
+        while body.read(UPLOAD_CHUNK_SIZE):
+            pass
+    except tarfile.TarError as e:
+        raise UploadError(f"Not a tar archive: {e}")
+    if not files:
+        raise UploadError("Upload holds no files")
+
+    # Strip a single top-level directory
+    tops = {path.parts[0] for path, _ in files}
+    show_dir = staging
+    if len(tops) == 1 and all(len(path.parts) > 1 for path, _ in files):
+        top = tops.pop()
+        show_dir = staging / top
+        files = [(PurePosixPath(*path.parts[1:]), digest) for path, digest in files]
+        name = name or top
+    name = name or "show"
+    if name.startswith('.') or '/' in name or '\\' in name:
+        raise UploadError(f"Invalid show name: {name}")
+    show_dir = show_dir.rename(dest / name)
+
+    content = hashlib.sha256(name.encode('utf-8'))
+    for path, digest in sorted(files):
+        content.update(f"\0{path}\0{digest}".encode('utf-8'))
+    return show_dir, content.hexdigest()
+
+
+def tools_version() -> str:
+    """SHA-256 of the tools' Python source, which every stored result depends on."""
+    digest = hashlib.sha256()
+    for path in sorted(Path(__file__).resolve().parent.glob('*.py')):
+        digest.update(f"{path.name}\0".encode('utf-8'))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _percentiles(samples) -> Dict:
+    values = sorted(samples)
+    if not values:
+        return {'count': 0}
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))], 6)
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), 6),
+        'p50': pick(0.50),
+        'p95': pick(0.95),
+        'max': round(values[-1], 6),
+    }
+
+
+class ShowService:
+    """
+    Runs uploaded shows through a process pool, keyed by content.
+
+    Example:
+        service = ShowService(Path("build/serve"), jobs=4)
+        status, result = service.submit('validate', body)
+        service.close()
+    """
+
+    def __init__(self, state_dir: Path = STATE_DIR, jobs: Optional[int] = None):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.state_dir = Path(state_dir).absolute()
+        self.uploads_dir = self.state_dir / "uploads"
+        self.results_dir = self.state_dir / "results"
+        self.uploads_dir.mkdir(parents=True, exist_ok=True)
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        self.workers = jobs or os.cpu_count() or 1
+        self.version = tools_version()
+        # Workers run from the state directory so the build cache lands there
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=os.chdir,
+                                        initargs=(str(self.state_dir),))
+        self.lock = threading.Lock()
+        self.results: Dict[str, Dict] = {}
+        self.inflight: Dict[str, object] = {}
+        self.started = time.time()
+        self.counts = {'requests': 0, 'cache_hits': 0, 'cache_misses': 0,
+                       'shared': 0, 'failed': 0}
+        self.latency = {kind: deque(maxlen=LATENCY_SAMPLES)
+                        for kind in ('upload', 'wait', 'run', 'total')}
+
+    def close(self):
+        """Wait for running jobs and stop the workers."""
+        self.pool.shutdown(wait=True)
+
+    def _result_path(self, key: str) -> Path:
+        return self.results_dir / key / "result.json"
+
+    def result(self, key: str) -> Optional[Dict]:
+        """Return the stored result for a key, if any."""
+        with self.lock:
+            result = self.results.get(key)
+        if result is not None:
+            return result
+        try:
+            with open(self._result_path(key), 'r') as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self.lock:
+            self.results[key] = result
+        return result
+
+    def package_dir(self, key: str) -> Optional[Path]:
+        """Return the packaged output of a stored package result, if any."""
+        result = self.result(key)
+        if not result or result.get('task') != 'build' or not result.get('ok'):
+            return None
+        path = self.results_dir / key / result['show']
+        return path if path.is_dir() else None
+
+    def _store(self, key: str, result: Dict):
+        """Save a finished job's result and retire its in-flight entry."""
+        try:
+            path = self._result_path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix('.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(result, f)
+            os.replace(tmp, path)
+        finally:
+            # One step, so a request for the same key finds either the
+            # running job or its result, and never starts the job again
+            with self.lock:
+                self.results[key] = result
+                del self.inflight[key]
+
+    def submit(self, task: str, body, name: Optional[str] = None,
+               verbose: bool = False, max_bytes: Optional[int] = None) -> Dict:
+        """
+        Receive one show and return the task's result.
+
+        Args:
+            task: 'validate' or 'build'
+            body: File-like object yielding the show as a tar stream
+            name: Show name (default: the tar's top directory)
+            verbose: Detailed validation output
+            max_bytes: Largest total size of the extracted show
+
+        Returns:
+            Result dict with the key it is stored under and whether it
+            came from the cache
+
+        Raises:
+            UploadError: If the upload is rejected
+        """
+        from batch import run_task
+
+        start = time.perf_counter()
+        with self.lock:
+            self.counts['requests'] += 1
+        upload = Path(tempfile.mkdtemp(dir=self.uploads_dir))
+        try:
+            show_dir, content = receive_show(body, upload, name, max_bytes)
+            received = time.perf_counter()
+            options = json.dumps({'task': task, 'verbose': verbose and task == 'validate',
+                                  'tools': self.version})
+            key = hashlib.sha256(f"{options}\0{content}".encode('utf-8')).hexdigest()
+
+            result = self.result(key)
+            if result is not None:
+                with self.lock:
+                    self.counts['cache_hits'] += 1
+                return self._answer(result, True, start, received)
+
+            with self.lock:
+                # Checked again under the lock: the job may have just finished
+                result = self.results.get(key)
+                future = self.inflight.get(key)
+                owner = result is None and future is None
+                if result is not None:
+                    self.counts['cache_hits'] += 1
+                elif owner:
+                    self.counts['cache_misses'] += 1
+                    future = self.pool.submit(run_task, task, show_dir, verbose,
+                                              self.results_dir / key, False, True)
+                    self.inflight[key] = future
+                else:
+                    self.counts['shared'] += 1
+            if result is not None:
+                return self._answer(result, True, start, received)
+
+            try:
+                outcome = future.result()
+            except Exception:
+                with self.lock:
+                    self.counts['failed'] += 1
+                    if owner:
+                        del self.inflight[key]
+                raise
+            result = {
+                'key': key,
+                'task': task,
+                'show': outcome.show,
+                'ok': outcome.ok,
+                'elapsed': round(outcome.elapsed, 6),
+                'messages': outcome.messages,
+                'output': outcome.output,
+            }
+            if owner:
+                self._store(key, result)
+                finished = time.perf_counter()
+                with self.lock:
+                    self.latency['run'].append(outcome.elapsed)
+                    self.latency['wait'].append(max(0.0, finished - received - outcome.elapsed))
+            return self._answer(result, not owner, start, received)
+        finally:
+            shutil.rmtree(upload, ignore_errors=True)
+
+    def _answer(self, result: Dict, cached: bool, start: float, received: float) -> Dict:
+        now = time.perf_counter()
+        with self.lock:
+            self.latency['upload'].append(received - start)
+            self.latency['total'].append(now - start)
+        return dict(result, cached=cached)
+
+    def metrics(self) -> Dict:
+        """Queue depth, request counts and latency percentiles (seconds)."""
+        with self.lock:
+            in_flight = len(self.inflight)
+            return {
+                'uptime': round(time.time() - self.started, 3),
+                'tools': self.version[:12],
+                'workers': self.workers,
+                'queue': {
+                    'running': min(in_flight, self.workers),
+                    'waiting': max(0, in_flight - self.workers),
+                },
+                'requests': dict(self.counts),
+                'latency': {kind: _percentiles(samples)
+                            for kind, samples in self.latency.items()},
+            }
+
+
+def _is_key(text: str) -> bool:
+    return len(text) == 64 and all(c in '0123456789abcdef' for c in text)
+
+
+class ShowRequestHandler(BaseHTTPRequestHandler):
+    """Routes requests to the server's ShowService."""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'LightshowServe/1.0'
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            print_info(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status: HTTPStatus, document: Dict):
+        data = json.dumps(document, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: HTTPStatus, message: str):
+        self._send_json(status, {'error': message})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        service = self.server.service
+        if parts == ['metrics']:
+            self._send_json(HTTPStatus.OK, service.metrics())
+        elif len(parts) == 2 and parts[0] == 'results':
+            result = service.result(parts[1]) if _is_key(parts[1]) else None
+            if result is None:
+                self._send_error(HTTPStatus.NOT_FOUND, "No such result")
+            else:
+                self._send_json(HTTPStatus.OK, dict(result, cached=True))
+        elif len(parts) == 2 and parts[0] == 'packages' and parts[1].endswith('.tar'):
+            key = parts[1][:-len('.tar')]
+            package = service.package_dir(key) if _is_key(key) else None
+            if package is None:
+                self._send_error(HTTPStatus.NOT_FOUND, "No such package")
+            else:
+                self._send_tar(package)
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, "Unknown endpoint")
+
+    def _send_tar(self, package: Path):
+        # Streamed as it is written, so the length is not known up front
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/x-tar')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        with tarfile.open(fileobj=self.wfile, mode='w|', bufsize=UPLOAD_CHUNK_SIZE) as tar:
+            for path in sorted(package.rglob('*')):
+                if path.is_file():
+                    tar.add(path, arcname=str(path.relative_to(package)))
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        task = TASKS.get(url.path.rstrip('/'))
+        if task is None:
+            self.close_connection = True
+            self._send_error(HTTPStatus.NOT_FOUND, "Unknown endpoint")
+            return
+        query = parse_qs(url.query)
+        name = query.get('name', [None])[0]
+        verbose = query.get('verbose', ['0'])[0] not in ('0', 'false', '')
+
+        try:
+            body = self._body()
+            result = self.server.service.submit(task, body, name, verbose,
+                                                self.server.max_upload)
+        except UploadError as e:
+            self.close_connection = True
+            self._send_error(e.status, str(e))
+            return
+        except Exception as e:
+            self.close_connection = True
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, f"{task} failed: {e}")
+            return
+        self._send_json(HTTPStatus.OK, result)
+
+    # curl -T uploads with PUT
+    do_PUT = do_POST
+
+    def _body(self):
+        limit = self.server.max_upload
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            return _ChunkedBody(self.rfile, limit)
+        length = self.headers.get('Content-Length')
+        if length is None:
+            raise UploadError("Content-Length required", HTTPStatus.LENGTH_REQUIRED)
+        try:
+            length = int(length)
+        except ValueError:
+            raise UploadError("Bad Content-Length")
+        if length > limit:
+            raise UploadError("Upload is too large", HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        return _Body(self.rfile, length)
+
+
+class ShowServer(ThreadingHTTPServer):
+    """Threading HTTP server owning a ShowService."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: ShowService,
+                 max_upload: int = MAX_UPLOAD_BYTES, quiet: bool = False):
+        super().__init__(address, ShowRequestHandler)
+        self.service = service
+        self.max_upload = max_upload
+        self.quiet = quiet
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, state_dir: Path = STATE_DIR,
+          jobs: Optional[int] = None, max_upload: int = MAX_UPLOAD_BYTES, quiet: bool = False):
+    """
+    Run the service until interrupted.
+
+    Args:
+        host: Address to listen on
+        port: Port to listen on (0 picks a free one)
+        state_dir: Where uploads, results and packages are kept
+        jobs: Worker processes (default: CPU count)
+        max_upload: Largest upload accepted, in bytes, both as sent and
+            once extracted
+        quiet: Do not log requests
+    """
+    service = ShowService(state_dir, jobs)
+    server = ShowServer((host, port), service, max_upload, quiet)
+    host, port = server.server_address[:2]
+    print_success(f"Serving on http://{host}:{port}/ with {service.workers} worker(s)")
+    print_info(f"Results are kept in {service.state_dir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        server.server_close()
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Validate and package uploaded shows over HTTP',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s                          Serve on http://127.0.0.1:8765/
+  %(prog)s --host 0.0.0.0 -j 8      Serve the local network with 8 workers
+
+  tar -C shows -c my-show | curl -T - http://127.0.0.1:8765/validate
+  tar -C shows -c my-show | curl -T - http://127.0.0.1:8765/package
+  curl -o my-show.tar http://127.0.0.1:8765/packages/<key>.tar
+  curl http://127.0.0.1:8765/metrics
+
+Uploads are tar streams (gzip is fine) of one show directory. Results are
+kept by content, so submitting an unchanged show again answers at once.
+Updating the tools starts a fresh set of results; delete DIRECTORY/results
+to clear old ones.
+        """
+    )
+
+    parser.add_argument(
+        '--host',
+        default=DEFAULT_HOST,
+        help=f'Address to listen on (default: {DEFAULT_HOST})'
+    )
+
+    parser.add_argument(
+        '-p', '--port',
+        type=int,
+        default=DEFAULT_PORT,
+        help=f'Port to listen on (default: {DEFAULT_PORT})'
+    )
+
+    parser.add_argument(
+        '-d', '--directory',
+        type=Path,
+        default=STATE_DIR,
+        help=f'Where uploads, results and packages are kept (default: {STATE_DIR}/)'
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        help='Number of worker processes (default: CPU count)'
+    )
+
+    parser.add_argument(
+        '--max-upload',
+        type=float,
+        default=MAX_UPLOAD_BYTES / (1024 * 1024),
+        metavar='MB',
+        help=f'Largest upload accepted, as sent and once extracted '
+             f'(default: {format_size(MAX_UPLOAD_BYTES)})'
+    )
+
+    parser.add_argument(
+        '-q', '--quiet',
+        action='store_true',
+        help='Do not log requests'
+    )
+
+    args = parser.parse_args()
+
+    try:
+        serve(args.host, args.port, args.directory, args.jobs,
+              int(args.max_upload * 1024 * 1024), args.quiet)
+    except OSError as e:
+        print_error(f"Cannot serve on {args.host}:{args.port}: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+Shared model of one show directory.
+
+A ``Show`` finds its files with a single directory scan and loads every
+other fact (metadata, the sequence header, the audio probe, the channel
+timeline) the first time it is asked for, keeping the result. validate,
+package, list_shows and preview all work from the same object, so a show is
+probed at most once per process however many checks look at it.
+
+Shows are slotted and store file names rather than paths, and the channel
+timeline is held as a NumPy buffer, so catalogs of tens of thousands of
+shows stay small in memory.
+"""
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from utils import scan_show_entries, load_metadata
+from fseq import FseqFile, DEFAULT_CACHE_BYTES
+from audio import probe_audio, AudioError
+from tracing import span
+
+
+_MISSING = object()
+
+
+class Show:
+    """
+    One show directory.
+
+    Example:
+        show = Show.load(Path("shows/my-show"))
+        if show.fseq_file:
+            print(show.title, show.header.duration)
+    """
+
+    __slots__ = (
+        'path', 'fseq_name', 'audio_name', 'has_metadata',
+        '_fseq_stat', '_audio_stat', '_metadata', '_header', '_audio_info',
+        '_audio_duration', '_timeline',   # (width, levels) of the last timeline
+    )
+
+    def __init__(self, path: Path, fseq_name: Optional[str] = None,
+                 audio_name: Optional[str] = None, has_metadata: bool = False):
+        self.path = Path(path)
+        self.fseq_name = fseq_name
+        self.audio_name = audio_name
+        self.has_metadata = has_metadata
+        self._fseq_stat = None    # (size, mtime_ns)
+        self._audio_stat = None
+        self._metadata = _MISSING
+        self._header = None
+        self._audio_info = None
+        self._audio_duration = _MISSING
+        self._timeline = None
+
+    @classmethod
+    def load(cls, path: Path) -> 'Show':
+        """Scan a show directory for its files."""
+        with span('discover'):
+            found = scan_show_entries(path)
+        return cls(
+            path,
+            found['fseq'].name if 'fseq' in found else None,
+            found['audio'].name if 'audio' in found else None,
+            'metadata' in found,
+        )
+
+    @classmethod
+    def for_sequence(cls, fseq_file: Path) -> 'Show':
+        """A show made of one sequence file, for tools that accept either."""
+        fseq_file = Path(fseq_file)
+        return cls(fseq_file.parent, fseq_name=fseq_file.name)
+
+    @classmethod
+    def from_index(cls, shows_dir: Path, entry: Dict) -> 'Show':
+        """
+        Build a show from its ShowIndex entry without touching the disk.
+
+        The file sizes, metadata and audio duration recorded in the index
+        are taken over as already loaded.
+        """
+        fseq = entry.get('fseq')
+        audio = entry.get('audio')
+        show = cls(
+            Path(shows_dir) / entry['dir'],
+            fseq['name'] if fseq else None,
+            audio['name'] if audio else None,
+            entry.get('metadata_mtime_ns') is not None,
+        )
+        show._fseq_stat = (fseq['size'], fseq['mtime_ns']) if fseq else None
+        show._audio_stat = (audio['size'], audio['mtime_ns']) if audio else None
+        if show.has_metadata:
+            show._metadata = entry.get('metadata') or {}
+        show._audio_duration = entry.get('audio_duration')
+        return show
+
+    def __repr__(self) -> str:
+        return f"Show({str(self.path)!r})"
+
+    @property
+    def name(self) -> str:
+        """Directory name of the show."""
+        return self.path.name
+
+    # Files
+
+    @property
+    def fseq_file(self) -> Optional[Path]:
+        return self.path / self.fseq_name if self.fseq_name else None
+
+    @property
+    def audio_file(self) -> Optional[Path]:
+        return self.path / self.audio_name if self.audio_name else None
+
+    @property
+    def metadata_file(self) -> Optional[Path]:
+        return self.path / "metadata.json" if self.has_metadata else None
+
+    @property
+    def files(self) -> Dict[str, Optional[Path]]:
+        """The show's files by kind: 'fseq', 'audio' and 'metadata'."""
+        return {'fseq': self.fseq_file, 'audio': self.audio_file,
+                'metadata': self.metadata_file}
+
+    def file_info(self, kind: str) -> Optional[Dict]:
+        """
+        Name, size and mtime of the show's 'fseq' or 'audio' file, or None
+        if it has none. The file is stat'ed once.
+        """
+        name = self.fseq_name if kind == 'fseq' else self.audio_name
+        if not name:
+            return None
+        stat = self._fseq_stat if kind == 'fseq' else self._audio_stat
+        if stat is None:
+            st = os.stat(self.path / name)
+            stat = (st.st_size, st.st_mtime_ns)
+            if kind == 'fseq':
+                self._fseq_stat = stat
+            else:
+                self._audio_stat = stat
+        return {'name': name, 'size': stat[0], 'mtime_ns': stat[1]}
+
+    @property
+    def fseq_size(self) -> Optional[int]:
+        info = self.file_info('fseq')
+        return info['size'] if info else None
+
+    @property
+    def audio_size(self) -> Optional[int]:
+        info = self.file_info('audio')
+        return info['size'] if info else None
+
+    # Metadata
+
+    @property
+    def metadata(self) -> Dict:
+        """
+        Parsed metadata.json ({} if the show has none).
+
+        Raises:
+            ValueError: If metadata.json cannot be read or parsed
+        """
+        if self._metadata is _MISSING:
+            self._metadata = load_metadata(self.metadata_file) if self.has_metadata else {}
+        return self._metadata
+
+    def set_metadata(self, metadata: Dict):
+        """Record metadata that was just written to metadata.json."""
+        self._metadata = metadata
+        self.has_metadata = True
+
+    def _field(self, field: str) -> Optional[object]:
+        try:
+            metadata = self.metadata
+        except ValueError:
+            return None
+        return metadata.get(field) if isinstance(metadata, dict) else None
+
+    @property
+    def title(self) -> str:
+        """Show name from the metadata, falling back to the directory name."""
+        value = self._field('name')
+        return self.name if value is None else str(value)
+
+    @property
+    def artist(self) -> str:
+        value = self._field('artist')
+        return '' if value is None else str(value)
+
+    @property
+    def duration(self) -> float:
+        """
+        Duration in seconds: the metadata value if set, otherwise the
+        probed audio duration (0 if unknown).
+        """
+        try:
+            duration = float(self._field('duration') or 0)
+        except (TypeError, ValueError):
+            duration = 0.0
+        return duration or self.audio_duration or 0.0
+
+    # Sequence
+
+    def open_sequence(self, cache_bytes: int = DEFAULT_CACHE_BYTES):
+        """
+        Open the sequence, keeping its parsed header for later use.
+
+        Returns:
+            An FseqFile, to be used as a context manager
+
+        Raises:
+            FseqError: If the sequence is malformed
+            OSError: If it cannot be opened
+        """
+        seq = FseqFile(self.fseq_file, cache_bytes=cache_bytes)
+        self._header = seq.header
+        return seq
+
+    @property
+    def header(self):
+        """
+        Parsed FSEQ header, or None if the show has no sequence.
+
+        Raises:
+            FseqError: If the sequence is malformed
+            OSError: If it cannot be opened
+        """
+        if self._header is None and self.fseq_name:
+            with self.open_sequence():
+                pass
+        return self._header
+
+    def timeline(self, width: int):
+        """
+        Average channel levels over ``width`` slices of the show, as a
+        ``(channels, width)`` uint8 NumPy array. Requires NumPy.
+
+        Raises:
+            FseqError: If the sequence is malformed
+        """
+        if self._timeline is not None and self._timeline[0] == width:
+            return self._timeline[1]
+        from preview import timeline
+
+        with self.open_sequence(cache_bytes=0) as seq:
+            levels = timeline(seq, width)
+        self._timeline = (width, levels)
+        return levels
+
+    # Audio
+
+    @property
+    def audio_info(self):
+        """
+        Header-only probe of the audio file, or None if there is none.
+
+        Raises:
+            AudioError: If the audio file cannot be parsed
+        """
+        if self._audio_info is None and self.audio_name:
+            self._audio_info = probe_audio(self.audio_file)
+            self._audio_duration = self._audio_info.duration
+        return self._audio_info
+
+    @property
+    def audio_duration(self) -> Optional[float]:
+        """Audio duration in seconds, or None if unknown or unreadable."""
+        if self._audio_duration is _MISSING:
+            try:
+                info = self.audio_info
+            except (AudioError, OSError):
+                info = None
+            self._audio_duration = info.duration if info is not None else None
+        return self._audio_duration
@@ -0,0 +1,213 @@
+"""
+Persistent index of the shows directory.
+
+Listing shows on network storage is dominated by metadata round trips, so
+the results of scanning each show directory are kept in
+``<shows_dir>/.show-index.json``. An entry is reused as long as the show
+directory's mtime (which changes when files are added, removed or renamed),
+its metadata.json mtime and the size and mtime of its sequence and audio
+files (which change when a file is overwritten in place) are unchanged;
+only changed directories are scanned again. Filtering and sorting work on
+the index alone.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils import scan_show_entries
+from tracing import span, count, INDEX_HITS, INDEX_MISSES
+from audio import audio_duration
+
+
+INDEX_NAME = ".show-index.json"
+INDEX_VERSION = 3
+
+SORT_KEYS = ('name', 'artist', 'duration')
+
+
+def _file_info(entry: os.DirEntry) -> Dict:
+    st = entry.stat()
+    return {'name': entry.name, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _metadata_mtime(show_path: str) -> Optional[int]:
+    try:
+        return os.stat(os.path.join(show_path, "metadata.json")).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _files_unchanged(show_path: str, cached: Dict) -> bool:
+    """Whether the indexed sequence and audio files still have their size and mtime."""
+    for kind in ('fseq', 'audio'):
+        info = cached.get(kind)
+        if info is None:
+            continue
+        try:
+            st = os.stat(os.path.join(show_path, info['name']))
+        except OSError:
+            return False
+        if st.st_size != info['size'] or st.st_mtime_ns != info['mtime_ns']:
+            return False
+    return True
+
+
+def scan_show(show_path: str, dir_mtime_ns: int) -> Dict:
+    """
+    Build the index entry for one directory.
+
+    Directories without a sequence or audio file are indexed too, so they
+    are not rescanned on every run, but are left out of the show list.
+    """
+    found = scan_show_entries(show_path)
+    entry = {
+        'dir': os.path.basename(show_path),
+        'dir_mtime_ns': dir_mtime_ns,
+        'metadata_mtime_ns': None,
+        'fseq': _file_info(found['fseq']) if 'fseq' in found else None,
+        'audio': _file_info(found['audio']) if 'audio' in found else None,
+        'metadata': None,
+        # Header-only probe, so this stays cheap even for large files
+        'audio_duration': audio_duration(found['audio'].path) if 'audio' in found else None,
+    }
+
+    if 'metadata' in found:
+        entry['metadata_mtime_ns'] = found['metadata'].stat().st_mtime_ns
+        try:
+            with open(found['metadata'].path, 'r') as f:
+                metadata = json.load(f)
+            if isinstance(metadata, dict):
+                entry['metadata'] = metadata
+        except (OSError, ValueError):
+            pass
+
+    return entry
+
+
+class ShowIndex:
+    """
+    Cached view of every show under a shows directory.
+
+    Example:
+        index = ShowIndex(Path("shows"))
+        index.refresh()
+        for show in index.query(search="jingle", sort="duration"):
+            print(show['dir'])
+    """
+
+    def __init__(self, shows_dir: Path):
+        self.shows_dir = Path(shows_dir)
+        self.path = self.shows_dir / INDEX_NAME
+        self.entries = self._load()
+        self.rescanned = 0
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != INDEX_VERSION:
+            return {}
+        return data.get('shows', {})
+
+    def save(self):
+        """Write the index atomically; silently skipped on read-only trees."""
+        tmp = self.path.with_name(INDEX_NAME + ".tmp")
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'shows': self.entries}, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def refresh(self, force: bool = False) -> List[Dict]:
+        """
+        Bring the index up to date, rescanning only changed directories.
+
+        Args:
+            force: Rescan every show directory
+
+        Returns:
+            Index entries for all shows, sorted by directory name
+        """
+        entries = {}
+        self.rescanned = 0
+
+        if self.shows_dir.exists():
+            with span('discover'), os.scandir(self.shows_dir) as it:
+                for item in it:
+                    if item.name.startswith('.') or not item.is_dir():
+                        continue
+                    dir_mtime = item.stat().st_mtime_ns
+                    cached = self.entries.get(item.name)
+                    if (not force and cached is not None
+                            and cached.get('dir_mtime_ns') == dir_mtime
+                            and cached.get('metadata_mtime_ns') == _metadata_mtime(item.path)
+                            and _files_unchanged(item.path, cached)):
+                        entries[item.name] = cached
+                        count(INDEX_HITS)
+                        continue
+                    self.rescanned += 1
+                    count(INDEX_MISSES)
+                    entries[item.name] = scan_show(item.path, dir_mtime)
+
+        changed = entries != self.entries
+        self.entries = entries
+        if changed:
+            self.save()
+        return self.shows()
+
+    def shows(self) -> List[Dict]:
+        """Return all indexed shows sorted by directory name."""
+        return [
+            self.entries[name] for name in sorted(self.entries)
+            if self.entries[name]['fseq'] or self.entries[name]['audio']
+        ]
+
+    def query(self, search: Optional[str] = None, sort: str = 'name',
+              reverse: bool = False) -> List[Dict]:
+        """
+        Filter and sort indexed shows without touching the filesystem.
+
+        Args:
+            search: Case-insensitive text matched against name and artist
+            sort: One of SORT_KEYS
+            reverse: Sort descending
+        """
+        shows = self.shows()
+        if search:
+            needle = search.lower()
+            shows = [
+                show for show in shows
+                if needle in show_field(show, 'name').lower()
+                or needle in show_field(show, 'artist').lower()
+            ]
+        if sort == 'duration':
+            key = lambda show: show_duration(show)
+        else:
+            key = lambda show: show_field(show, sort).lower()
+        return sorted(shows, key=key, reverse=reverse)
+
+
+def show_field(show: Dict, field: str) -> str:
+    """Return a text metadata field, falling back to the directory name."""
+    metadata = show.get('metadata') or {}
+    value = metadata.get(field)
+    if value is None:
+        return show['dir'] if field == 'name' else ''
+    return str(value)
+
+
+def show_duration(show: Dict) -> float:
+    """
+    Return the show duration in seconds: the metadata value if set,
+    otherwise the probed audio duration (0 if unknown).
+    """
+    metadata = show.get('metadata') or {}
+    try:
+        duration = float(metadata.get('duration') or 0)
+    except (TypeError, ValueError):
+        duration = 0.0
+    return duration or show.get('audio_duration') or 0.0
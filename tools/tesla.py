@@ -0,0 +1,215 @@
+"""
+Tesla light show hardware model.
+
+Channel layout, format limits and vectorized checks of a decoded frame
+matrix against what the car can actually play. The checks work on a
+``(frames, channels)`` uint8 NumPy array and run in a handful of array
+passes, so a full 5 minute show is analysed in milliseconds.
+"""
+from typing import Dict, List, NamedTuple
+
+
+# Limits enforced by Tesla's own sequence validator
+CHANNEL_COUNTS = (48, 200)
+MIN_STEP_MS = 15
+MAX_DURATION_S = 5 * 60
+
+# The car stores a show as a list of state-change commands and has room
+# for this many of them
+COMMAND_MEMORY_LIMIT = 681
+
+# Channel layout of the Tesla xLights model
+LIGHT_CHANNELS = range(0, 30)
+RAMP_CHANNELS = range(0, 14)
+CLOSURE_CHANNELS = range(30, 46)
+
+CHANNEL_NAMES = [
+    "Left Outer Main Beam", "Right Outer Main Beam",
+    "Left Inner Main Beam", "Right Inner Main Beam",
+    "Left Signature", "Right Signature",
+    "Left Channel 4", "Right Channel 4",
+    "Left Channel 5", "Right Channel 5",
+    "Left Channel 6", "Right Channel 6",
+    "Left Front Turn", "Right Front Turn",
+    "Left Front Fog", "Right Front Fog",
+    "Left Aux Park", "Right Aux Park",
+    "Left Side Marker", "Right Side Marker",
+    "Left Side Repeater", "Right Side Repeater",
+    "Left Rear Turn", "Right Rear Turn",
+    "Brake Lights", "Left Tail", "Right Tail",
+    "Reverse Lights", "Rear Fog Lights", "License Plate",
+    "Left Falcon Door", "Right Falcon Door",
+    "Left Front Door", "Right Front Door",
+    "Left Mirror", "Right Mirror",
+    "Left Front Window", "Left Rear Window",
+    "Right Front Window", "Right Rear Window",
+    "Liftgate",
+    "Left Front Door Handle", "Left Rear Door Handle",
+    "Right Front Door Handle", "Right Rear Door Handle",
+    "Charge Port",
+]
+
+# Closure moves beyond these per-show counts are dropped by the car, so a
+# door or window would end the show out of sync with the music
+CLOSURE_MOVE_BUDGETS = {
+    "Left Falcon Door": 20, "Right Falcon Door": 20,
+    "Left Front Door": 20, "Right Front Door": 20,
+    "Left Mirror": 20, "Right Mirror": 20,
+    "Left Front Window": 30, "Left Rear Window": 30,
+    "Right Front Window": 30, "Right Rear Window": 30,
+    "Liftgate": 6,
+    "Charge Port": 20,
+}
+
+# Light relays cannot follow state changes closer together than this
+MIN_LIGHT_TOGGLE_MS = 50
+
+
+def channel_name(index: int) -> str:
+    """Return the Tesla name of a channel, or a generic label."""
+    if index < len(CHANNEL_NAMES):
+        return CHANNEL_NAMES[index]
+    return f"Channel {index}"
+
+
+def channel_index(name: str) -> int:
+    """
+    Return the channel number of a Tesla channel name (case-insensitive).
+
+    Raises:
+        ValueError: If no channel has that name
+    """
+    wanted = name.strip().lower()
+    for index, channel in enumerate(CHANNEL_NAMES):
+        if channel.lower() == wanted:
+            return index
+    raise ValueError(f"Unknown channel name: {name!r}")
+
+
+class ChannelStats(NamedTuple):
+    """Per-channel statistics of a frame matrix; each field is a NumPy array."""
+    on_time: object           # seconds the channel is on (value > 127)
+    transitions: object       # number of on/off changes
+    toggle_rate: object       # on/off changes per second
+    ramp_frames: object       # frames holding a partial (ramping) value
+    min_toggle_ms: object     # shortest gap between two changes (inf if < 2)
+
+
+class SequenceReport(NamedTuple):
+    """Result of checking a frame matrix against Tesla's limits."""
+    stats: ChannelStats
+    command_count: int
+    memory_usage: float       # fraction of COMMAND_MEMORY_LIMIT used
+    closure_moves: Dict[str, int]
+    errors: List[str]
+    warnings: List[str]
+
+
+def _state_changes(state) -> int:
+    """Count rows that differ from the previous row, counting the first row."""
+    import numpy as np
+
+    if len(state) == 0:
+        return 0
+    return 1 + int(np.count_nonzero((state[1:] != state[:-1]).any(axis=1)))
+
+
+def closure_state(matrix):
+    """Map closure channel values to Tesla's closure commands (0 = idle)."""
+    closures = matrix[:, CLOSURE_CHANNELS.start:CLOSURE_CHANNELS.stop]
+    return (closures // 32 + 1) // 2
+
+
+def command_count(matrix) -> int:
+    """
+    Count the state-change commands the car needs to store for a show.
+
+    Mirrors Tesla's validator: light on/off state, the ramp speed of the
+    first 14 lights and the two closure groups each cost one command on
+    every frame where they change.
+    """
+    import numpy as np
+
+    lights = matrix[:, LIGHT_CHANNELS.start:LIGHT_CHANNELS.stop]
+    ramp_src = matrix[:, RAMP_CHANNELS.start:RAMP_CHANNELS.stop].astype(np.int16)
+    ramp = np.minimum(
+        (np.where(ramp_src > 127, 255 - ramp_src, ramp_src) // 13 + 1) // 2, 3)
+    closures = closure_state(matrix)
+
+    return (
+        _state_changes(lights > 127)
+        + _state_changes(ramp)
+        + _state_changes(closures[:, :10])
+        + _state_changes(closures[:, 10:])
+    )
+
+
+def channel_stats(matrix, step_time_ms: int) -> ChannelStats:
+    """Compute per-channel on-time, transition and ramp statistics."""
+    import numpy as np
+
+    frame_count, channel_count = matrix.shape
+    duration = frame_count * step_time_ms / 1000.0
+
+    on = matrix > 127
+    on_time = on.sum(axis=0) * (step_time_ms / 1000.0)
+    changed = on[1:] != on[:-1]
+    transitions = changed.sum(axis=0)
+    toggle_rate = transitions / duration if duration else np.zeros(channel_count)
+    ramp_frames = ((matrix != 0) & (matrix != 255)).sum(axis=0)
+
+    # Shortest gap between consecutive changes of the same channel
+    min_toggle_ms = np.full(channel_count, np.inf)
+    channels, frames = np.nonzero(changed.T)
+    if len(frames) > 1:
+        same_channel = channels[1:] == channels[:-1]
+        gaps = np.diff(frames)[same_channel]
+        if len(gaps):
+            np.minimum.at(min_toggle_ms, channels[1:][same_channel], gaps * float(step_time_ms))
+
+    return ChannelStats(on_time, transitions, toggle_rate, ramp_frames, min_toggle_ms)
+
+
+def check_matrix(matrix, step_time_ms: int) -> SequenceReport:
+    """
+    Check a decoded ``(frames, channels)`` matrix against Tesla's limits.
+
+    Returns:
+        SequenceReport with statistics, command budget usage and any
+        errors (show will not play) or warnings (show plays differently)
+    """
+    import numpy as np
+
+    errors = []
+    warnings = []
+
+    stats = channel_stats(matrix, step_time_ms)
+    commands = command_count(matrix)
+    usage = commands / COMMAND_MEMORY_LIMIT
+    if usage > 1.0:
+        errors.append(
+            f"Sequence needs {commands} commands, the car has room for "
+            f"{COMMAND_MEMORY_LIMIT} ({usage:.0%} of memory)"
+        )
+
+    closures = closure_state(matrix)
+    # A move is a change to a non-idle command
+    moves = ((closures[1:] != closures[:-1]) & (closures[1:] != 0)).sum(axis=0)
+    moves += closures[:1].astype(bool).sum(axis=0) if len(closures) else 0
+    closure_moves = {}
+    for offset, count in enumerate(moves.tolist()):
+        name = channel_name(CLOSURE_CHANNELS.start + offset)
+        closure_moves[name] = count
+        budget = CLOSURE_MOVE_BUDGETS.get(name)
+        if budget is not None and count > budget:
+            warnings.append(f"{name} moves {count} times (budget {budget})")
+
+    light_end = min(LIGHT_CHANNELS.stop, matrix.shape[1])
+    too_fast = np.nonzero(stats.min_toggle_ms[:light_end] < MIN_LIGHT_TOGGLE_MS)[0]
+    for channel in too_fast.tolist():
+        warnings.append(
+            f"{channel_name(channel)} toggles {stats.min_toggle_ms[channel]:.0f} ms apart "
+            f"(minimum {MIN_LIGHT_TOGGLE_MS} ms)"
+        )
+
+    return SequenceReport(stats, commands, usage, closure_moves, errors, warnings)
@@ -0,0 +1,203 @@
+"""
+Timing spans and counters shared by the tools.
+
+Code marks its phases with ``span()`` and reports work done with
+``count()``::
+
+    with span('copy'):
+        ...
+        count(BYTES_WRITTEN, size)
+
+Spans nest: a span opened inside ``package`` is recorded as
+``package/copy``. A counter is added to every span open at the time, so
+each phase knows how many bytes it moved and its throughput can be
+reported. Tracing is off by default, and both calls then cost no more
+than a function call; the ``--timings`` and ``--format json`` options of
+the tools switch it on.
+"""
+import functools
+import time
+from typing import Dict, List
+
+
+# Counter names
+BYTES_READ = 'bytes_read'
+BYTES_WRITTEN = 'bytes_written'
+BLOCK_CACHE_HITS = 'block_cache_hits'
+BLOCK_CACHE_MISSES = 'block_cache_misses'
+BUILD_CACHE_HITS = 'build_cache_hits'
+BUILD_CACHE_MISSES = 'build_cache_misses'
+INDEX_HITS = 'index_hits'
+INDEX_MISSES = 'index_misses'
+PREVIEW_CACHE_HITS = 'preview_cache_hits'
+PREVIEW_CACHE_MISSES = 'preview_cache_misses'
+
+MB = 1024 * 1024
+
+
+class SpanStats:
+    """Accumulated calls, time and counters of one span path."""
+    __slots__ = ('calls', 'seconds', 'counters')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.counters = {}
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'stats', 'start')
+
+    def __init__(self, tracer: 'Tracer', name: str):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        tracer = self.tracer
+        path = f"{tracer._stack[-1][0]}/{self.name}" if tracer._stack else self.name
+        self.stats = tracer.spans.get(path)
+        if self.stats is None:
+            self.stats = tracer.spans[path] = SpanStats()
+        tracer._stack.append((path, self.stats))
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.seconds += time.perf_counter() - self.start
+        self.stats.calls += 1
+        self.tracer._stack.pop()
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Collects span timings and counters for one process.
+
+    Example:
+        tracer.enable()
+        with span('validate'):
+            validate_show(show_dir)
+        print(tracer.report())
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        self.spans: Dict[str, SpanStats] = {}
+        self.counters: Dict[str, int] = {}
+        self._stack = []
+        self._started = time.perf_counter()
+
+    def span(self, name: str):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + value
+        for _, stats in self._stack:
+            stats.counters[name] = stats.counters.get(name, 0) + value
+
+    def report(self) -> Dict:
+        """
+        Return the recorded data as a JSON-serialisable dict.
+
+        Spans are listed in the order they were first entered, with read
+        and write throughput in MB/s where bytes were counted.
+        """
+        spans = []
+        for path, stats in self.spans.items():
+            entry = {'name': path, 'calls': stats.calls, 'seconds': round(stats.seconds, 6)}
+            entry.update(stats.counters)
+            for counter, key in ((BYTES_READ, 'read_mb_s'), (BYTES_WRITTEN, 'write_mb_s')):
+                if stats.counters.get(counter) and stats.seconds > 0:
+                    entry[key] = round(stats.counters[counter] / MB / stats.seconds, 1)
+            spans.append(entry)
+        return {
+            'wall_seconds': round(time.perf_counter() - self._started, 6),
+            'spans': spans,
+            'counters': dict(self.counters),
+        }
+
+    def merge(self, report: Dict):
+        """Add a report from another process (e.g. a batch worker) to this one."""
+        for entry in report.get('spans', []):
+            stats = self.spans.get(entry['name'])
+            if stats is None:
+                stats = self.spans[entry['name']] = SpanStats()
+            stats.calls += entry['calls']
+            stats.seconds += entry['seconds']
+            for key, value in entry.items():
+                if key not in ('name', 'calls', 'seconds', 'read_mb_s', 'write_mb_s'):
+                    stats.counters[key] = stats.counters.get(key, 0) + value
+        for key, value in report.get('counters', {}).items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+def format_report(report: Dict) -> List[str]:
+    """Format a report as indented text lines, one per span."""
+    lines = [f"Timings ({report['wall_seconds'] * 1000:.1f} ms wall):"]
+    for entry in report['spans']:
+        depth = entry['name'].count('/')
+        label = '  ' * depth + entry['name'].rsplit('/', 1)[-1]
+        line = f"  {label:<24} {entry['calls']:>6} x {entry['seconds'] * 1000:>10.2f} ms"
+        moved = []
+        if entry.get(BYTES_READ):
+            moved.append(f"{entry[BYTES_READ] / MB:.1f} MB read"
+                         + (f" ({entry['read_mb_s']:.0f} MB/s)" if 'read_mb_s' in entry else ""))
+        if entry.get(BYTES_WRITTEN):
+            moved.append(f"{entry[BYTES_WRITTEN] / MB:.1f} MB written"
+                         + (f" ({entry['write_mb_s']:.0f} MB/s)" if 'write_mb_s' in entry else ""))
+        if moved:
+            line += "   " + ", ".join(moved)
+        lines.append(line)
+    if report['counters']:
+        lines.append("Counters:")
+        for key, value in sorted(report['counters'].items()):
+            lines.append(f"  {key.replace('_', ' '):<24} {value}")
+    return lines
+
+
+tracer = Tracer()
+
+
+def span(name: str):
+    """Time a phase: ``with span('hash'): ...``. A no-op unless tracing is on."""
+    return tracer.span(name)
+
+
+def count(name: str, value: int = 1):
+    """Add value to a counter and to every open span. A no-op unless tracing is on."""
+    tracer.count(name, value)
+
+
+def traced(name: str):
+    """Decorator that runs the whole function inside ``span(name)``."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
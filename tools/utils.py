@@ -3,8 +3,11 @@ Utility functions for Tesla Lightshow management.
 """
 import os
 import json
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import Dict, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
+
+from tracing import span, tracer, format_report
 
 
 class Colors:
@@ -17,51 +20,153 @@ class Colors:
     BOLD = '\033[1m'
 
 
+# Message lists being collected by capture_messages(), innermost last
+_captures: List[List[Dict[str, str]]] = []
+
+
+@contextmanager
+def capture_messages():
+    """
+    Collect print_* messages into a list instead of printing them, for
+    machine-readable output.
+    
+    Example:
+        with capture_messages() as messages:
+            validate_show(show_dir)
+        # messages == [{'level': 'error', 'message': '...'}, ...]
+    """
+    messages = []
+    _captures.append(messages)
+    try:
+        yield messages
+    finally:
+        _captures.pop()
+
+
+def _emit(level: str, color: str, symbol: str, message: str):
+    if _captures:
+        _captures[-1].append({'level': level, 'message': message.strip()})
+    else:
+        print(f"{color}{symbol} {message}{Colors.END}")
+
+
 def print_success(message: str):
     """Print success message in green."""
-    print(f"{Colors.GREEN}✓ {message}{Colors.END}")
+    _emit('success', Colors.GREEN, '✓', message)
 
 
 def print_error(message: str):
     """Print error message in red."""
-    print(f"{Colors.RED}✗ {message}{Colors.END}")
+    _emit('error', Colors.RED, '✗', message)
 
 
 def print_warning(message: str):
     """Print warning message in yellow."""
-    print(f"{Colors.YELLOW}⚠ {message}{Colors.END}")
+    _emit('warning', Colors.YELLOW, '⚠', message)
 
 
 def print_info(message: str):
     """Print info message in blue."""
-    print(f"{Colors.BLUE}ℹ {message}{Colors.END}")
+    _emit('info', Colors.BLUE, 'ℹ', message)
 
 
-def get_show_files(show_dir: Path) -> Tuple[Optional[Path], Optional[Path], Optional[Path]]:
+def add_output_options(parser):
+    """Add the --timings and --format options shared by the reporting tools."""
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        help='Print the time spent in each phase and the bytes moved'
+    )
+    
+    parser.add_argument(
+        '--format',
+        choices=['text', 'json'],
+        default='text',
+        help='Output format (default: text); json includes timings'
+    )
+
+
+def begin_output(args):
     """
-    Find the required files in a show directory.
+    Start tracing if --timings or --format json was given.
     
     Returns:
-        Tuple of (fseq_file, audio_file, metadata_file)
+        A context manager collecting messages for JSON output (a no-op
+        yielding an empty list for text output)
     """
-    fseq_file = None
-    audio_file = None
-    metadata_file = show_dir / "metadata.json"
-    
-    if not metadata_file.exists():
-        metadata_file = None
+    tracer.enable(args.timings or args.format == 'json')
+    if args.format == 'json':
+        return capture_messages()
+    return nullcontext([])
+
+
+def end_output(args, document: Optional[Dict] = None, timings: Optional[Dict] = None):
+    """
+    Print the JSON document, or the timing report if --timings was given.
     
-    # Look for .fseq file
-    fseq_files = list(show_dir.glob("*.fseq"))
-    if fseq_files:
-        fseq_file = fseq_files[0]
+    Args:
+        args: Parsed command line with the add_output_options() options
+        document: Result fields for JSON output
+        timings: Tracer report to use instead of this process's tracer
+    """
+    if timings is None:
+        timings = tracer.report()
+    if args.format == 'json':
+        document = dict(document or {})
+        document['timings'] = timings
+        print(json.dumps(document, indent=2))
+    elif args.timings:
+        print()
+        for line in format_report(timings):
+            print(line)
+
+
+def scan_show_entries(show_dir: Path) -> Dict[str, os.DirEntry]:
+    """
+    Find the show files in a directory with a single ``os.scandir`` pass.
     
-    # Look for audio file (wav or mp3)
-    audio_files = list(show_dir.glob("*.wav")) + list(show_dir.glob("*.mp3"))
-    if audio_files:
-        audio_file = audio_files[0]
+    Returns:
+        Dict with 'fseq', 'audio' and 'metadata' keys mapped to the matching
+        DirEntry (only keys that were found are present). When several files
+        match, the first by name wins, and .wav is preferred over .mp3.
+    """
+    found = {}
+    wav = mp3 = None
+    with os.scandir(show_dir) as it:
+        for entry in it:
+            name = entry.name
+            if name == "metadata.json":
+                found['metadata'] = entry
+                continue
+            suffix = os.path.splitext(name)[1]
+            if suffix == ".fseq":
+                if 'fseq' not in found or name < found['fseq'].name:
+                    found['fseq'] = entry
+            elif suffix == ".wav":
+                if wav is None or name < wav.name:
+                    wav = entry
+            elif suffix == ".mp3":
+                if mp3 is None or name < mp3.name:
+                    mp3 = entry
+    if wav is not None or mp3 is not None:
+        found['audio'] = wav if wav is not None else mp3
+    return found
+
+
+def get_show_files(show_dir: Path) -> Tuple[Optional[Path], Optional[Path], Optional[Path]]:
+    """
+    Find the required files in a show directory.
     
-    return fseq_file, audio_file, metadata_file
+    Returns:
+        Tuple of (fseq_file, audio_file, metadata_file)
+    """
+    with span('discover'):
+        found = scan_show_entries(show_dir)
+    paths = [
+        Path(found[key].path) if key in found else None
+        for key in ('fseq', 'audio', 'metadata')
+    ]
+    return paths[0], paths[1], paths[2]
 
 
 def load_metadata(metadata_file: Path) -> Dict:
@@ -95,6 +200,33 @@ def format_size(size_bytes: int) -> str:
     return f"{size_bytes:.2f} TB"
 
 
+def parse_size(text: str) -> int:
+    """
+    Parse a size such as "512M", "8G" or "1048576" into bytes.
+    
+    Suffixes K, M, G and T (optionally followed by B or iB) are powers of 1024.
+    
+    Raises:
+        ValueError: If the text is not a size
+    """
+    value = text.strip().upper()
+    for suffix in ('IB', 'B'):
+        if value.endswith(suffix) and len(value) > len(suffix):
+            value = value[:-len(suffix)]
+            break
+    multiplier = 1
+    if value and value[-1] in 'KMGT':
+        multiplier = 1024 ** ('KMGT'.index(value[-1]) + 1)
+        value = value[:-1]
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"Invalid size: {text}")
+    if number < 0:
+        raise ValueError(f"Invalid size: {text}")
+    return int(number * multiplier)
+
+
 def normalize_show_name(name: str) -> str:
     """
     Normalize show name to valid directory name.
@@ -130,12 +262,14 @@ def find_all_shows(shows_dir: Path) -> list:
     if not shows_dir.exists():
         return shows
     
-    for item in shows_dir.iterdir():
-        if item.is_dir() and not item.name.startswith('.'):
+    with span('discover'), os.scandir(shows_dir) as it:
+        for entry in it:
+            if entry.name.startswith('.') or not entry.is_dir():
+                continue
             # Check if it looks like a show directory
-            fseq, audio, _ = get_show_files(item)
-            if fseq or audio:
-                shows.append(item)
+            found = scan_show_entries(entry.path)
+            if 'fseq' in found or 'audio' in found:
+                shows.append(Path(entry.path))
     
     return sorted(shows)
 
@@ -7,110 +7,280 @@ Checks that all required files are present and properly formatted.
 import sys
 import argparse
 from pathlib import Path
+from typing import Optional, Set, Union
 
 from utils import (
-    get_show_files, load_metadata, print_success, print_error,
-    print_warning, print_info, get_file_size_mb, format_size
+    save_metadata, print_success, print_error, print_warning, print_info,
+    format_size, add_output_options, begin_output, end_output
 )
+from fseq import FseqFile, FseqError
+from audio import AudioError
+from show import Show
+from tracing import span, traced
+import tesla
 
+MB = 1024 * 1024
 
-def validate_show(show_dir: Path, verbose: bool = False) -> bool:
+
+def validate_sequence(fseq_file: Path, verbose: bool = False) -> bool:
     """
-    Validate a Tesla Lightshow directory.
-    
-    Args:
-        show_dir: Path to show directory
-        verbose: Print detailed information
-    
+    Parse the .fseq header and check it against Tesla's format limits.
+
+    When the header is sound and NumPy is installed, the channel data is
+    also checked against the car's command memory and hardware limits.
+
     Returns:
-        True if valid, False otherwise
+        True if the sequence is usable, False otherwise
     """
+    try:
+        with FseqFile(fseq_file) as seq:
+            return check_sequence(seq, verbose)
+    except (FseqError, OSError) as e:
+        print_error(f"Invalid sequence file: {e}")
+        return False
+
+
+def check_sequence(seq: FseqFile, verbose: bool = False) -> bool:
+    """Check an open sequence's header and, if it is sound, its channel data."""
+    valid = check_header(seq.header, verbose)
+    # A layout Tesla cannot play still decodes, so its channels are checked too
+    layout_ok = check_layout(seq.header)
+    if valid:
+        valid = check_channels(seq, verbose)
+    return valid and layout_ok
+
+
+def check_header(header, verbose: bool = False) -> bool:
+    """Check parsed FSEQ header fields against Tesla's format limits."""
     if verbose:
-        print_info(f"Validating show: {show_dir.name}")
-    
+        print_info(f"  Format: FSEQ {header.layout}")
+        print_info(f"  Channels: {header.channel_count}, frames: {header.frame_count}")
+        print_info(f"  Frame interval: {header.step_time_ms} ms ({header.fps:.1f} FPS)")
+        print_info(f"  Duration: {header.duration:.2f}s")
+
     valid = True
-    
-    # Check if directory exists
-    if not show_dir.exists():
-        print_error(f"Show directory does not exist: {show_dir}")
+
+    if header.sparse_ranges:
+        # Stored channels are expanded into the smallest layout holding them
+        channels = max(r.start_channel + r.channel_count for r in header.sparse_ranges)
+        if channels > max(tesla.CHANNEL_COUNTS):
+            print_error(
+                f"Sequence uses channels up to {channels}, Tesla has at most "
+                f"{max(tesla.CHANNEL_COUNTS)}"
+            )
+            valid = False
+    elif header.channel_count not in tesla.CHANNEL_COUNTS:
+        print_error(
+            f"Sequence has {header.channel_count} channels, expected "
+            f"{' or '.join(str(c) for c in tesla.CHANNEL_COUNTS)}"
+        )
+        valid = False
+
+    if header.frame_count < 1:
+        print_error("Sequence has no frames")
+        valid = False
+
+    if header.step_time_ms < tesla.MIN_STEP_MS:
+        print_error(
+            f"Frame interval {header.step_time_ms} ms is below the "
+            f"{tesla.MIN_STEP_MS} ms minimum"
+        )
+        valid = False
+
+    if header.duration > tesla.MAX_DURATION_S:
+        print_error(f"Sequence is {header.duration:.1f}s long, shows must be under 5 minutes")
+        valid = False
+
+    return valid
+
+
+def check_layout(header) -> bool:
+    """
+    Check that the channel data is stored the way Tesla plays it: FSEQ v2,
+    uncompressed, every channel present. Other layouts are rejected by the
+    car, but convert.py can rewrite them.
+    """
+    valid = True
+
+    if header.major_version != 2:
+        print_error(f"Sequence is FSEQ v{header.version}, Tesla requires v2")
+        valid = False
+
+    if header.compression != 0:
+        print_error(f"Sequence is {header.compression_name}-compressed, "
+                    f"Tesla requires an uncompressed FSEQ v2 export")
+        valid = False
+
+    if header.sparse_ranges:
+        print_error("Sequence uses sparse channel ranges, Tesla requires every channel")
+        valid = False
+
+    if not valid:
+        print_info(f"  Stored as FSEQ {header.layout}; "
+                   f"rewrite it for Tesla with: python tools/convert.py <file> --in-place")
+
+    return valid
+
+
+def check_channels(seq: FseqFile, verbose: bool = False) -> bool:
+    """
+    Decode the frame matrix and check it against Tesla's hardware limits
+    in one vectorized pass.
+    """
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        if verbose:
+            print_info("  Install numpy to check channel data against Tesla limits")
+        return True
+
+    with span('check'):
+        matrix = seq.as_array()
+        if seq.header.sparse_ranges:
+            matrix = _expand_sparse(matrix, seq.header)
+        report = tesla.check_matrix(matrix, seq.header.step_time_ms)
+
+    if verbose:
+        print_info(
+            f"  Command memory: {report.command_count}/{tesla.COMMAND_MEMORY_LIMIT} "
+            f"({report.memory_usage:.0%})"
+        )
+        stats = report.stats
+        step = seq.header.step_time_ms / 1000.0
+        for channel in range(min(seq.channel_count, len(tesla.CHANNEL_NAMES))):
+            if stats.transitions[channel] or stats.on_time[channel] or stats.ramp_frames[channel]:
+                ramping = stats.ramp_frames[channel] * step
+                print_info(
+                    f"    {tesla.channel_name(channel)}: on {stats.on_time[channel]:.1f}s, "
+                    f"{stats.transitions[channel]} toggles "
+                    f"({stats.toggle_rate[channel]:.2f}/s)"
+                    + (f", ramping {ramping:.1f}s" if ramping else "")
+                )
+
+    for message in report.warnings:
+        print_warning(message)
+    for message in report.errors:
+        print_error(message)
+
+    return not report.errors
+
+
+def _expand_sparse(matrix, header):
+    """Place a sparse file's stored channels at their positions in the full layout."""
+    import numpy as np
+    from convert import target_channels
+
+    columns = [c for r in header.sparse_ranges
+               for c in range(r.start_channel, r.start_channel + r.channel_count)]
+    full = np.zeros((len(matrix), target_channels(header)), dtype=np.uint8)
+    full[:, columns] = matrix
+    return full
+
+
+def check_sequence_file(show: Show, verbose: bool = False) -> bool:
+    """Check that the .fseq file exists, has a sane size and a valid sequence."""
+    fseq_file = show.fseq_file
+    if not fseq_file:
+        print_error("Missing .fseq file (light sequence)")
         return False
     
-    if not show_dir.is_dir():
-        print_error(f"Not a directory: {show_dir}")
-        return False
+    if verbose:
+        print_success(f"Found sequence file: {fseq_file.name}")
     
-    # Get show files
-    fseq_file, audio_file, metadata_file = get_show_files(show_dir)
+    # Check file size (typical shows are 1-50 MB)
+    try:
+        size = show.fseq_size
+    except OSError as e:
+        print_error(f"Invalid sequence file: {e}")
+        return False
+    size_mb = size / MB
+    if verbose:
+        print_info(f"  Size: {format_size(size)}")
     
-    # Validate .fseq file
-    if not fseq_file:
-        print_error("Missing .fseq file (light sequence)")
-        valid = False
-    else:
-        if verbose:
-            print_success(f"Found sequence file: {fseq_file.name}")
-        
-        # Check file size (typical shows are 1-50 MB)
-        size_mb = get_file_size_mb(fseq_file)
-        if verbose:
-            print_info(f"  Size: {format_size(fseq_file.stat().st_size)}")
-        
-        if size_mb > 100:
-            print_warning(f"Sequence file is very large ({size_mb:.1f} MB)")
-        elif size_mb < 0.1:
-            print_warning(f"Sequence file is very small ({size_mb:.1f} MB)")
+    if size_mb > 100:
+        print_warning(f"Sequence file is very large ({size_mb:.1f} MB)")
+    elif size_mb < 0.1:
+        print_warning(f"Sequence file is very small ({size_mb:.1f} MB)")
     
-    # Validate audio file
+    # Opened through the show, which keeps the header for the sync check
+    try:
+        with show.open_sequence() as seq:
+            return check_sequence(seq, verbose)
+    except (FseqError, OSError) as e:
+        print_error(f"Invalid sequence file: {e}")
+        return False
+
+
+def check_audio_file(show: Show, verbose: bool = False) -> bool:
+    """Check that the audio file exists and has a supported format and size."""
+    audio_file = show.audio_file
     if not audio_file:
         print_error("Missing audio file (.wav or .mp3)")
+        return False
+    
+    try:
+        size = show.audio_size
+    except OSError as e:
+        print_error(f"Invalid audio file: {e}")
+        return False
+    
+    valid = True
+    if verbose:
+        print_success(f"Found audio file: {audio_file.name}")
+        print_info(f"  Size: {format_size(size)}")
+    
+    # Check audio format
+    if audio_file.suffix not in ['.wav', '.mp3']:
+        print_error(f"Invalid audio format: {audio_file.suffix}")
+        print_info("  Audio must be .wav or .mp3")
         valid = False
-    else:
-        if verbose:
-            print_success(f"Found audio file: {audio_file.name}")
-            print_info(f"  Size: {format_size(audio_file.stat().st_size)}")
-        
-        # Check audio format
-        if audio_file.suffix not in ['.wav', '.mp3']:
-            print_error(f"Invalid audio format: {audio_file.suffix}")
-            print_info("  Audio must be .wav or .mp3")
-            valid = False
-        
-        # Check file size (typical songs are 3-50 MB for WAV, 1-10 MB for MP3)
-        size_mb = get_file_size_mb(audio_file)
-        if audio_file.suffix == '.wav' and size_mb > 100:
-            print_warning(f"Audio file is very large ({size_mb:.1f} MB)")
-        elif size_mb < 0.5:
-            print_warning(f"Audio file is very small ({size_mb:.1f} MB)")
-    
-    # Validate metadata file
-    if not metadata_file:
+    
+    # Check file size (typical songs are 3-50 MB for WAV, 1-10 MB for MP3)
+    size_mb = size / MB
+    if audio_file.suffix == '.wav' and size_mb > 100:
+        print_warning(f"Audio file is very large ({size_mb:.1f} MB)")
+    elif size_mb < 0.5:
+        print_warning(f"Audio file is very small ({size_mb:.1f} MB)")
+    
+    return valid
+
+
+def check_metadata_file(show: Show, verbose: bool = False) -> bool:
+    """Check that metadata.json, if present, parses and has the usual fields."""
+    if not show.has_metadata:
         print_warning("Missing metadata.json (recommended but optional)")
         if verbose:
             print_info("  Create metadata.json with show information")
-    else:
-        try:
-            metadata = load_metadata(metadata_file)
-            if verbose:
-                print_success("Found valid metadata.json")
-            
-            # Check recommended fields
-            recommended_fields = ['name', 'duration', 'artist', 'created']
-            for field in recommended_fields:
-                if field not in metadata:
-                    if verbose:
-                        print_warning(f"  Missing recommended field: {field}")
-            
-            # Display metadata if verbose
-            if verbose and metadata:
-                print_info("  Metadata:")
-                for key, value in metadata.items():
-                    print_info(f"    {key}: {value}")
+        return True
+    
+    try:
+        metadata = show.metadata
+        if verbose:
+            print_success("Found valid metadata.json")
         
-        except ValueError as e:
-            print_error(f"Invalid metadata.json: {e}")
-            valid = False
+        # Check recommended fields
+        recommended_fields = ['name', 'duration', 'artist', 'created']
+        for field in recommended_fields:
+            if field not in metadata:
+                if verbose:
+                    print_warning(f"  Missing recommended field: {field}")
+        
+        # Display metadata if verbose
+        if verbose and metadata:
+            print_info("  Metadata:")
+            for key, value in metadata.items():
+                print_info(f"    {key}: {value}")
     
-    # Check file naming conventions
+    except ValueError as e:
+        print_error(f"Invalid metadata.json: {e}")
+        return False
+    
+    return True
+
+
+def check_file_names(show: Show):
+    """Warn about file names Tesla will not pick up."""
+    fseq_file, audio_file = show.fseq_file, show.audio_file
     if fseq_file and fseq_file.name != "lightshow.fseq":
         print_warning(f"Sequence file should be named 'lightshow.fseq' (found: {fseq_file.name})")
         print_info("  Tesla expects 'lightshow.fseq' on the USB drive")
@@ -118,16 +288,189 @@ def validate_show(show_dir: Path, verbose: bool = False) -> bool:
     if audio_file and not audio_file.name.startswith("lightshow"):
         print_warning(f"Audio file should be named 'lightshow.wav' or 'lightshow.mp3' (found: {audio_file.name})")
         print_info("  Tesla expects 'lightshow.wav' or 'lightshow.mp3' on the USB drive")
+
+
+def fill_duration(show: Show, duration: float):
+    """
+    Record the probed audio duration in metadata.json if it is unset.
+
+    Stored to 0.01 s, as create_show.py does. A duration that rounds to
+    zero is not written, so it is not rewritten on every run either.
+    """
+    try:
+        metadata = show.metadata
+    except ValueError:
+        return
+    duration = round(duration, 2)
+    if not isinstance(metadata, dict) or metadata.get('duration') or duration <= 0:
+        return
+    metadata = dict(metadata, duration=duration)
+    save_metadata(show.metadata_file, metadata)
+    show.set_metadata(metadata)
+    print_info(f"Filled in metadata duration: {metadata['duration']}s")
+
+
+def check_sync(show: Show, verbose: bool = False) -> bool:
+    """
+    Compare the exact audio duration with the sequence length.
+
+    Only file headers are read. Fails when the two differ by more than one
+    frame interval, and fills in a missing metadata duration.
+    """
+    audio_file = show.audio_file
+    if not audio_file:
+        return True
+    
+    try:
+        info = show.audio_info
+    except (AudioError, OSError) as e:
+        if audio_file.suffix in ('.wav', '.mp3'):
+            print_error(f"Invalid audio file: {e}")
+            return False
+        if verbose:
+            print_info(f"  Cannot check audio duration: {e}")
+        return True
+    
+    if verbose:
+        print_info(
+            f"  Audio: {info.duration:.3f}s, {info.sample_rate} Hz, "
+            f"{info.channels} channel(s)"
+        )
+    
+    if show.has_metadata:
+        fill_duration(show, info.duration)
+    
+    if not show.fseq_file:
+        return True
+    
+    try:
+        header = show.header
+    except (FseqError, OSError):
+        # Already reported by the sequence check
+        return True
+    
+    drift_ms = (info.duration - header.duration) * 1000
+    if abs(drift_ms) > header.step_time_ms:
+        longer = "longer" if drift_ms > 0 else "shorter"
+        print_error(
+            f"Audio is {abs(drift_ms):.0f} ms {longer} than the sequence "
+            f"({info.duration:.3f}s vs {header.duration:.3f}s, "
+            f"one frame is {header.step_time_ms} ms)"
+        )
+        return False
     
-    # Final result
+    if verbose:
+        print_success(f"Audio and sequence lengths match ({drift_ms:+.0f} ms)")
+    return True
+
+
+# Checks run for each kind of show file, in report order
+FILE_CHECKS = (
+    ('fseq', check_sequence_file),
+    ('audio', check_audio_file),
+    ('metadata', check_metadata_file),
+)
+
+
+def print_result(show_dir: Path, valid: bool):
+    """Print the final verdict for a show."""
     if valid:
         print_success(f"✓ Show '{show_dir.name}' is valid!")
     else:
         print_error(f"✗ Show '{show_dir.name}' has validation errors")
+
+
+@traced('validate')
+def validate_show(show_dir: Union[Path, Show], verbose: bool = False,
+                  beat_sync: bool = False) -> bool:
+    """
+    Validate a Tesla Lightshow directory.
+    
+    Args:
+        show_dir: Path to show directory, or an already loaded Show whose
+            cached facts are reused
+        verbose: Print detailed information
+        beat_sync: Also check that the lights change on the music's
+            onsets; this reads the whole WAV file, and an off-beat show
+            only gets warnings, as it still plays
+    
+    Returns:
+        True if valid, False otherwise
+    """
+    show = show_dir if isinstance(show_dir, Show) else None
+    if show is not None:
+        show_dir = show.path
+    
+    if verbose:
+        print_info(f"Validating show: {show_dir.name}")
+    
+    # Check if directory exists
+    if not show_dir.exists():
+        print_error(f"Show directory does not exist: {show_dir}")
+        return False
+    
+    if not show_dir.is_dir():
+        print_error(f"Not a directory: {show_dir}")
+        return False
+    
+    # Find the show's files; everything else is loaded once, on first use
+    if show is None:
+        show = Show.load(show_dir)
+    
+    valid = True
+    for _, check in FILE_CHECKS:
+        if not check(show, verbose):
+            valid = False
+    
+    if not check_sync(show, verbose):
+        valid = False
+    
+    if beat_sync:
+        from analyze import check_beat_sync
+        with span('beat_sync'):
+            check_beat_sync(show, verbose)
+    
+    check_file_names(show)
+    
+    print_result(show_dir, valid)
     
     return valid
 
 
+def watch_validate(shows_dir: Path, verbose: bool = False, polling: bool = False,
+                   only: Optional[Path] = None):
+    """
+    Revalidate shows as their files change, until interrupted.
+    
+    Only the checks for the files that changed are re-run; the results of
+    the other checks are remembered from the previous run.
+    """
+    from watch import watch_shows
+    
+    results = {}
+    
+    def on_change(show_dir: Path, kinds: Set[str]):
+        show = Show.load(show_dir)
+        show_results = results.setdefault(show_dir, {})
+        
+        print_info(f"Changed: {show_dir.name} ({', '.join(sorted(kinds))})")
+        for kind, check in FILE_CHECKS:
+            if '*' in kinds or kind in kinds or kind not in show_results:
+                show_results[kind] = check(show, verbose)
+        if kinds != {'metadata'} or 'sync' not in show_results:
+            show_results['sync'] = check_sync(show, verbose)
+        check_file_names(show)
+        print_result(show_dir, all(show_results.values()))
+        print()
+        sys.stdout.flush()
+    
+    print_info(f"Watching {shows_dir}/ for changes (Ctrl+C to stop)")
+    try:
+        watch_shows(shows_dir, on_change, polling=polling, only=only)
+    except KeyboardInterrupt:
+        print()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Validate Tesla Lightshow files',
@@ -136,13 +479,19 @@ def main():
 Examples:
   %(prog)s shows/my-show              Validate a specific show
   %(prog)s shows/my-show -v           Validate with detailed output
+  %(prog)s shows/my-show --beat-sync  Also check the lights follow the beat
+  %(prog)s --watch                    Revalidate shows as they change
+  %(prog)s shows/my-show --timings    Show where the time goes
+  %(prog)s shows/my-show --format json
+                                      Machine-readable result
         """
     )
     
     parser.add_argument(
         'show_dir',
         type=Path,
-        help='Path to show directory'
+        nargs='?',
+        help='Path to show directory (with --watch: only watch this show)'
     )
     
     parser.add_argument(
@@ -151,10 +500,55 @@ Examples:
         help='Verbose output with detailed information'
     )
     
+    parser.add_argument(
+        '--beat-sync',
+        action='store_true',
+        help='Check that light changes line up with the music (WAV audio, needs numpy)'
+    )
+    
+    parser.add_argument(
+        '-w', '--watch',
+        action='store_true',
+        help='Keep running and revalidate shows whenever their files change'
+    )
+    
+    parser.add_argument(
+        '-d', '--directory',
+        type=Path,
+        default=Path('shows'),
+        help='Shows directory to watch (default: shows/)'
+    )
+    
+    parser.add_argument(
+        '--poll',
+        action='store_true',
+        help='With --watch: poll for changes instead of using inotify'
+    )
+    
+    add_output_options(parser)
+    
     args = parser.parse_args()
     
+    if args.watch:
+        if args.timings or args.format != 'text':
+            parser.error("--timings and --format json cannot be used with --watch")
+        shows_dir = args.show_dir.parent if args.show_dir else args.directory
+        watch_validate(shows_dir, args.verbose, polling=args.poll, only=args.show_dir)
+        sys.exit(0)
+    
+    if args.show_dir is None:
+        parser.error("the following arguments are required: show_dir")
+    
     # Validate the show
-    is_valid = validate_show(args.show_dir, verbose=args.verbose)
+    with begin_output(args) as messages:
+        is_valid = validate_show(args.show_dir, verbose=args.verbose,
+                                 beat_sync=args.beat_sync)
+    end_output(args, {
+        'tool': 'validate',
+        'show': str(args.show_dir),
+        'valid': is_valid,
+        'messages': messages,
+    })
     
     # Exit with appropriate code
     sys.exit(0 if is_valid else 1)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Verify a deployed USB stick against its checksum manifest.
+
+Packaging writes ``SHA256SUMS`` next to the ``LightShow`` folder, in the
+format of ``sha256sum`` (so ``sha256sum -c SHA256SUMS`` works too). This
+tool re-reads every listed file in parallel threads and compares it with
+the manifest. Reads bypass the page cache (O_DIRECT where supported,
+otherwise the cached pages are dropped first), so a stick that was just
+written is checked against what actually reached the device.
+"""
+import os
+import sys
+import hashlib
+import argparse
+import mmap
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from utils import (
+    print_success, print_error, print_warning, print_info,
+    add_output_options, begin_output, end_output
+)
+from tracing import count, traced, BYTES_READ
+
+
+MANIFEST_NAME = "SHA256SUMS"
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+DEFAULT_THREADS = 4
+
+
+class FileCheck(NamedTuple):
+    """Result of checking one manifest entry."""
+    path: str
+    status: str            # 'ok', 'mismatch', 'missing' or 'error'
+    detail: str = ''
+    bytes_read: int = 0
+
+
+def format_manifest(digests: Dict[str, str]) -> str:
+    """Return manifest text for {relative path: sha256}, sorted by path."""
+    return ''.join(f"{digest}  {path}\n" for path, digest in sorted(digests.items()))
+
+
+def write_manifest(path: Path, digests: Dict[str, str], mtime: Optional[float] = None):
+    """
+    Write the manifest for {relative path: sha256} to a file.
+
+    Args:
+        path: Manifest file to write
+        digests: SHA-256 hex digest of each file, keyed by relative path
+        mtime: Modification time to give the manifest, e.g. that of the
+            newest file it lists, so an image holding it is reproducible
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(format_manifest(digests))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def read_manifest(manifest: Path) -> Dict[str, str]:
+    """
+    Parse a sha256sum-style manifest.
+
+    Returns:
+        Dict mapping relative paths to SHA-256 hex digests
+
+    Raises:
+        ValueError: If a line is not "<sha256>  <path>"
+    """
+    digests = {}
+    with open(manifest, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+            digest, sep, path = line.partition(' ')
+            path = path[1:] if path[:1] in (' ', '*') else path
+            if not sep or len(digest) != 64 or not path:
+                raise ValueError(f"{manifest.name} line {number} is not '<sha256>  <path>'")
+            digests[path] = digest.lower()
+    return digests
+
+
+def _open_uncached(path: Path) -> int:
+    """Open a file for reading so that reads come from the device."""
+    if hasattr(os, 'O_DIRECT'):
+        try:
+            return os.open(path, os.O_RDONLY | os.O_DIRECT)
+        except OSError:
+            pass
+    fd = os.open(path, os.O_RDONLY)
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            # Dirty pages cannot be dropped, so flush them first
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+    return fd
+
+
+def hash_stored_file(path: Path) -> Tuple[str, int]:
+    """
+    Return the SHA-256 of a file as read back from its device.
+
+    Returns:
+        Tuple of (hex digest, bytes read)
+    """
+    digest = hashlib.sha256()
+    total = 0
+    # O_DIRECT needs an aligned buffer; anonymous mmaps are page aligned
+    view = memoryview(mmap.mmap(-1, READ_BUFFER_SIZE))
+    with os.fdopen(_open_uncached(path), 'rb', buffering=0) as f:
+        while True:
+            try:
+                n = f.readinto(view)
+            except OSError:
+                # Some filesystems accept O_DIRECT at open but not on read
+                if total:
+                    raise
+                return _hash_buffered(path)
+            if not n:
+                break
+            total += n
+            digest.update(view[:n])
+    return digest.hexdigest(), total
+
+
+def _hash_buffered(path: Path) -> Tuple[str, int]:
+    digest = hashlib.sha256()
+    total = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_BUFFER_SIZE)
+            if not chunk:
+                break
+            total += len(chunk)
+            digest.update(chunk)
+    return digest.hexdigest(), total
+
+
+def check_file(root: Path, path: str, expected: str) -> FileCheck:
+    """Check one manifest entry under root."""
+    target = root / path
+    if not target.is_file():
+        return FileCheck(path, 'missing')
+    try:
+        actual, size = hash_stored_file(target)
+    except OSError as e:
+        return FileCheck(path, 'error', str(e))
+    if actual != expected:
+        return FileCheck(path, 'mismatch', f"expected {expected[:12]}…, got {actual[:12]}…",
+                         size)
+    return FileCheck(path, 'ok', bytes_read=size)
+
+
+def unlisted_files(root: Path, digests: Dict[str, str]) -> List[str]:
+    """Files in root/LightShow that the manifest does not cover."""
+    lightshow_dir = root / "LightShow"
+    if not lightshow_dir.is_dir():
+        return []
+    return sorted(
+        f"LightShow/{entry.name}" for entry in os.scandir(lightshow_dir)
+        if entry.is_file() and f"LightShow/{entry.name}" not in digests
+    )
+
+
+@traced('verify')
+def verify_stick(root: Path, manifest: Optional[Path] = None,
+                 threads: int = DEFAULT_THREADS) -> Optional[List[FileCheck]]:
+    """
+    Re-read every file listed in the manifest and compare checksums.
+
+    Args:
+        root: Stick mount point (or packaged output directory)
+        manifest: Manifest to check against (default: root/SHA256SUMS)
+        threads: Files read in parallel
+
+    Returns:
+        One FileCheck per manifest entry, or None if the manifest is
+        missing or unreadable
+    """
+    if manifest is None:
+        manifest = root / MANIFEST_NAME
+    try:
+        digests = read_manifest(manifest)
+    except FileNotFoundError:
+        print_error(f"No checksum manifest: {manifest}")
+        return None
+    except (OSError, ValueError) as e:
+        print_error(f"Cannot read manifest: {e}")
+        return None
+
+    # Imported here so that package.py, which only needs the manifest
+    # helpers, does not pay for concurrent.futures at startup
+    from concurrent.futures import ThreadPoolExecutor
+
+    print_info(f"Verifying {len(digests)} file(s) in {root} against {manifest}")
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        results = list(pool.map(lambda item: check_file(root, *item), sorted(digests.items())))
+    # The tracer is not thread-safe, so the workers' reads are counted here
+    count(BYTES_READ, sum(r.bytes_read for r in results))
+
+    for result in results:
+        if result.status == 'ok':
+            print_success(f"{result.path}")
+        else:
+            detail = f": {result.detail}" if result.detail else ''
+            print_error(f"{result.path}: {result.status}{detail}")
+    for path in unlisted_files(root, digests):
+        print_warning(f"{path}: not in the manifest")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Verify a deployed USB stick against its checksum manifest',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s /media/usb                       Check the stick against its SHA256SUMS
+  %(prog)s /media/usb -m build/my-show/SHA256SUMS
+                                            Check against the build's manifest
+  %(prog)s /media/usb -j 8                  Read 8 files at a time
+        """
+    )
+
+    parser.add_argument(
+        'root',
+        type=Path,
+        help='Mount point of the stick (or a packaged output directory)'
+    )
+
+    parser.add_argument(
+        '-m', '--manifest',
+        type=Path,
+        help=f'Manifest to check against (default: ROOT/{MANIFEST_NAME})'
+    )
+
+    parser.add_argument(
+        '-j', '--threads',
+        type=int,
+        default=DEFAULT_THREADS,
+        help=f'Files to read in parallel (default: {DEFAULT_THREADS})'
+    )
+
+    add_output_options(parser)
+
+    args = parser.parse_args()
+
+    with begin_output(args) as messages:
+        results = verify_stick(args.root, args.manifest, args.threads)
+        ok = results is not None and all(r.status == 'ok' for r in results)
+        if results is not None:
+            bad = sum(r.status != 'ok' for r in results)
+            if ok:
+                print_success(f"\n✓ All {len(results)} file(s) match the manifest")
+            else:
+                print_error(f"\n{bad} of {len(results)} file(s) failed verification")
+    end_output(args, {
+        'tool': 'verify',
+        'root': str(args.root),
+        'ok': ok,
+        'files': [{'path': r.path, 'status': r.status, 'detail': r.detail}
+                  for r in results or []],
+        'messages': messages,
+    })
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
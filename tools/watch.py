@@ -0,0 +1,239 @@
+"""
+Watch the shows tree for changes to show files.
+
+Uses Linux inotify through ctypes when available and falls back to polling
+file mtimes elsewhere. Events are debounced: xLights writes a sequence in
+bursts, so a show is only reported once its files have been quiet for the
+debounce interval. Only sequence, audio and metadata.json changes are
+reported, grouped per show directory.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from utils import find_all_shows
+
+
+DEFAULT_DEBOUNCE = 0.5
+DEFAULT_POLL_INTERVAL = 1.0
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# What kind of show file a name is, or None if changes to it are ignored
+KIND_SEQUENCE = 'fseq'
+KIND_AUDIO = 'audio'
+KIND_METADATA = 'metadata'
+
+
+def file_kind(name: str) -> Optional[str]:
+    """Classify a file name as a sequence, audio or metadata file."""
+    if name.startswith('.'):
+        return None
+    if name == "metadata.json":
+        return KIND_METADATA
+    suffix = os.path.splitext(name)[1]
+    if suffix == ".fseq":
+        return KIND_SEQUENCE
+    if suffix in (".wav", ".mp3"):
+        return KIND_AUDIO
+    return None
+
+
+class InotifyWatcher:
+    """Recursive inotify watch on a shows directory and its show folders."""
+
+    def __init__(self, shows_dir: Path):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.shows_dir = Path(shows_dir)
+        self._paths = {}
+        self._add(self.shows_dir)
+        with os.scandir(self.shows_dir) as it:
+            for entry in it:
+                if entry.is_dir() and not entry.name.startswith('.'):
+                    self._add(Path(entry.path))
+
+    def _add(self, path: Path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)), WATCH_MASK)
+        if wd >= 0:
+            self._paths[wd] = path
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def wait(self, timeout: Optional[float]) -> Set[Tuple[Path, str]]:
+        """
+        Wait up to timeout seconds for events.
+
+        Returns:
+            Set of (show_dir, kind) pairs; a full rescan marker
+            (shows_dir, '*') is returned if the kernel queue overflowed
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changes = set()
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                changes.add((self.shows_dir, '*'))
+                continue
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            parent = self._paths.get(wd)
+            if parent is None:
+                continue
+
+            if parent == self.shows_dir:
+                # A new show folder: watch it and pick up files already in it
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) \
+                        and not name.startswith('.'):
+                    show_dir = parent / name
+                    self._add(show_dir)
+                    changes.add((show_dir, '*'))
+                continue
+
+            kind = file_kind(name)
+            if kind is not None:
+                changes.add((parent, kind))
+        return changes
+
+
+class PollingWatcher:
+    """Portable fallback that compares file signatures every interval."""
+
+    def __init__(self, shows_dir: Path, interval: float = DEFAULT_POLL_INTERVAL):
+        self.shows_dir = Path(shows_dir)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[Tuple[Path, str], Tuple[int, int]]:
+        snapshot = {}
+        with os.scandir(self.shows_dir) as shows:
+            for show in shows:
+                if show.name.startswith('.') or not show.is_dir():
+                    continue
+                try:
+                    with os.scandir(show.path) as it:
+                        for entry in it:
+                            if file_kind(entry.name) is None:
+                                continue
+                            st = entry.stat()
+                            key = (Path(show.path), entry.name)
+                            snapshot[key] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+        return snapshot
+
+    def close(self):
+        pass
+
+    def wait(self, timeout: Optional[float]) -> Set[Tuple[Path, str]]:
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = set()
+        for key in set(snapshot) | set(self._snapshot):
+            if snapshot.get(key) != self._snapshot.get(key):
+                show_dir, name = key
+                changed.add((show_dir, file_kind(name)))
+        self._snapshot = snapshot
+        return changed
+
+
+def create_watcher(shows_dir: Path, polling: bool = False):
+    """Return an inotify watcher, or a polling watcher if inotify is unavailable."""
+    if not polling:
+        try:
+            return InotifyWatcher(shows_dir)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(shows_dir)
+
+
+def watch_shows(shows_dir: Path, on_change: Callable[[Path, Set[str]], None],
+                debounce: float = DEFAULT_DEBOUNCE, polling: bool = False,
+                only: Optional[Path] = None):
+    """
+    Call on_change(show_dir, kinds) whenever a show's files settle after a change.
+
+    ``kinds`` holds 'fseq', 'audio' and/or 'metadata', or '*' when the whole
+    show should be rechecked. Runs until interrupted.
+
+    Args:
+        shows_dir: Directory containing the shows
+        on_change: Callback run once per changed show after the debounce
+        debounce: Seconds without events before a show is reported
+        polling: Force the mtime polling fallback
+        only: Only report changes to this show directory
+    """
+    watcher = create_watcher(shows_dir, polling)
+    pending = {}
+    last_event = 0.0
+    if only is not None:
+        only = Path(only).absolute()
+    try:
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(0.0, last_event + debounce - time.monotonic())
+            changes = watcher.wait(timeout)
+            if changes:
+                last_event = time.monotonic()
+                for show_dir, kind in changes:
+                    if (only is not None and Path(show_dir) != Path(shows_dir)
+                            and Path(show_dir).absolute() != only):
+                        continue
+                    pending.setdefault(Path(show_dir), set()).add(kind)
+                continue
+            if pending and time.monotonic() - last_event >= debounce:
+                ready, pending = pending, {}
+                if Path(shows_dir) in ready:
+                    # Events were lost; recheck every show
+                    del ready[Path(shows_dir)]
+                    for show_dir in find_all_shows(Path(shows_dir)):
+                        if only is None or show_dir.absolute() == only:
+                            ready[show_dir] = {'*'}
+                for show_dir in sorted(ready):
+                    if show_dir.is_dir():
+                        on_change(show_dir, ready[show_dir])
+    finally:
+        watcher.close()